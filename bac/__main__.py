@@ -18,6 +18,11 @@ def parse_entry_point_args():
     parser.add_argument(
             '-v', '--verbose', action='count', default=0,
             help='Verbosity level; can be specified 0-2 times')
+    parser.add_argument(
+            '--max-sessions', type=int, default=None,
+            help=('Maximum number of live profile sessions, the least'
+                  ' recently used ones are dropped and created again'
+                  ' once they are used'))
     return parser.parse_args()
 
 
@@ -26,7 +31,7 @@ def main():
     setup_logging(args.verbose)
 
     try:
-        BAC().run_cli()
+        BAC(args.max_sessions).run_cli()
     except (EOFError, KeyboardInterrupt):
         sys.exit()
     except NoProfilesError:
@@ -4,13 +4,25 @@
 import logging
 import os
 import subprocess
+import sys
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 
 from bac.constants import (EC2_REGIONS_JMES, IGNORED_ENV_VARS,
-                           PROFILE_OPTIONS, REGION_OPTIONS)
+                           PROFILE_OPTIONS, REGION_OPTIONS, TARGET_COMPLETED)
+from bac.engines import requires_subprocess
 from bac.errors import InvalidAwsCliCommandError
-from bac.utils import extract_positional_args, extract_profile, paginate
+from bac.executor import (FanOutExecutor, Target, TargetResult,
+                          log_summary)
+from bac.jobs import current_job
+from bac.multiplexer import OutputMultiplexer
+from bac.output import AggregateOutput
+from bac.result_cache import CachedCommand, classify_command, get_cache_ttl
+from bac.result_query import ResultQuery
+from bac.utils import (call_command, execute_command,
+                       extract_positional_args, extract_profile,
+                       extract_region, get_global_region, is_read_only,
+                       paginate)
 
 log = logging.getLogger(__name__)
 
@@ -23,8 +35,12 @@ class AwsCliReceiver(object):
     Commands are checked, appended with "--profile"/"--region"
     parameters as needed and finally executed by calling the underlying
     shell, where the assembled commands are handled by the aws-cli.
+    Assembled commands are executed concurrently, as limited by the
+    BAC global arguments. Instead of the shell, the commands may also
+    be executed by one of the alternative execution engines.
     """
-    def __init__(self, profile_manager, checker):
+    def __init__(self, profile_manager, checker, engines=None, store=None,
+                 last_fan_out=None, cache=None, history=None, limiter=None):
         """
         :param profile_manager: an instance of ProfileManager used
             to receive currently active regions and profiles.
@@ -33,10 +49,32 @@ class AwsCliReceiver(object):
             privilege checking of the aws-cli command before its
             execution.
         :type: bac.checker.CLIChecker
+        :param engines: Provider of the execution engines selected
+            by the "--bac-engine" global argument.
+        :type: bac.engines.EngineProvider
+        :param store: Local store of the results, used if requested
+            by the "--bac-store" global argument.
+        :type: bac.store.ResultStore
+        :param last_fan_out: Record of the last fan-out, used to rerun
+            its failed targets by the "rerun-failed" command.
+        :type: bac.rerun.LastFanOut
+        :param cache: Local cache of the results of read-only commands.
+        :type: bac.result_cache.ResultCache
+        :param history: History of the execution times of targets,
+            used to start the longest targets first.
+        :type: bac.timings.TimingHistory
+        :param limiter: Rate limiter shared by all of the fan-outs.
+        :type: bac.throttling.RateLimiter
         :rtype: None
         """
         self._profile_manager = profile_manager
         self._checker = checker
+        self._engines = engines
+        self._store = store
+        self._last_fan_out = last_fan_out
+        self._cache = cache
+        self._history = history
+        self._limiter = limiter
         self._initialize_environment()
 
     def _initialize_environment(self):
@@ -81,12 +119,14 @@ class AwsCliReceiver(object):
             log.warning('No profiles specified or active.'
                         ' Please specify or activate some profiles first.')
             return
+        elif getattr(args, 'dedupe_accounts', False) and is_read_only(command):
+            vars(args)['profiles'] = self._deduplicate_profiles(args)
 
         vars(args)['region'] = None
         # check of region is provided explicitly (--region/-r)
         if any(arg in command for arg in REGION_OPTIONS):
             vars(args)['regions'] = set()
-            region = self._extract_region(command)
+            region = extract_region(command)
             vars(args)['region'] = region
         elif not args.regions:
             vars(args)['regions'] = {'us-east-1'}
@@ -99,14 +139,172 @@ class AwsCliReceiver(object):
             return
 
         commands = self._prepare_commands(command, args)
-        self._run(commands)
+        self._run(command, commands, args)
 
-    def _run(self, commands):
-        for data in commands:
-            cmd, profile, region = data
-            log.info('Executing for: Profile=%s,  Region=%s, Command:\n"%s"'
-                     % (profile, region, ' '.join(cmd)))
-            subprocess.call(cmd, env=self._env)
+    def _run(self, command, commands, args):
+        targets = [Target(*data) for data in commands]
+        results = self._dispatch(command, targets, args)
+        if self._last_fan_out is not None:
+            self._last_fan_out.record(
+                    ' '.join(command), results,
+                    lambda targets: self._dispatch(command, targets, args))
+        return results
+
+    def _dispatch(self, command, targets, args):
+        classified = None
+        if self._cache is not None and get_cache_ttl(args):
+            classified = classify_command(self._checker, command)
+        try:
+            return self._dispatch_targets(command, targets, args, classified)
+        finally:
+            if classified is not None and not classified[1]:
+                # Cached results of the service may be outdated now
+                self._cache.invalidate(classified[0])
+
+    def _dispatch_targets(self, command, targets, args, classified=None):
+        engine = self._get_engine(args)
+        # The targets use the cached credentials of the assumed roles
+        self._profile_manager.assume_roles(
+                target.profile for target in targets)
+        account_names = self._profile_manager.account_names
+        executor = FanOutExecutor.from_args(args, account_names,
+                                            self._history, self._limiter)
+        job = current_job()
+        if job is not None:
+            job.attach(executor)
+        query = ResultQuery.from_args(args, account_names)
+        output = multiplexer = None
+        if query is None:
+            output = AggregateOutput.from_args(args, account_names)
+        if query is None and output is None:
+            multiplexer = OutputMultiplexer.from_args(args, targets)
+        run = self._start_run(command, args, account_names)
+        cache = self._get_cache(args, classified)
+        # Stored and cached results have to be captured, and printed
+        # afterwards. So does the output of background jobs, which
+        # must not be printed right into the terminal.
+        capture = any(x is not None for x in (query, output, run, cache,
+                                              job))
+        echo = capture and query is None and output is None
+
+        def on_result(result):
+            if run is not None:
+                run.add(result)
+            if output is not None:
+                output.write(result)
+
+        if output is not None:
+            output.open()
+        try:
+            results = executor.run(
+                    targets,
+                    lambda target: self._execute_target(
+                            target, engine, capture, multiplexer, echo,
+                            cache),
+                    on_result=on_result)
+        finally:
+            if output is not None:
+                output.close()
+            if multiplexer is not None:
+                multiplexer.close()
+            if run is not None:
+                run.finish()
+        self._report(results)
+        if query is not None:
+            query.write(results)
+        return results
+
+    def _start_run(self, command, args, account_names):
+        if self._store is None or not getattr(args, 'store', False):
+            return None
+        return self._store.start_run('aws', ' '.join(command), account_names)
+
+    def _get_cache(self, args, classified):
+        if classified is None or not classified[2]:
+            return None
+        return CachedCommand(self._cache, classified[0], get_cache_ttl(args))
+
+    def _get_engine(self, args):
+        if self._engines is None:
+            return None
+        return self._engines.get_engine(args)
+
+    def _execute_target(self, target, engine=None, capture=False,
+                        multiplexer=None, echo=False, cache=None):
+        try:
+            result = cache.get(target) if cache is not None else None
+            if result is None:
+                log.info('Executing for: Profile=%s,  Region=%s,'
+                         ' Command:\n"%s"'
+                         % (target.profile, target.region,
+                            ' '.join(target.command)))
+                result = self._execute(target, engine, capture, multiplexer)
+                if cache is not None:
+                    cache.put(result)
+            if echo:
+                self._echo(result, multiplexer)
+            return result
+        finally:
+            if multiplexer is not None:
+                multiplexer.finish(target)
+
+    def _echo(self, result, multiplexer=None):
+        if multiplexer is not None:
+            multiplexer.feed(result.target, result.out, result.err)
+            return
+        if result.out:
+            sys.stdout.write(result.out)
+        if result.err:
+            sys.stderr.write(result.err)
+
+    def _execute(self, target, engine, capture, multiplexer):
+        if requires_subprocess(target.command):
+            # Interactive commands are never captured
+            exit_code = subprocess.call(target.command, env=self._env)
+            return TargetResult(target, exit_code)
+        if engine is None and capture:
+            # Background jobs must not be interrupted by Ctrl-C
+            out, err, exit_code = execute_command(
+                    target.command, target.remaining(), env=self._env,
+                    cancelled=target.cancelled,
+                    new_session=current_job() is not None)
+            return TargetResult(target, exit_code, out, err)
+        if engine is None and multiplexer is not None:
+            exit_code = multiplexer.execute(target, env=self._env)
+            return TargetResult(target, exit_code)
+        if engine is None and target.deadline is None:
+            # Interrupted together with BAC by the terminal
+            exit_code = subprocess.call(target.command, env=self._env)
+            return TargetResult(target, exit_code)
+        if engine is None:
+            exit_code = call_command(target.command, target.remaining(),
+                                     self._env, target.cancelled)
+            return TargetResult(target, exit_code)
+
+        result = engine.execute(target, target.remaining())
+        if not capture:
+            self._echo(result, multiplexer)
+        return result
+
+    def _report(self, results):
+        for result in results:
+            if (result is None or not result.failed
+                    or result.status != TARGET_COMPLETED):
+                continue
+            target = result.target
+            log.warning('Command for Profile=%s, Region=%s ended with'
+                        ' following non-zero exit code: %s'
+                        % (target.profile, target.region, result.exit_code))
+        log_summary(results)
+
+    def _deduplicate_profiles(self, args):
+        profiles = self._profile_manager.deduplicate_profiles(
+                args.profiles, getattr(args, 'account_preferences', None))
+        skipped = set(args.profiles).difference(profiles)
+        if skipped:
+            log.info('Executing once per account, skipping profiles: %s'
+                     % ', '.join(sorted(skipped)))
+        return profiles
 
     def _check(self, command, args):
         # These may end command execution by raising an exception
@@ -128,6 +326,17 @@ class AwsCliReceiver(object):
 
     def _apply_regions(self, command, args, profile):
         commands = list()
+        global_region = self._get_global_region(command, args)
+        if global_region is not None:
+            # Same results in every region, no need to filter regions
+            log.debug('Command "%s" is global, executing it in "%s" only.'
+                      % (' '.join(command), global_region))
+            if args.region:
+                return [(command, profile, args.region)]
+            cmd = list(command)
+            cmd.extend(['--region', global_region])
+            return [(cmd, profile, global_region)]
+
         regions = set(args.region) if args.region else args.regions
         regions = self._filter_regions(regions, command, profile)
 
@@ -142,6 +351,15 @@ class AwsCliReceiver(object):
             commands.append(data)
         return commands
 
+    def _get_global_region(self, command, args):
+        region = get_global_region(command)
+        if region is None or args.region:
+            return region
+        if region in args.regions:
+            return region
+        # Keep the output labeled by one of the active regions
+        return sorted(args.regions)[0]
+
     def _check_privileges(self, operation, args):
         # Could be parallel (needs to use clients, not sessions)
         if not args.profiles:
@@ -153,7 +371,7 @@ class AwsCliReceiver(object):
     def _filter_regions(self, regions, command, profile):
         try:
             filtered = self._filter(regions, command, profile)
-        except ClientError as e:
+        except (BotoCoreError, ClientError) as e:
             if ('UnauthorizedOperation' in str(e)
                 or 'AccessDeniedException' in str(e)):
                 log.warning(
@@ -213,12 +431,6 @@ class AwsCliReceiver(object):
             msg = 'Invalid profile given: "%s"' % profile
             raise InvalidAwsCliCommandError(msg)
 
-    def _extract_region(self, command):
-        iter_command = iter(command)
-        for argument in iter_command:
-            if argument in REGION_OPTIONS:
-                return next(iter_command, None)
-
     def _extract_service_name(self, command):
         cmd = extract_positional_args(command)
         service_name = cmd[1]
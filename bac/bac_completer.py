@@ -35,6 +35,12 @@ COMMANDS_MAP = {
         'switch-regions': None,
         'include-regions': None,
         'exclude-regions': None,
+        'list-runs': None,
+        'query-results': None,
+        'rerun-failed': None,
+        'jobs': None,
+        'fg': None,
+        'kill': None,
 }
 
 
@@ -44,35 +50,57 @@ class BACCompleter(Completer):
 
     This is achieved with help of other subcompleters. Initialization
     of the subcompleters as well as the correct delegation of work to
-    them is managed within this class.
+    them is managed within this class. If the loader is given, the
+    subcompleters are initialized in the background and no completions
+    are provided until they are ready.
     """
 
-    def __init__(self, profile_manager):
+    def __init__(self, profile_manager, loader=None):
         """
         :param profile_manager: an instance of ProfileManager used
             to receive currently active regions and profiles.
         :type: bac.profile_manager.ProfileManager
+        :param loader: Loader, which initializes the subcompleters
+            in the background.
+        :type: bac.loader.BackgroundLoader
         :rtype: None
         """
         self._profile_manager = profile_manager
         self._fuzzy = True
+        self._query_context = None
+        self._loader = loader
+        self._initialized = False
+        if loader is None:
+            self._initialize()
+        else:
+            loader.start('completions', self._initialize)
+
+    def _initialize(self):
         self._init_subcompleters()
         self._nested_completer = NestedCompleter.from_nested_dict(COMMANDS_MAP)
         self._cache = CacheProvider(self._profile_manager)
-        self._query_context = None
+        self._initialized = True
 
-    def _init_subcompleters(self):
-        log.debug('Initializing completers')
+    def _wait(self):
+        if self._loader is not None:
+            self._loader.wait('completions')
+
+    def _get_profile_words(self):
         profile_names = sorted(text_type(name) for name
                                in self._profile_manager.sessions.keys())
-        region_names = sorted(text_type(name) for name
-                              in self._profile_manager.available_regions)
-
         profile_meta_dict = {
               text_type(profile): text_type(account_name)
               for profile, account_name
               in self._profile_manager.account_names.items()
         }
+        return profile_names, profile_meta_dict
+
+    def _init_subcompleters(self):
+        log.debug('Initializing completers')
+        profile_names, profile_meta_dict = self._get_profile_words()
+        region_names = sorted(text_type(name) for name
+                              in self._profile_manager.available_regions)
+
         profile_completer = WordCompleter(
                 profile_names, WORD=True, meta_dict=profile_meta_dict)
         self._profile_completer = FuzzyCompleter(profile_completer,
@@ -108,20 +136,40 @@ class BACCompleter(Completer):
         support fuzzy completions.
         """
         log.debug('Toggling fuzzy completion.')
+        self._wait()
         self._fuzzy = not self._fuzzy
         self._profile_completer.enable_fuzzy = to_filter(self._fuzzy)
         self._region_completer.enable_fuzzy = to_filter(self._fuzzy)
         self._cache_completer.enable_fuzzy = to_filter(self._fuzzy)
         self._aws_completer.toggle_fuzzy()
 
+    def refresh_profiles(self):
+        """
+        Update the profile completions after the profiles are reloaded.
+
+        Account names of the reloaded profiles may still be loading,
+        so the completions are updated in the background, if possible.
+        """
+        self._wait()
+        if self._loader is None:
+            self._refresh_profiles()
+        else:
+            self._loader.start('completions', self._refresh_profiles)
+
+    def _refresh_profiles(self):
+        completer = self._profile_completer.completer
+        completer.words, completer.meta_dict = self._get_profile_words()
+
     def toggle_cache(self):
         """Toggle cached resource completion on/off."""
+        self._wait()
         self._cache.toggle_cache()
 
     def refresh_cache(self):
         """
         Refresh all of resource cache for every active profile/region.
         """
+        self._wait()
         log.info('Refreshing resource cache...')
         self._cache.refresh_cache()
         log.info('Cache refreshed.')
@@ -141,6 +189,9 @@ class BACCompleter(Completer):
         :type Document
         :rtype None
         """
+        if not self._initialized:
+            return
+
         text = document.text_before_cursor
         words = text.split()
         word = document.get_word_before_cursor(WORD=True)
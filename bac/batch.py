@@ -8,11 +8,20 @@ import yaml
 
 from six import text_type
 
+from bac.engines import requires_subprocess
 from bac.errors import (ArgumentParserDoneException, BACError,
                         InvalidArgumentException, TimeoutException,
                         BatchJobSyntaxException)
+from bac.constants import TARGET_TIMED_OUT
+from bac.executor import (FanOutExecutor, Target, TargetResult,
+                          log_summary)
+from bac.jobs import current_job
+from bac.output import AggregateOutput
 from bac.parser import Parser
-from bac.utils import ArgumentParser, execute_command, extract_profile
+from bac.result_cache import classify_command, get_cache_ttl
+from bac.result_query import ResultQuery
+from bac.utils import (ArgumentParser, execute_command, extract_profile,
+                       extract_region)
 
 log = logging.getLogger(__name__)
 
@@ -21,7 +30,10 @@ class CommandBatch(object):
     """
     Encapsulates the parse and execution of predefined command batch.
     """
-    def __init__(self, global_args, argv, checker):
+    def __init__(self, global_args, argv, checker, engines=None,
+                 account_names=None, store=None, last_fan_out=None,
+                 cache=None, history=None, assume_roles=None,
+                 limiter=None):
         """
         :param global_args: Namespace which contains BAC global
             arguments such as "--bac-dry-run".
@@ -31,11 +43,42 @@ class CommandBatch(object):
         :type list
         :param checker: The checker object used for command checking.
         :type bac.checker.CLIChecker
+        :param engines: Provider of the execution engines selected
+            by the "--bac-engine" global argument.
+        :type bac.engines.EngineProvider
+        :param account_names: Account names of the profiles, used
+            to annotate the aggregate output.
+        :type dict
+        :param store: Local store of the results, used if requested
+            by the "--bac-store" global argument.
+        :type bac.store.ResultStore
+        :param last_fan_out: Record of the last fan-out, used to rerun
+            its failed commands by the "rerun-failed" command.
+        :type bac.rerun.LastFanOut
+        :param cache: Local cache of the results of read-only commands,
+            which is invalidated by the modifying commands.
+        :type bac.result_cache.ResultCache
+        :param history: History of the execution times of commands,
+            used to start the longest commands first.
+        :type bac.timings.TimingHistory
+        :param assume_roles: Callable, which assumes the roles of the
+            profiles of the commands before they are executed.
+        :type callable
+        :param limiter: Rate limiter shared by all of the fan-outs.
+        :type bac.throttling.RateLimiter
         :rtype None
         """
         self._global_args = global_args
         self._args = self._parse_args(argv)
         self._checker = checker
+        self._engines = engines
+        self._account_names = account_names
+        self._store = store
+        self._last_fan_out = last_fan_out
+        self._cache = cache
+        self._history = history
+        self._assume_roles = assume_roles
+        self._limiter = limiter
         self._parser = Parser()
         self._commands = list()
         self._run()
@@ -51,7 +94,7 @@ class CommandBatch(object):
         argv = argv[1:]
 
         description = ('Parses a YAML defined command batch definition'
-                       ' and then sequentially executes assembled commands.')
+                       ' and then concurrently executes assembled commands.')
         parser = ArgumentParser(description=description)
         parser.add_argument(
                 'path', type=str, help='Path to the batch command definition')
@@ -89,22 +132,113 @@ class CommandBatch(object):
             log.debug('Dry running only, check finished.')
             return
 
-        for command in self._commands:
-            log.info('Executing command: "%s"' % command)
-            try:
-                out, err, exit_code = execute_command(command, timeout)
-            except TimeoutException:
-                log.error('Timeout of %s seconds reached when executing'
-                          ' following command:\n%s' % (timeout, command))
-                continue
-
-            if exit_code:
-                log.warning('Command "%s" ended with following non-zero exit'
-                            ' code: %s' % (command, exit_code))
-                if err:
-                    log.error('An error occured: "%s"' % text_type(err))
-            if out:
-                print(out)
+        targets = [Target(command, extract_profile(command),
+                          extract_region(command))
+                   for command in self._commands]
+        results = self._execute_targets(targets, timeout)
+        if self._last_fan_out is not None:
+            self._last_fan_out.record(
+                    'batch-command %s' % self._args.path, results,
+                    lambda targets: self._execute_targets(targets, timeout))
+        return results
+
+    def _execute_targets(self, targets, timeout):
+        services = self._get_modified_services(targets)
+        try:
+            return self._execute_all(targets, timeout)
+        finally:
+            for service in services:
+                # Cached results of the service may be outdated now
+                self._cache.invalidate(service)
+
+    def _get_modified_services(self, targets):
+        if self._cache is None or not get_cache_ttl(self._global_args):
+            return set()
+        services = set()
+        for target in targets:
+            classified = classify_command(self._checker, target.command)
+            if classified is not None and not classified[1]:
+                services.add(classified[0])
+        return services
+
+    def _execute_all(self, targets, timeout):
+        engine = None
+        if self._engines is not None:
+            engine = self._engines.get_engine(self._global_args)
+        if self._assume_roles is not None:
+            self._assume_roles(target.profile for target in targets)
+        executor = FanOutExecutor.from_args(
+                self._global_args, self._account_names, self._history,
+                self._limiter)
+        job = current_job()
+        if job is not None:
+            job.attach(executor)
+        query = ResultQuery.from_args(self._global_args, self._account_names)
+        output = None
+        if query is None:
+            output = AggregateOutput.from_args(
+                    self._global_args, self._account_names)
+        run = self._start_run()
+
+        def on_result(result):
+            if run is not None:
+                run.add(result)
+            if output is not None:
+                output.write(result)
+
+        if output is not None:
+            output.open()
+        try:
+            results = executor.run(
+                    targets,
+                    lambda target: self._execute_target(
+                            target, timeout, engine,
+                            capture=query is not None or output is not None),
+                    on_result=on_result)
+        finally:
+            if output is not None:
+                output.close()
+            if run is not None:
+                run.finish()
+        log_summary(results)
+        if query is not None:
+            query.write(results)
+        return results
+
+    def _start_run(self):
+        if self._store is None or not getattr(self._global_args, 'store',
+                                              False):
+            return None
+        return self._store.start_run(
+                'batch-command', 'batch-command %s' % self._args.path,
+                self._account_names)
+
+    def _execute_target(self, target, timeout, engine=None, capture=False):
+        command = target.command
+        timeout = target.remaining(timeout)
+        log.info('Executing command: "%s"' % command)
+        try:
+            if engine is None or requires_subprocess(command):
+                # Background jobs must not be interrupted by Ctrl-C
+                out, err, exit_code = execute_command(
+                        command, timeout, cancelled=target.cancelled,
+                        new_session=current_job() is not None)
+            else:
+                result = engine.execute(target, timeout)
+                out, err, exit_code = result.out, result.err, result.exit_code
+        except TimeoutException:
+            log.error('Timeout of %s seconds reached when executing'
+                      ' following command:\n%s' % (timeout, command))
+            return TargetResult(target, None, status=TARGET_TIMED_OUT)
+
+        if exit_code:
+            log.warning('Command "%s" ended with following non-zero exit'
+                        ' code: %s' % (command, exit_code))
+            if err:
+                log.error('An error occured: "%s"' % text_type(err))
+        if out and not capture:
+            print(out)
+        return TargetResult(target, exit_code, out, err)
 
     def _load_batch_command(self, path):
         path = os.path.expanduser(path)
@@ -4,13 +4,16 @@
 import logging
 
 from awscli.argparser import MainArgParser
+from awscli.argprocess import ParamError
 from awscli.arguments import CustomArgument, UnknownArgumentError
+from botocore import xform_name
 from botocore.exceptions import BotoCoreError, ClientError
-from botocore.session import Session
 
-from bac.data_tables import build_command_table, build_argument_table
+from bac.data_tables import (build_command_table, build_argument_table,
+                             is_quiet, quiet_parsers)
 from bac.errors import (ArgumentParserDoneException, BACError,
                         CLICheckerSyntaxError, CLICheckerPermissionException)
+from bac.models import Session
 
 log = logging.getLogger(__name__)
 
@@ -48,6 +51,11 @@ class CLIChecker(object):
         self._sessions[profile] = session
         return session
 
+    def reload(self):
+        """Drop the sessions of the profiles, once the profiles change."""
+        # The session loading the AWS service data is kept
+        self._sessions = dict()
+
     def _get_profile_session(self, profile):
         if profile not in self._sessions:
             self._sessions[profile] = Session(profile=profile)
@@ -112,13 +120,7 @@ class CLIChecker(object):
         """
         log.debug('Syntax checking following aws command: %s' % args)
         command_table = self.command_table
-        try:
-            parsed_args, remaining = self.parser.parse_known_args(args)
-        except ArgumentParserDoneException:
-            msg = ('When parsing awscli global optional arguments and service'
-                   ' an exception was raised with following arguments: %s '
-                   % args)
-            raise CLICheckerSyntaxError(msg)
+        parsed_args, remaining = self._parse_globals(args)
 
         # Syntax and permission check for awscli s3 commands not supported.
         if parsed_args.command == 's3':
@@ -141,6 +143,59 @@ class CLIChecker(object):
         operation = '%s:%s' % (command, action_name)
         return operation
 
+    def resolve(self, args):
+        """
+        Resolve recieved aws-cli command into a botocore operation call.
+
+        The command is parsed the same way as within the check method,
+        but instead of the operation name, everything that is needed
+        to call the operation directly is returned.
+
+        :param args: received aws-cli command arguments
+        :type: list
+        :rtype: bac.checker.OperationCall or None, if the command
+            is not a botocore operation (e.g. "aws s3 ls")
+        """
+        # Failures are handled by the callers, nothing is printed
+        with quiet_parsers():
+            return self._resolve(args)
+
+    def _resolve(self, args):
+        parsed_args, remaining = self._parse_globals(args)
+        if parsed_args.command == 's3':
+            return
+
+        command = parsed_args.command
+        service_command = self.command_table[command]
+        name = remaining[0] if remaining else None
+        operation = service_command.command_table.get(name)
+        if operation is None:
+            msg = ('Invalid %s operation given: "%s"' % (command, name))
+            raise CLICheckerSyntaxError(msg)
+
+        try:
+            parameters = operation.build_call_parameters(remaining[1:])
+        except ArgumentParserDoneException:
+            msg = ('When parsing %s arguments, an exception was raised'
+                   ' with following arguments: %s ' % (command, args))
+            raise CLICheckerSyntaxError(msg)
+        except (ParamError, UnknownArgumentError, ValueError) as e:
+            raise CLICheckerSyntaxError(str(e))
+
+        return OperationCall(operation.service_name,
+                             operation.operational_name,
+                             parameters, parsed_args,
+                             operation.operation_model)
+
+    def _parse_globals(self, args):
+        try:
+            return self.parser.parse_known_args(args)
+        except ArgumentParserDoneException:
+            msg = ('When parsing awscli global optional arguments and service'
+                   ' an exception was raised with following arguments: %s '
+                   % args)
+            raise CLICheckerSyntaxError(msg)
+
     def privilege_check(self, operation, profile):
         """
         Check if profile has sufficient privileges to execute command.
@@ -196,6 +251,39 @@ class CLIChecker(object):
         raise CLICheckerPermissionException(msg)
 
 
+class OperationCall(object):
+    """
+    Botocore operation call resolved from an aws-cli command.
+    """
+    def __init__(self, service_name, operation_name, parameters,
+                 parsed_globals, operation_model=None):
+        """
+        :param service_name: Botocore name of the called service.
+        :type: str
+        :param operation_name: Name of the called operation,
+            e.g. "DescribeInstances".
+        :type: str
+        :param parameters: Parameters of the operation call.
+        :type: dict
+        :param parsed_globals: Parsed aws-cli global arguments,
+            such as "--query" or "--output".
+        :type: argparse.Namespace
+        :param operation_model: Botocore model of the operation.
+        :type: botocore.model.OperationModel
+        :rtype: None
+        """
+        self.service_name = service_name
+        self.operation_name = operation_name
+        self.parameters = parameters
+        self.parsed_globals = parsed_globals
+        self.operation_model = operation_model
+
+    @property
+    def method_name(self):
+        """Name of the operation method of a boto3 client."""
+        return xform_name(self.operation_name)
+
+
 class BACMainArgParser(MainArgParser):
     """
     Overrides the exit method of the argparse.ArgumentParser.
@@ -204,3 +292,7 @@ class BACMainArgParser(MainArgParser):
     """
     def exit(self, status=0, message=None):
         raise ArgumentParserDoneException(message)
+
+    def _print_message(self, message, file=None):
+        if not is_quiet():
+            super(BACMainArgParser, self)._print_message(message, file)
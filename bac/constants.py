@@ -4,12 +4,17 @@
 import jmespath
 
 
+AWSCLI_ERROR_EXIT_CODE = 255
+
 BAC_PROMPT = '~> '
 
 BAC_HISTORY = '.history'
 
 BATCH_JOB_SECTIONS = {'command', 'optionals'}
 
+BOTO3_ENGINE_OPTIONS = {'command', 'endpoint_url', 'output', 'paginate',
+                        'profile', 'query', 'region', 'verify_ssl'}
+
 CLI_OPTION_HAS_ARGS = {
         '--debug': False,
         '--endpoint-url': True,
@@ -35,12 +40,64 @@ CONFIG_PATH = '~/.aws/config'
 CREDS_FILE = 'AWS_SHARED_CREDENTIALS_FILE'
 CREDS_PATH = '~/.aws/credentials'
 
+DEFAULT_WORKERS = 8
+
 EC2_REGIONS_JMES = jmespath.compile('Regions[].RegionName')
 
+ENGINE_BOTO3 = 'boto3'
+ENGINE_FORKSERVER = 'forkserver'
+ENGINE_IN_PROCESS = 'in-process'
+ENGINE_SUBPROCESS = 'subprocess'
+ENGINES = [ENGINE_SUBPROCESS, ENGINE_FORKSERVER, ENGINE_IN_PROCESS,
+           ENGINE_BOTO3]
+
+EXECUTOR_CANCEL_GRACE = 5
+EXECUTOR_POLL_INTERVAL = 0.1
+
+FORKSERVER_READY = 'ready'
+FORKSERVER_START_TIMEOUT = 30
+
+GLOBAL_ENDPOINT_REGION = 'us-east-1'
+# Operations of regional services, which return the same results
+# in every region
+GLOBAL_OPERATIONS = {('s3', 'ls'), ('s3api', 'list-buckets')}
+
+IDENTITY_CACHE_PATH = '~/.bac/identities.db'
+IDENTITY_CACHE_TTL = 24 * 60 * 60
+
 IGNORED_ENV_VARS = {'AWS_ACCESS_KEY_ID', 'AWS_PROFILE',
                     'AWS_ROLE_SESSION_NAME', 'AWS_SECRET_ACCESS_KEY',
                     'AWS_SESSION_TOKEN'}
 
+JOB_COMMANDS = {
+        'jobs': 'List background jobs and their progress',
+        'fg': 'Print the output of a background job until it finishes',
+        'kill': 'Cancel all of the targets of a background job',
+        }
+
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_KILLED = 'killed'
+JOB_RUNNING = 'running'
+
+MULTIPLEXER_BUFFER_SIZE = 1024 * 1024
+MULTIPLEXER_READ_SIZE = 64 * 1024
+
+OUTPUT_FORMAT_JSON = 'json'
+OUTPUT_FORMAT_JSONL = 'jsonl'
+OUTPUT_FORMATS = [OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_JSONL]
+
+PREFIX_ORDER_AS_COMPLETED = 'as-completed'
+PREFIX_ORDER_DETERMINISTIC = 'ordered'
+PREFIX_ORDERS = [PREFIX_ORDER_AS_COMPLETED, PREFIX_ORDER_DETERMINISTIC]
+
+PROFILE_DISCOVERY_CONNECT_TIMEOUT = 5
+# Profiles asked to list the organization accounts at once
+PROFILE_DISCOVERY_ORGANIZATION_PROBES = 4
+PROFILE_DISCOVERY_READ_TIMEOUT = 10
+PROFILE_DISCOVERY_RETRIES = 2
+PROFILE_DISCOVERY_WORKERS = 16
+
 PROFILE_OPTIONS = {'-p', '--profile'}
 
 PROFILE_MANAGER_COMMANDS = {
@@ -61,6 +118,74 @@ PROFILE_MANAGER_COMMANDS = {
 
 PROFILE_COMMANDS = ['switch-profiles', 'include-profiles', 'exclude-profiles']
 
+QUERY_POOL_THRESHOLD = 4 * 1024 * 1024
+QUERY_SHARDS_PER_PROCESS = 4
+
+READ_ONLY_OPERATIONS = ('Describe', 'Get', 'List')
+READ_ONLY_PREFIXES = ('describe-', 'get-', 'list-')
+
 REGION_COMMANDS = ['switch-regions', 'include-regions', 'exclude-regions']
 
 REGION_OPTIONS = {'-r', '--region'}
+
+RERUN_COMMANDS = {
+        'rerun-failed': 'Re-execute only the failed profiles and regions'
+                        ' of the last command',
+        }
+
+RESULT_CACHE_MAX_AGE = 24 * 60 * 60
+RESULT_CACHE_PATH = '~/.bac/cache.db'
+RESULT_CACHE_TTL = 0
+
+RESULT_STORE_COMMANDS = {
+        'list-runs': 'List the most recent stored fan-out runs',
+        'query-results': 'Print stored results of a fan-out run',
+        }
+
+RESULT_STORE_PATH = '~/.bac/results.db'
+
+# Credential cache of the assumed roles, which is read by the aws-cli
+ROLE_CREDENTIALS_CACHE_PATH = '~/.aws/cli/cache'
+# The aws-cli assumes the role again, once the cached credentials
+# expire in less than 15 minutes
+ROLE_CREDENTIALS_REFRESH_AHEAD = 20 * 60
+# Short role sessions are refreshed ahead by this fraction of their lifetime
+ROLE_CREDENTIALS_REFRESH_FRACTION = 0.25
+ROLE_CREDENTIALS_REFRESH_INTERVAL = 60
+
+# Operations returning secrets, which are not marked as sensitive
+# by their botocore models
+SECRET_OPERATIONS = {
+        ('apigateway', 'GetApiKey'),
+        ('apigateway', 'GetApiKeys'),
+        ('ecr', 'GetAuthorizationToken'),
+        ('ecr-public', 'GetAuthorizationToken'),
+        ('lightsail', 'GetInstanceAccessDetails'),
+        }
+
+SUBPROCESS_ONLY_COMMANDS = {'configure', 'help'}
+
+TARGET_CANCELLED = 'cancelled'
+TARGET_COMPLETED = 'completed'
+TARGET_TIMED_OUT = 'timed out'
+
+THROTTLING_DECREASE_FACTOR = 0.5
+# Error codes retried by botocore as throttling errors
+THROTTLING_ERRORS = {'BandwidthLimitExceeded', 'EC2ThrottledException',
+                     'LimitExceededException', 'PriorRequestNotComplete',
+                     'ProvisionedThroughputExceededException',
+                     'RequestLimitExceeded', 'RequestThrottled',
+                     'RequestThrottledException', 'SlowDown',
+                     'ThrottledException', 'Throttling',
+                     'ThrottlingException', 'TooManyRequestsException',
+                     'TransactionInProgressException'}
+THROTTLING_LATENCY_FACTOR = 3
+THROTTLING_LATENCY_SMOOTHING = 0.3
+
+TIMING_HISTORY_MAX_AGE = 30 * 24 * 60 * 60
+TIMING_HISTORY_MAX_ENTRIES = 10000
+TIMING_HISTORY_PATH = '~/.bac/timings.db'
+TIMING_HISTORY_SMOOTHING = 0.5
+
+# Keeps the progress of background jobs in the toolbar up to date
+TOOLBAR_REFRESH_INTERVAL = 0.5
@@ -15,18 +15,46 @@ classes. In this module, they are rewritten in order to prevent
 various side-effects that succeed the calls of __call__ methods.
 """
 
+import contextlib
 import logging
+import threading
 
 from awscli.argparser import ArgTableArgParser, ServiceArgParser
+from awscli.argprocess import ParamShorthandParser
 from awscli.arguments import CustomArgument, UnknownArgumentError
 from awscli.clidriver import ServiceCommand, ServiceOperation
 from botocore import xform_name
 from botocore.compat import copy_kwargs, OrderedDict
+from botocore.hooks import HierarchicalEmitter
 
 from bac.errors import ArgumentParserDoneException
 
 log = logging.getLogger(__name__)
 
+# Only the shorthand syntax handler is registered to this emitter,
+# to unpack arguments as the aws-cli does, but without any other
+# side-effects of the aws-cli handlers.
+_ARGUMENT_EMITTER = HierarchicalEmitter()
+
+# Parsers of the quiet threads do not print their usage and errors
+_quiet = threading.local()
+_ARGUMENT_EMITTER.register('process-cli-arg', ParamShorthandParser())
+
+
+@contextlib.contextmanager
+def quiet_parsers():
+    """Suppress usage and error messages of the parsers in this thread."""
+    _quiet.enabled = True
+    try:
+        yield
+    finally:
+        _quiet.enabled = False
+
+
+def is_quiet():
+    """Whether the parsers of this thread are quiet."""
+    return getattr(_quiet, 'enabled', False)
+
 
 def build_command_table(session):
     """
@@ -120,14 +148,38 @@ class BACServiceOperation(ServiceOperation):
     def operational_name(self):
         return self._operation_model.name
 
+    @property
+    def service_name(self):
+        return self._operation_model.service_model.service_name
+
+    @property
+    def operation_model(self):
+        return self._operation_model
+
     def __call__(self, args, _):
+        self._parse_operation_args(args)
+        return self.operational_name
+
+    def build_call_parameters(self, args):
+        """
+        Convert the operation arguments to botocore call parameters.
+        """
+        parsed_args = vars(self._parse_operation_args(args))
+        parameters = dict()
+        for arg_object in self.arg_table.values():
+            if arg_object.py_name in parsed_args:
+                value = parsed_args[arg_object.py_name]
+                arg_object.add_to_params(parameters, value)
+        return parameters
+
+    def _parse_operation_args(self, args):
         operation_parser = self._create_operation_parser(self.arg_table)
         self._add_help(operation_parser)
         parsed_args, remaining = operation_parser.parse_known_args(args)
         if remaining:
             raise UnknownArgumentError(
                 'Unknown options: %s' % ', '.join(remaining))
-        return self.operational_name
+        return parsed_args
 
     def _create_argument_table(self):
         argument_table = OrderedDict()
@@ -150,7 +202,7 @@ class BACServiceOperation(ServiceOperation):
                 is_required=is_required,
                 operation_model=self._operation_model,
                 serialized_name=arg_name,
-                event_emitter=None)
+                event_emitter=_ARGUMENT_EMITTER)
             arg_object.add_to_arg_table(argument_table)
         return argument_table
 
@@ -161,13 +213,21 @@ class BACServiceOperation(ServiceOperation):
 
 class BACServiceArgParser(ServiceArgParser):
     def exit(self, status=0, message=None):
-        if message:
+        if message and not is_quiet():
             log.error(message)
         raise ArgumentParserDoneException()
 
+    def _print_message(self, message, file=None):
+        if not is_quiet():
+            super(BACServiceArgParser, self)._print_message(message, file)
+
 
 class BACArgTableArgParser(ArgTableArgParser):
     def exit(self, status=0, message=None):
-        if message:
+        if message and not is_quiet():
             log.error(message)
         raise ArgumentParserDoneException()
+
+    def _print_message(self, message, file=None):
+        if not is_quiet():
+            super(BACArgTableArgParser, self)._print_message(message, file)
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+"""
+Execution engines of aws-cli commands.
+
+By default, every aws-cli command is executed in a separate aws-cli
+process. The engines in this module provide alternative ways of
+executing the assembled fan-out targets, which avoid the startup
+costs of a new aws-cli interpreter.
+"""
+import copy
+import json
+import logging
+import os
+import sys
+import threading
+
+from collections import defaultdict
+
+import jmespath
+
+from awscli import __version__ as awscli_version
+from awscli.clidriver import CLIDriver
+from awscli.plugin import load_plugins
+from awscli.utils import json_encoder
+from botocore import __version__ as botocore_version
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from six import StringIO, string_types
+
+from bac import forkserver, models
+from bac.constants import (AWSCLI_ERROR_EXIT_CODE, BOTO3_ENGINE_OPTIONS,
+                           DEFAULT_WORKERS, ENGINE_BOTO3, ENGINE_FORKSERVER,
+                           ENGINE_IN_PROCESS, ENGINE_SUBPROCESS,
+                           IGNORED_ENV_VARS, PROFILE_OPTIONS, REGION_OPTIONS,
+                           SUBPROCESS_ONLY_COMMANDS)
+from bac.errors import BACError
+from bac.executor import TargetResult
+from bac.jobs import current_job
+from bac.utils import execute_command, extract_positional_args
+
+log = logging.getLogger(__name__)
+
+
+def requires_subprocess(command):
+    """
+    Check whether the command can only be executed by the aws-cli
+    running in a separate process, e.g. "aws ec2 help", or whether it
+    streams binary data through the standard streams, e.g.
+    "aws s3 cp s3://bucket/key -".
+    """
+    positionals = extract_positional_args(command)
+    if positionals[1:2] == ['s3'] and '-' in positionals[3:]:
+        return True
+    return any(arg in SUBPROCESS_ONLY_COMMANDS for arg in positionals)
+
+
+class EngineProvider(object):
+    """
+    Creates and holds execution engines selected by "--bac-engine".
+
+    Engines are created lazily and reused by all subsequent commands.
+    No engine is provided for the default "subprocess" execution,
+    which is handled by the callers themselves.
+    """
+    def __init__(self, profile_manager, checker):
+        """
+        :param profile_manager: an instance of ProfileManager used
+            to receive the sessions of loaded profiles.
+        :type: bac.profile_manager.ProfileManager
+        :param checker: The checker object used to resolve aws-cli
+            commands into botocore operations.
+        :type: bac.checker.CLIChecker
+        :rtype: None
+        """
+        self._engines = dict()
+        self._factories = {
+            ENGINE_IN_PROCESS: lambda: InProcessEngine(profile_manager),
+            ENGINE_BOTO3: lambda: Boto3Engine(profile_manager, checker),
+            ENGINE_FORKSERVER: ForkServerEngine,
+            }
+
+    def get_engine(self, args):
+        """
+        Get engine selected by BAC global arguments.
+
+        :param args: Namespace which contains BAC global arguments.
+        :type: argparse.Namespace
+        :rtype: object or None if subprocess execution is selected
+        """
+        name = getattr(args, 'engine', None) or ENGINE_SUBPROCESS
+        if name == ENGINE_SUBPROCESS:
+            return None
+        if name not in self._engines:
+            log.debug('Initializing the "%s" execution engine.' % name)
+            self._engines[name] = self._factories[name]()
+        return self._engines[name]
+
+    def reload(self):
+        """Drop the state of the engines, once the profiles change."""
+        for engine in self._engines.values():
+            engine.reload()
+
+
+class _ThreadLocalStream(object):
+    """
+    Proxy of a standard stream, which is redirectable per thread.
+
+    Threads, which have not redirected the stream, write into
+    the original stream.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def redirect(self, target):
+        self._local.target = target
+
+    def current(self):
+        return getattr(self._local, 'target', None) or self._stream
+
+    @property
+    def buffer(self):
+        current = self.current()
+        return getattr(current, 'buffer', None) or _TextBuffer(current)
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+
+class _TextBuffer(object):
+    """Binary view of a captured text stream, which decodes the data."""
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, data):
+        self._stream.write(data.decode('utf-8', 'replace'))
+        return len(data)
+
+    def flush(self):
+        self._stream.flush()
+
+
+class _OutputCapture(object):
+    """
+    Captures stdout and stderr written by the current thread.
+
+    Proxies of the standard streams are installed while at least
+    one thread captures its output.
+    """
+    _lock = threading.Lock()
+    _users = 0
+    _proxies = None
+
+    def __init__(self):
+        self.out = StringIO()
+        self.err = StringIO()
+
+    def __enter__(self):
+        cls = type(self)
+        with cls._lock:
+            if not cls._users:
+                cls._proxies = (_ThreadLocalStream(sys.stdout),
+                                _ThreadLocalStream(sys.stderr))
+                sys.stdout, sys.stderr = cls._proxies
+            cls._users += 1
+        stdout, stderr = cls._proxies
+        stdout.redirect(self.out)
+        stderr.redirect(self.err)
+        return self
+
+    def __exit__(self, *exc_info):
+        cls = type(self)
+        stdout, stderr = cls._proxies
+        stdout.redirect(None)
+        stderr.redirect(None)
+        with cls._lock:
+            cls._users -= 1
+            if not cls._users:
+                sys.stdout, sys.stderr = (stdout._stream, stderr._stream)
+                cls._proxies = None
+
+
+class InProcessEngine(object):
+    """
+    Executes aws-cli commands by the awscli.clidriver within BAC.
+
+    Every target is executed by its own CLIDriver with a fresh
+    botocore session, so that the concurrently running targets do
+    not share any mutable session state. Service models are, however,
+    shared by all of the BAC sessions, and credentials are shared with
+    the sessions already held by the ProfileManager, which avoids
+    repeated model loading and credential resolution.
+
+    The in-process execution cannot be interrupted, so targets with
+    a timeout are executed by a new aws-cli process instead.
+    """
+    def __init__(self, profile_manager):
+        """
+        :param profile_manager: an instance of ProfileManager used
+            to receive the sessions of loaded profiles.
+        :type: bac.profile_manager.ProfileManager
+        :rtype: None
+        """
+        self._profile_manager = profile_manager
+        self._env = dict((k, v) for k, v in os.environ.items()
+                         if k not in IGNORED_ENV_VARS)
+
+    def execute(self, target, timeout=None):
+        """
+        Execute the target and capture its output and exit code.
+
+        :param target: Target to be executed.
+        :type: bac.executor.Target
+        :param timeout: Maximum time (in seconds) until the execution
+            is interrupted.
+        :type: int
+        :rtype: bac.executor.TargetResult
+        """
+        if timeout is not None:
+            out, err, exit_code = execute_command(
+                    target.command, timeout, env=self._env,
+                    cancelled=target.cancelled,
+                    new_session=current_job() is not None)
+            return TargetResult(target, exit_code, out, err)
+        driver = self._create_driver(target.profile)
+        with _OutputCapture() as captured:
+            try:
+                exit_code = driver.main(target.command[1:])
+            except SystemExit as e:
+                # Raised by the aws-cli argument parsers on syntax errors
+                exit_code = (e.code if isinstance(e.code, int)
+                             else AWSCLI_ERROR_EXIT_CODE)
+        return TargetResult(target, exit_code,
+                            captured.out.getvalue(), captured.err.getvalue())
+
+    def reload(self):
+        """Nothing to drop, every target parses the profiles again."""
+        pass
+
+    def _create_driver(self, profile):
+        # Mimics the awscli.clidriver.create_clidriver
+        session = models.Session(profile=profile)
+        session.user_agent_name = 'aws-cli'
+        session.user_agent_version = awscli_version
+        session.user_agent_extra = 'botocore/%s' % botocore_version
+        self._share_components(session, profile)
+        load_plugins(session.full_config.get('plugins', {}),
+                     event_hooks=session.get_component('event_emitter'))
+        return CLIDriver(session=session)
+
+    def _share_components(self, session, profile):
+        source = self._profile_manager.sessions.get(profile)
+        if source is None:
+            return
+        # boto3 sessions wrap the botocore session
+        source = getattr(source, '_session', source)
+        session.register_component(
+                'credential_provider',
+                source.get_component('credential_provider'))
+
+
+class ForkServerEngine(object):
+    """
+    Executes aws-cli commands in workers forked from a pre-warmed
+    aws-cli process.
+
+    Unlike the other engines, the commands are executed by the
+    unmodified aws-cli in a separate process, only without its startup
+    costs. On platforms which do not support the fork-server, every
+    command is executed by a new aws-cli process instead.
+    """
+    def __init__(self):
+        env = dict((k, v) for k, v in os.environ.items()
+                   if k not in IGNORED_ENV_VARS)
+        self._server = None
+        if forkserver.is_supported():
+            self._server = forkserver.ForkServer(env)
+        else:
+            log.warning('The fork-server is not supported on this platform.'
+                        ' Executing commands in new aws-cli processes.')
+
+    def execute(self, target, timeout=None):
+        """
+        Execute the target and capture its output and exit code.
+
+        :param target: Target to be executed.
+        :type: bac.executor.Target
+        :param timeout: Maximum time (in seconds) until the execution
+            is interrupted.
+        :type: int
+        :rtype: bac.executor.TargetResult
+        """
+        if self._server is None:
+            out, err, exit_code = execute_command(
+                    target.command, timeout, cancelled=target.cancelled,
+                    new_session=current_job() is not None)
+        else:
+            positionals = extract_positional_args(target.command)
+            if len(positionals) > 1:
+                self._server.preload(positionals[1])
+            out, err, exit_code = self._server.execute(
+                    target.command, timeout, target.cancelled)
+        return TargetResult(target, exit_code, out, err)
+
+    def reload(self):
+        """Restart the fork-server, so that it parses the profiles again."""
+        if self._server is not None:
+            self._server.restart()
+
+
+class ClientPool(object):
+    """
+    Pool of boto3 clients shared by all targets and commands.
+
+    A single client is created for every profile, region, service
+    and endpoint combination. Clients keep their HTTP connections
+    open, so that they are reused by the subsequent calls.
+    """
+    def __init__(self, profile_manager, max_pool_connections=DEFAULT_WORKERS):
+        """
+        :param profile_manager: an instance of ProfileManager used
+            to receive the sessions of loaded profiles.
+        :type: bac.profile_manager.ProfileManager
+        :param max_pool_connections: Maximum number of kept open
+            connections of a single client.
+        :type: int
+        :rtype: None
+        """
+        self._profile_manager = profile_manager
+        self._config = Config(max_pool_connections=max_pool_connections)
+        self._clients = dict()
+        self._lock = threading.Lock()
+        # boto3 sessions are not thread-safe, clients are
+        self._session_locks = defaultdict(threading.Lock)
+
+    def get_client(self, profile, region, service, endpoint_url=None,
+                   verify=None):
+        """Get a pooled client, create it if it does not exist yet."""
+        key = (profile, region, service, endpoint_url, verify)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            session_lock = self._session_locks[profile]
+        with session_lock:
+            if key not in self._clients:
+                session = self._profile_manager.sessions[profile]
+                self._clients[key] = session.client(
+                        service, region_name=region, endpoint_url=endpoint_url,
+                        verify=verify, config=self._config)
+        return self._clients[key]
+
+    def clear(self):
+        """Drop all of the clients, e.g. once the profiles change."""
+        with self._lock:
+            self._clients = dict()
+
+
+class Boto3Engine(object):
+    """
+    Executes aws-cli commands as direct calls of boto3 clients.
+
+    Commands are resolved into botocore operations by the CLIChecker,
+    and then called on a pooled client of every target profile and
+    region. Output is formatted the same way, as the aws-cli "json"
+    output. Commands, which cannot be called directly (e.g. "aws s3 cp"
+    or "--output table"), are executed by the in-process engine.
+    """
+    def __init__(self, profile_manager, checker):
+        """
+        :param profile_manager: an instance of ProfileManager used
+            to receive the sessions of loaded profiles.
+        :type: bac.profile_manager.ProfileManager
+        :param checker: The checker object used to resolve aws-cli
+            commands into botocore operations.
+        :type: bac.checker.CLIChecker
+        :rtype: None
+        """
+        self._profile_manager = profile_manager
+        self._checker = checker
+        self._clients = ClientPool(profile_manager)
+        self._fallback = InProcessEngine(profile_manager)
+        self._calls = dict()
+        self._outputs = dict()
+        self._lock = threading.Lock()
+
+    def execute(self, target, timeout=None):
+        """
+        Call the operation of the target and format its response.
+
+        :param target: Target to be executed.
+        :type: bac.executor.Target
+        :param timeout: Ignored, the call is not interrupted.
+        :type: int
+        :rtype: bac.executor.TargetResult
+        """
+        try:
+            call = self._resolve(target.command)
+        except BACError as e:
+            log.debug('Failed to resolve the command for the boto3 engine:'
+                      ' %s. Using the in-process engine instead.' % str(e))
+            call = None
+        if call is None or not self._has_json_output(target, call):
+            return self._fallback.execute(target, timeout)
+
+        try:
+            response = self._call(target, call)
+        except ClientError as e:
+            return TargetResult(target, AWSCLI_ERROR_EXIT_CODE,
+                                '', '\n%s\n' % str(e))
+        except BotoCoreError as e:
+            return TargetResult(target, AWSCLI_ERROR_EXIT_CODE, '',
+                                '%s\n' % str(e))
+        return TargetResult(target, 0, self._format(response, call), '')
+
+    def reload(self):
+        """Drop the clients and outputs of the previous profiles."""
+        self._clients.clear()
+        with self._lock:
+            self._outputs = dict()
+
+    def _resolve(self, command):
+        # Targets of a single fan-out differ only in profile and region,
+        # so the command is resolved only once for all of them.
+        key = tuple(self._strip_target_options(command))
+        if key not in self._calls:
+            call = self._checker.resolve(command[1:])
+            if call is not None and not self._is_supported(call):
+                call = None
+            with self._lock:
+                self._calls[key] = call
+        return self._calls[key]
+
+    def _strip_target_options(self, command):
+        iter_command = iter(command)
+        for argument in iter_command:
+            if argument in PROFILE_OPTIONS or argument in REGION_OPTIONS:
+                next(iter_command, None)
+                continue
+            yield argument
+
+    def _is_supported(self, call):
+        parser = self._checker.parser
+        for option, value in vars(call.parsed_globals).items():
+            if (option not in BOTO3_ENGINE_OPTIONS
+                    and value != parser.get_default(option)):
+                log.debug('Option "%s" is not supported by the boto3'
+                          ' engine.' % option)
+                return False
+        if call.parsed_globals.output not in (None, 'json'):
+            return False
+        return not any(isinstance(value, string_types)
+                       and value.startswith(('file://', 'fileb://'))
+                       for value in call.parameters.values())
+
+    def _has_json_output(self, target, call):
+        if call.parsed_globals.output is not None:
+            return True
+        profile = target.profile
+        with self._lock:
+            known = profile in self._outputs
+            output = self._outputs.get(profile)
+        if not known:
+            output = self._get_profile_output(profile)
+            with self._lock:
+                output = self._outputs.setdefault(profile, output)
+        if output not in (None, 'json'):
+            log.debug('Output "%s" of %s profile is not supported by the'
+                      ' boto3 engine.' % (output, profile))
+            return False
+        return True
+
+    def _get_profile_output(self, profile):
+        session = self._profile_manager.sessions[profile]
+        session = getattr(session, '_session', session)
+        # The "output" is only registered as a config variable
+        # by the aws-cli, resolved the same way here
+        try:
+            output = session.get_config_variable('output')
+            if output is None:
+                output = os.environ.get('AWS_DEFAULT_OUTPUT',
+                                        session.get_scoped_config().get(
+                                                'output'))
+        except BotoCoreError as e:
+            log.debug('Failed to resolve the output of %s profile: %s'
+                      % (profile, str(e)))
+            return None
+        return output
+
+    def _call(self, target, call):
+        globals_ = call.parsed_globals
+        verify = None if globals_.verify_ssl else False
+        client = self._clients.get_client(
+                target.profile, target.region, call.service_name,
+                globals_.endpoint_url, verify)
+        # Botocore handlers may modify the parameters
+        parameters = copy.deepcopy(call.parameters)
+        if globals_.paginate and client.can_paginate(call.method_name):
+            paginator = client.get_paginator(call.method_name)
+            response = paginator.paginate(**parameters).build_full_result()
+        else:
+            response = getattr(client, call.method_name)(**parameters)
+        response.pop('ResponseMetadata', None)
+        return response
+
+    def _format(self, response, call):
+        query = call.parsed_globals.query
+        if query:
+            response = jmespath.search(query, response)
+        if response == {}:
+            return ''
+        return '%s\n' % json.dumps(response, indent=4, default=json_encoder,
+                                   ensure_ascii=False)
@@ -19,6 +19,11 @@ class BatchJobSyntaxException(Exception):
         super(self.__class__, self).__init__(msg)
 
 
+class CancelledException(Exception):
+    """Raised if the execution of a command is cancelled."""
+    pass
+
+
 class ConfigParsingException(Exception):
     """
     Raised if some errors occurs during parse of aws config files.
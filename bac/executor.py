@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import logging
+import threading
+import time
+
+from collections import Counter
+
+from bac.constants import (AWSCLI_ERROR_EXIT_CODE, DEFAULT_WORKERS,
+                           EXECUTOR_CANCEL_GRACE, EXECUTOR_POLL_INTERVAL,
+                           TARGET_CANCELLED, TARGET_COMPLETED,
+                           TARGET_TIMED_OUT)
+from bac.errors import CancelledException, TimeoutException
+from bac.throttling import RateLimiter
+
+log = logging.getLogger(__name__)
+
+
+class Target(object):
+    """
+    A single unit of fan-out work.
+
+    Target binds an assembled aws-cli command to the profile and
+    region, which it is going to be executed for.
+    """
+    def __init__(self, command, profile, region):
+        """
+        :param command: Assembled aws-cli command.
+        :type: list
+        :param profile: Profile the command is executed for.
+        :type: str
+        :param region: Region the command is executed in.
+        :type: str
+        :rtype: None
+        """
+        self.command = command
+        self.profile = profile
+        self.region = region
+        # Set by the executor before the target is executed
+        self.deadline = None
+        self.cancelled = threading.Event()
+
+    def remaining(self, timeout=None):
+        """
+        Get the time remaining until the deadline of the target.
+
+        :param timeout: Timeout (in seconds) of the execution, which
+            is applied if it ends sooner than the deadline.
+        :type: float
+        :rtype: float or None if there is neither a deadline
+            nor a timeout
+        """
+        if self.deadline is None:
+            return timeout
+        remaining = max(0, self.deadline - time.time())
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    def __getstate__(self):
+        # Events cannot be pickled, e.g. for the worker processes
+        state = dict(self.__dict__)
+        state.pop('cancelled')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cancelled = threading.Event()
+
+    def __repr__(self):
+        return ('Target(profile=%s, region=%s)'
+                % (self.profile, self.region))
+
+
+class TargetResult(object):
+    """Outcome of a single target execution."""
+    def __init__(self, target, exit_code, out=None, err=None,
+                 status=TARGET_COMPLETED):
+        """
+        :param target: The executed target.
+        :type: bac.executor.Target
+        :param exit_code: Exit code of the executed command.
+        :type: int
+        :param out: Captured standard output, if any.
+        :type: str
+        :param err: Captured standard error output, if any.
+        :type: str
+        :param status: Whether the target has completed, timed out
+            or has been cancelled.
+        :type: str
+        :rtype: None
+        """
+        self.target = target
+        self.exit_code = exit_code
+        self.out = out
+        self.err = err
+        self.status = status
+        self.started = None
+        self.finished = None
+        # Whether the result has been served from the result cache
+        self.cached = False
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    @property
+    def failed(self):
+        return self.exit_code != 0
+
+
+class FanOutProgress(object):
+    """
+    Snapshot of the progress of a fan-out.
+
+    Progress of multiple fan-outs can be summed up.
+    """
+    def __init__(self, total=0, finished=0, failed=0, running=0, workers=0,
+                 elapsed=0, latency=0, timed=0):
+        """
+        :param total: Number of all targets.
+        :type: int
+        :param finished: Number of finished targets.
+        :type: int
+        :param failed: Number of finished targets, which have failed.
+        :type: int
+        :param running: Number of currently running targets.
+        :type: int
+        :param workers: Maximum number of concurrently running targets.
+        :type: int
+        :param elapsed: Time (in seconds) since the fan-out started.
+        :type: float
+        :param latency: Total execution time (in seconds) of the timed
+            finished targets.
+        :type: float
+        :param timed: Number of the finished targets, whose execution
+            time is known.
+        :type: int
+        :rtype: None
+        """
+        self.total = total
+        self.finished = finished
+        self.failed = failed
+        self.running = running
+        self.workers = workers
+        self.elapsed = elapsed
+        self.latency = latency
+        self.timed = timed
+
+    @property
+    def rate(self):
+        """Finished targets per second, or None if not known yet."""
+        if not self.elapsed:
+            return None
+        return self.finished / float(self.elapsed)
+
+    @property
+    def eta(self):
+        """
+        Expected time (in seconds) until all targets finish, or None
+        if no target has finished yet.
+
+        Computed from the average execution time of the finished
+        targets, as if the remaining ones ran with full concurrency.
+        """
+        remaining = self.total - self.finished
+        if remaining <= 0:
+            return 0
+        if not self.timed:
+            return None
+        concurrency = max(1, min(self.workers, remaining))
+        return remaining * (self.latency / self.timed) / concurrency
+
+    def __add__(self, other):
+        return FanOutProgress(
+                self.total + other.total, self.finished + other.finished,
+                self.failed + other.failed, self.running + other.running,
+                self.workers + other.workers,
+                max(self.elapsed, other.elapsed),
+                self.latency + other.latency, self.timed + other.timed)
+
+
+class FanOutExecutor(object):
+    """
+    Executes fan-out targets with bounded concurrency.
+
+    At most "workers" targets run at the same time. In addition,
+    the number of concurrently running targets may be limited for
+    every single profile and every single region. Targets, which
+    cannot be started due to these limits, are postponed until
+    some of the running targets finish.
+
+    Every target may run for at most "timeout" seconds and the whole
+    fan-out for at most "budget" seconds. Targets, which have not
+    been started before the budget runs out or before the executor
+    is interrupted, are cancelled. Running targets are cancelled
+    too, if their execution supports it.
+
+    If the timing history is given, targets which took the longest
+    in the past are started first.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, per_profile=None,
+                 per_region=None, limiter=None, timeout=None, budget=None,
+                 history=None):
+        """
+        :param workers: Maximum number of concurrently running targets.
+        :type: int
+        :param per_profile: Maximum number of concurrently running
+            targets of a single profile. Unlimited if not set.
+        :type: int
+        :param per_region: Maximum number of concurrently running
+            targets in a single region. Unlimited if not set.
+        :type: int
+        :param limiter: Limiter of the start rate and concurrency of
+            targets, which share the same AWS API limits.
+        :type: bac.throttling.RateLimiter
+        :param timeout: Maximum time (in seconds) of a single target.
+        :type: float
+        :param budget: Maximum time (in seconds) of all targets.
+        :type: float
+        :param history: History of the execution times of targets,
+            which orders and records the executed targets.
+        :type: bac.timings.TimingHistory
+        :rtype: None
+        """
+        self._workers = max(1, workers or DEFAULT_WORKERS)
+        self._per_profile = per_profile
+        self._per_region = per_region
+        self._limiter = limiter
+        self._timeout = timeout
+        self._budget = budget
+        self._history = history
+        self._deadline = None
+        self._started = None
+        self._finished = None
+        self._targets = list()
+        self._condition = threading.Condition()
+        self._pending = list()
+        self._results = list()
+        self._running_profiles = Counter()
+        self._running_regions = Counter()
+        self._stopped = False
+        self._on_result = None
+        self._result_lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args, account_names=None, history=None,
+                  limiter=None):
+        """
+        Create executor configured by BAC global arguments.
+
+        :param args: Namespace which contains BAC global arguments.
+        :type: argparse.Namespace
+        :param account_names: Account names of the profiles, used
+            to group targets by their accounts.
+        :type: dict
+        :param history: History of the execution times of targets,
+            unused with "--bac-no-timings".
+        :type: bac.timings.TimingHistory
+        :param limiter: Rate limiter shared by all of the fan-outs.
+        :type: bac.throttling.RateLimiter
+        :rtype: bac.executor.FanOutExecutor
+        """
+        if getattr(args, 'no_timings', False):
+            history = None
+        return cls(workers=getattr(args, 'workers', None),
+                   per_profile=getattr(args, 'max_per_profile', None),
+                   per_region=getattr(args, 'max_per_region', None),
+                   limiter=RateLimiter.from_args(args, account_names,
+                                                 limiter),
+                   timeout=getattr(args, 'target_timeout', None),
+                   budget=getattr(args, 'budget', None),
+                   history=history)
+
+    def run(self, targets, execute, on_result=None):
+        """
+        Execute all targets and wait for them to finish.
+
+        On Ctrl-C, all of the targets are cancelled, the summary of the
+        targets is logged and the KeyboardInterrupt is raised again.
+
+        :param targets: Targets to be executed.
+        :type: list
+        :param execute: A callable, which receives a target, executes
+            it and returns its bac.executor.TargetResult.
+        :type: callable
+        :param on_result: A callable, which receives every
+            bac.executor.TargetResult as soon as its target finishes.
+            It is never called concurrently.
+        :type: callable
+        :rtype: list
+        """
+        self._on_result = on_result
+        self._targets = list(targets)
+        self._pending = list(enumerate(targets))
+        if self._history is not None and len(self._pending) > 1:
+            # Longest targets first, the results keep the target order
+            self._pending = [self._pending[index]
+                             for index in self._history.order(self._targets)]
+        self._results = [None] * len(self._pending)
+        self._stopped = False
+        self._started = time.time()
+        self._finished = None
+        self._deadline = self._started + self._budget if self._budget else None
+
+        threads = list()
+        for _ in range(min(self._workers, len(self._pending))):
+            thread = threading.Thread(target=self._work, args=(execute,))
+            thread.daemon = True
+            # Workers write their output as the thread, which runs them
+            thread.parent = threading.current_thread()
+            thread.start()
+            threads.append(thread)
+
+        try:
+            self._wait(threads)
+        except KeyboardInterrupt:
+            log.warning('Interrupted, cancelling all of the targets.')
+            self.cancel()
+            try:
+                self._wait(threads, time.time() + EXECUTOR_CANCEL_GRACE)
+            except KeyboardInterrupt:
+                pass
+            log_summary(self._finish())
+            raise KeyboardInterrupt()
+        return self._finish()
+
+    @property
+    def progress(self):
+        """
+        Progress of the fan-out.
+
+        :rtype: bac.executor.FanOutProgress
+        """
+        results = [result for result in list(self._results)
+                   if result is not None]
+        durations = [result.duration for result in results
+                     if result.duration is not None]
+        with self._condition:
+            running = sum(self._running_profiles.values())
+        elapsed = 0
+        if self._started is not None:
+            elapsed = (self._finished or time.time()) - self._started
+        return FanOutProgress(
+                total=len(self._targets), finished=len(results),
+                failed=sum(1 for result in results if result.failed),
+                running=running, workers=self._workers, elapsed=elapsed,
+                latency=sum(durations), timed=len(durations))
+
+    def cancel(self):
+        """Cancel all of the pending and running targets."""
+        log.debug('Cancelling pending and running targets.')
+        with self._condition:
+            self._stopped = True
+            for target in self._targets:
+                target.cancelled.set()
+            self._condition.notify_all()
+
+    def _finish(self):
+        # Targets still running after the cancellation are abandoned
+        with self._result_lock:
+            self._on_result = None
+        for index, result in enumerate(self._results):
+            if result is None:
+                self._results[index] = TargetResult(
+                        self._targets[index], None, status=TARGET_CANCELLED)
+        self._finished = time.time()
+        if self._history is not None:
+            self._history.record(self._results)
+        return list(self._results)
+
+    def _wait(self, threads, until=None):
+        for thread in threads:
+            # Joining with timeout keeps the main thread responsive
+            # to the KeyboardInterrupt.
+            while thread.is_alive():
+                if until is not None and time.time() >= until:
+                    return
+                if (self._deadline is not None and not self._stopped
+                        and time.time() >= self._deadline):
+                    log.warning('Time budget of %s seconds exceeded.'
+                                % self._budget)
+                    self.cancel()
+                    until = time.time() + EXECUTOR_CANCEL_GRACE
+                thread.join(EXECUTOR_POLL_INTERVAL)
+
+    def _work(self, execute):
+        while True:
+            with self._condition:
+                item = self._acquire_next()
+                if item is None:
+                    return
+            index, target = item
+            target.deadline = self._get_deadline()
+            result = None
+            try:
+                result = self._execute(execute, target)
+                self._results[index] = result
+            finally:
+                with self._condition:
+                    self._release(target, result)
+            with self._result_lock:
+                # Cleared by run() once the targets are abandoned
+                on_result = self._on_result
+                if on_result is not None:
+                    on_result(result)
+
+    def _acquire_next(self):
+        # Must be called while holding the condition
+        while not self._stopped and self._pending:
+            for position, (index, target) in enumerate(self._pending):
+                if self._can_start(target):
+                    del self._pending[position]
+                    self._running_profiles[target.profile] += 1
+                    self._running_regions[target.region] += 1
+                    if self._limiter is not None:
+                        self._limiter.start(target)
+                    return index, target
+            self._condition.wait(EXECUTOR_POLL_INTERVAL)
+        return None
+
+    def _get_deadline(self):
+        deadlines = list()
+        if self._timeout:
+            deadlines.append(time.time() + self._timeout)
+        if self._deadline is not None:
+            deadlines.append(self._deadline)
+        return min(deadlines) if deadlines else None
+
+    def _release(self, target, result=None):
+        # Must be called while holding the condition
+        self._running_profiles[target.profile] -= 1
+        self._running_regions[target.region] -= 1
+        if self._limiter is not None:
+            self._limiter.finish(target, result)
+        self._condition.notify_all()
+
+    def _can_start(self, target):
+        if (self._per_profile
+                and self._running_profiles[target.profile]
+                >= self._per_profile):
+            return False
+        if (self._per_region
+                and self._running_regions[target.region]
+                >= self._per_region):
+            return False
+        if self._limiter is not None and not self._limiter.can_start(target):
+            return False
+        return True
+
+    def _execute(self, execute, target):
+        started = time.time()
+        try:
+            result = execute(target)
+        except TimeoutException as e:
+            result = TargetResult(target, None, err=str(e),
+                                  status=TARGET_TIMED_OUT)
+        except CancelledException as e:
+            result = TargetResult(target, None, err=str(e),
+                                  status=TARGET_CANCELLED)
+        except Exception as e:
+            log.error('Execution failed for profile "%s" and region "%s".'
+                      ' Following error occured: %s'
+                      % (target.profile, target.region, str(e)))
+            result = TargetResult(target, AWSCLI_ERROR_EXIT_CODE, err=str(e))
+        if (target.cancelled.is_set() and result.failed
+                and result.status == TARGET_COMPLETED):
+            # Most probably interrupted by the cancellation
+            result.status = TARGET_CANCELLED
+        result.started = started
+        result.finished = time.time()
+        return result
+
+
+def log_summary(results):
+    """
+    Log how many targets have completed, failed, timed out or been
+    cancelled, and warn about the targets, which have not completed.
+
+    :param results: Results of the fan-out targets.
+    :type: list of bac.executor.TargetResult
+    :rtype: None
+    """
+    results = [result for result in results if result is not None]
+    if not results:
+        return
+    counts = Counter(result.status for result in results)
+    failed = sum(1 for result in results
+                 if result.status == TARGET_COMPLETED and result.failed)
+    log.info('Fan-out summary: %s completed (%s failed), %s timed out,'
+             ' %s cancelled.' % (counts[TARGET_COMPLETED], failed,
+                                 counts[TARGET_TIMED_OUT],
+                                 counts[TARGET_CANCELLED]))
+    unfinished = [result for result in results
+                  if result.status != TARGET_COMPLETED]
+    if unfinished:
+        log.warning('Targets which have not completed:\n%s'
+                    % '\n'.join('%s: %s' % (result.status, result.target)
+                                for result in unfinished))
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+"""
+Fork-server of pre-warmed aws-cli workers.
+
+The fork-server (zygote) is a separate process, which imports
+the aws-cli, creates its CLIDriver and loads the service models
+in advance. Every aws-cli command is then executed by a worker
+forked from the zygote, which inherits all of the already loaded
+data. The standard streams of the worker are passed to the zygote
+from BAC, so the worker prints exactly what the aws-cli would.
+
+The zygote is started by running this module:
+
+    python -m bac.forkserver <socket-path>
+"""
+import array
+import atexit
+import errno
+import io
+import json
+import logging
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from bac.constants import (AWSCLI_ERROR_EXIT_CODE, EXECUTOR_POLL_INTERVAL,
+                           FORKSERVER_READY, FORKSERVER_START_TIMEOUT)
+from bac.errors import BACError, CancelledException, TimeoutException
+
+log = logging.getLogger(__name__)
+
+_FDS_SIZE = array.array('i', [0, 0, 0]).itemsize * 3
+
+
+def is_supported():
+    """Check whether the fork-server can be used on this platform."""
+    return (hasattr(os, 'fork')
+            and hasattr(socket, 'AF_UNIX')
+            and hasattr(socket.socket, 'sendmsg'))
+
+
+class ForkServer(object):
+    """
+    Client of the fork-server, owned by the BAC process.
+
+    The zygote process is started lazily on the first execution
+    and terminated when BAC exits.
+    """
+    def __init__(self, env=None):
+        """
+        :param env: Environment of the zygote and its workers.
+        :type: dict
+        :rtype: None
+        """
+        self._env = dict(env if env is not None else os.environ)
+        self._process = None
+        self._directory = None
+        self._address = None
+        self._preloaded = set()
+        self._stop_registered = False
+        self._outdated = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the zygote process, if it is not running yet."""
+        with self._lock:
+            running = (self._process is not None
+                       and self._process.poll() is None)
+            if running and not self._outdated:
+                return
+            if running:
+                log.debug('Restarting the outdated aws-cli fork-server.')
+                self.stop()
+            self._outdated = False
+            self._start()
+
+    def restart(self):
+        """
+        Restart the zygote process on the next execution.
+
+        The zygote parses the AWS credentials and config files only
+        once it starts, so it must be restarted once they change.
+        Workers already forked from the zygote are not affected.
+        """
+        with self._lock:
+            self._outdated = True
+
+    def _start(self):
+        self._directory = tempfile.mkdtemp(prefix='bac-forkserver-')
+        self._address = os.path.join(self._directory, 'socket')
+        package_root = os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))
+        env = dict(self._env)
+        env['PYTHONPATH'] = os.pathsep.join(
+                p for p in (package_root, env.get('PYTHONPATH')) if p)
+
+        log.debug('Starting the aws-cli fork-server.')
+        # The zygote runs in its own session, so that the interrupt
+        # signals sent to BAC do not terminate it.
+        self._process = subprocess.Popen(
+                [sys.executable, '-m', 'bac.forkserver', self._address],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+                start_new_session=True)
+        if not self._stop_registered:
+            # The zygote may be restarted, but is stopped only once
+            atexit.register(self.stop)
+            self._stop_registered = True
+
+        ready, _, _ = select.select(
+                [self._process.stdout], [], [], FORKSERVER_START_TIMEOUT)
+        line = self._process.stdout.readline() if ready else b''
+        if line.strip() != FORKSERVER_READY.encode('ascii'):
+            self.stop()
+            raise BACError('Failed to start the aws-cli fork-server.')
+        self._preloaded = set()
+
+    def stop(self):
+        """Terminate the zygote process and clean up its socket."""
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            # Closing stdin makes the zygote exit
+            process.stdin.close()
+            try:
+                process.wait()
+            except OSError:
+                pass
+        if self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def preload(self, service):
+        """Load the service model into the zygote for all workers."""
+        if service in self._preloaded:
+            return
+        self.start()
+        with self._connect() as conn:
+            self._send(conn, {'preload': service})
+            conn.makefile('r').readline()
+        self._preloaded.add(service)
+
+    def execute(self, command, timeout=None, cancelled=None):
+        """
+        Execute aws-cli command in a worker forked from the zygote.
+
+        :param command: aws-cli command to be executed.
+        :type: list
+        :param timeout: Maximum time (in seconds) until the worker
+            is killed.
+        :type: int
+        :param cancelled: Event, which kills the worker once it is set.
+        :type: threading.Event
+        :rtype: tuple of stdout, stderr and exit code
+        """
+        self.start()
+        out_read, out_write = os.pipe()
+        err_read, err_write = os.pipe()
+        stdin = self._open_stdin()
+        try:
+            conn = None
+            try:
+                conn = self._connect()
+                self._send(conn, {'argv': command[1:], 'cwd': os.getcwd()},
+                           [stdin, out_write, err_write])
+            except Exception:
+                if conn is not None:
+                    conn.close()
+                raise
+            finally:
+                # The worker has its own copies of the sent descriptors
+                for fd in (stdin, out_write, err_write):
+                    os.close(fd)
+            with conn:
+                return self._communicate(conn, out_read, err_read, timeout,
+                                         cancelled)
+        finally:
+            os.close(out_read)
+            os.close(err_read)
+
+    def _open_stdin(self):
+        # Workers may prompt for the MFA codes of the role profiles
+        try:
+            return os.dup(sys.stdin.fileno())
+        except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+            return os.open(os.devnull, os.O_RDONLY)
+
+    def _connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self._address)
+        except socket.error:
+            conn.close()
+            raise
+        return conn
+
+    def _send(self, conn, message, fds=None):
+        payload = ('%s\n' % json.dumps(message)).encode('utf-8')
+        ancillary = list()
+        if fds:
+            ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                              array.array('i', fds)))
+        conn.sendmsg([payload], ancillary)
+
+    def _communicate(self, conn, out_read, err_read, timeout, cancelled):
+        outputs = {out_read: list(), err_read: list(), conn: list()}
+        # The worker can only be killed once its pid is known
+        pid = self._receive_pid(conn, outputs[conn])
+        deadline = time.time() + timeout if timeout is not None else None
+        pending = list(outputs.keys())
+        while pending:
+            remaining = deadline - time.time() if deadline else None
+            if remaining is not None and remaining <= 0:
+                self._kill(pid)
+                raise TimeoutException(
+                        'Command timed out after %s seconds' % timeout)
+            if cancelled is not None and cancelled.is_set():
+                self._kill(pid)
+                raise CancelledException('Command has been cancelled')
+            if cancelled is not None:
+                remaining = min(remaining or EXECUTOR_POLL_INTERVAL,
+                                EXECUTOR_POLL_INTERVAL)
+            ready, _, _ = select.select(pending, [], [], remaining)
+            for source in ready:
+                if source is conn:
+                    data = conn.recv(4096)
+                else:
+                    data = os.read(source, 4096)
+                if data:
+                    outputs[source].append(data)
+                else:
+                    pending.remove(source)
+
+        status = self._parse_status(outputs[conn])
+        exit_code = status.get('exit_code', AWSCLI_ERROR_EXIT_CODE)
+        out = b''.join(outputs[out_read]).decode('utf-8')
+        err = b''.join(outputs[err_read]).decode('utf-8')
+        return out, err, exit_code
+
+    def _receive_pid(self, conn, chunks):
+        deadline = time.time() + FORKSERVER_START_TIMEOUT
+        while b'\n' not in b''.join(chunks):
+            remaining = deadline - time.time()
+            ready = remaining > 0 and select.select([conn], [], [],
+                                                    remaining)[0]
+            data = conn.recv(4096) if ready else b''
+            if not data:
+                raise BACError('The aws-cli fork-server has not started'
+                               ' the worker.')
+            chunks.append(data)
+        return self._parse_status(chunks).get('pid')
+
+    def _parse_status(self, chunks):
+        # Worker reports its pid first and its exit code when it ends
+        status = dict()
+        for line in b''.join(chunks).decode('utf-8').splitlines():
+            if line.endswith('}'):
+                status.update(json.loads(line))
+        return status
+
+    def _kill(self, pid):
+        if not pid:
+            return
+        try:
+            # Kills the processes started by the worker as well
+            os.killpg(pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+
+class _Zygote(object):
+    """The fork-server process itself."""
+    def __init__(self, address):
+        from awscli.clidriver import create_clidriver
+
+        self._address = address
+        self._driver = create_clidriver()
+        # Preload the data needed by every single command
+        self._driver._get_command_table()
+        self._driver._get_argument_table()
+
+    def serve(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self._address)
+        listener.listen(128)
+        # Workers are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        sys.stdout.write('%s\n' % FORKSERVER_READY)
+        sys.stdout.flush()
+
+        stdin = sys.stdin.fileno()
+        while True:
+            ready, _, _ = select.select([listener, stdin], [], [])
+            if stdin in ready and not os.read(stdin, 1):
+                # BAC has exited or stopped the fork-server
+                return
+            if listener in ready:
+                conn, _ = listener.accept()
+                self._handle(listener, conn)
+
+    def _handle(self, listener, conn):
+        message, fds = self._receive(conn)
+        if 'preload' in message:
+            self._preload(message['preload'])
+            self._send(conn, {})
+            conn.close()
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+
+        # Worker process
+        exit_code = AWSCLI_ERROR_EXIT_CODE
+        try:
+            listener.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            # The worker leads its own process group, killed as a whole
+            os.setpgid(0, 0)
+            self._send(conn, {'pid': os.getpid()})
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            os.chdir(message['cwd'])
+            # The aws-cli names itself by the executed program
+            sys.argv = ['aws'] + message['argv']
+            exit_code = self._run(message['argv'])
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            try:
+                self._send(conn, {'exit_code': exit_code})
+            finally:
+                os._exit(exit_code)
+
+    def _send(self, conn, message):
+        conn.sendall(('%s\n' % json.dumps(message)).encode('utf-8'))
+
+    def _run(self, argv):
+        try:
+            return self._driver.main(argv)
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            if isinstance(e.code, int):
+                return e.code
+            sys.stderr.write('%s\n' % e.code)
+            return 1
+
+    def _preload(self, service):
+        try:
+            command = self._driver._get_command_table()[service]
+            command._get_command_table()
+        except Exception:
+            # Unknown services are reported by the workers themselves
+            pass
+
+    def _receive(self, conn):
+        data, ancillary, _, _ = conn.recvmsg(4096, socket.CMSG_LEN(_FDS_SIZE))
+        fds = array.array('i')
+        for level, kind, payload in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(payload[:len(payload)
+                                      - (len(payload) % fds.itemsize)])
+        while not data.endswith(b'\n'):
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return json.loads(data.decode('utf-8')), list(fds)
+
+
+def main():
+    _Zygote(sys.argv[1]).serve()
+
+
+if __name__ == '__main__':
+    main()
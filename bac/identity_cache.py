@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import hashlib
+import logging
+import sqlite3
+import time
+
+from bac.constants import IDENTITY_CACHE_PATH
+from bac.utils import Database
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS identities (
+    profile TEXT PRIMARY KEY,
+    files_hash TEXT NOT NULL,
+    account_id TEXT,
+    account_name TEXT,
+    updated REAL NOT NULL
+);
+'''
+
+
+def hash_files(paths):
+    """
+    Hash the contents of the files.
+
+    Missing files are hashed as empty ones.
+
+    :param paths: Paths to the hashed files.
+    :type: list
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except (IOError, OSError):
+            pass
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class IdentityCache(object):
+    """
+    Local disk cache of the accounts of the profiles.
+
+    Account IDs and names almost never change, so they are cached
+    across BAC runs. Cached accounts are only valid for the same
+    contents of the AWS credentials and config files, identified by
+    their hash.
+    """
+    def __init__(self, path=IDENTITY_CACHE_PATH):
+        """
+        :param path: Path to the SQLite database file.
+        :type: str
+        :rtype: None
+        """
+        self._database = Database(path, _SCHEMA)
+
+    def get(self, files_hash):
+        """
+        Get the cached accounts of the profiles.
+
+        :param files_hash: Hash of the AWS credentials and config files.
+        :type: str
+        :rtype: dict of the profile to the tuple of its account ID,
+            account name and the time the account has been cached
+        """
+        try:
+            with self._database as connection:
+                rows = connection.execute(
+                        'SELECT * FROM identities WHERE files_hash = ?',
+                        (files_hash,)).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            log.debug('Failed to read the identity cache: %s' % str(e))
+            return dict()
+        return dict((row['profile'], (row['account_id'], row['account_name'],
+                                      row['updated']))
+                    for row in rows)
+
+    def put(self, files_hash, accounts):
+        """
+        Cache the accounts of the profiles.
+
+        :param files_hash: Hash of the AWS credentials and config files.
+        :type: str
+        :param accounts: Profiles and the tuples of their account IDs
+            and account names.
+        :type: dict
+        :rtype: None
+        """
+        if not accounts:
+            return
+        updated = time.time()
+        try:
+            with self._database as connection:
+                with connection:
+                    connection.executemany(
+                            'INSERT OR REPLACE INTO identities (profile,'
+                            ' files_hash, account_id, account_name, updated)'
+                            ' VALUES (?, ?, ?, ?, ?)',
+                            [(profile, files_hash, account_id, account_name,
+                              updated)
+                             for profile, (account_id, account_name)
+                             in accounts.items()])
+        except (sqlite3.Error, OSError) as e:
+            log.debug('Failed to write the identity cache: %s' % str(e))
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+"""
+Background jobs of the BAC shell.
+
+Commands suffixed by "&" are executed by a background thread, while
+the shell keeps prompting for new commands. Everything the job writes
+into the standard streams, including its log messages, is buffered
+within the job, instead of interleaving with the prompt. The buffered
+output is printed once the job is brought to the foreground.
+"""
+import logging
+import sys
+import threading
+
+from bac.constants import (EXECUTOR_POLL_INTERVAL, JOB_COMMANDS, JOB_DONE,
+                           JOB_FAILED, JOB_KILLED, JOB_RUNNING)
+from bac.errors import ArgumentParserDoneException, BACError
+from bac.executor import FanOutProgress
+from bac.utils import ArgumentParser
+
+log = logging.getLogger(__name__)
+
+
+def current_job():
+    """
+    Get the job executed by the current thread.
+
+    Threads started on behalf of a job, e.g. the fan-out workers,
+    refer to their starting thread by the "parent" attribute.
+
+    :rtype: bac.jobs.Job or None if the current thread does not
+        execute any background job
+    """
+    thread = threading.current_thread()
+    while thread is not None:
+        job = getattr(thread, 'job', None)
+        if job is not None:
+            return job
+        thread = getattr(thread, 'parent', None)
+    return None
+
+
+def split_background(argv):
+    """
+    Strip the trailing "&" from the command.
+
+    :param argv: The command entered into the shell.
+    :type: list
+    :rtype: tuple of the stripped command and whether it has been
+        requested to be executed in the background
+    """
+    if not argv or not argv[-1].endswith('&'):
+        return argv, False
+    last = argv[-1][:-1]
+    if last:
+        return argv[:-1] + [last], True
+    return argv[:-1], True
+
+
+class _JobStream(object):
+    """
+    Proxy of a standard stream, which writes into the current job.
+
+    Threads, which do not execute any job, write into the original
+    stream.
+    """
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+
+    def write(self, text):
+        job = current_job()
+        if job is None:
+            return self._stream.write(text)
+        job.output.write(self._name, text)
+
+    def flush(self):
+        if current_job() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class JobOutput(object):
+    """Output written by a job, read as it grows."""
+    def __init__(self):
+        self._chunks = list()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def write(self, name, text):
+        """Append text written into the "stdout" or "stderr" stream."""
+        if not text:
+            return
+        with self._condition:
+            self._chunks.append((name, text))
+            self._condition.notify_all()
+
+    def close(self):
+        """Mark the output as complete."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def read(self, position, timeout=None):
+        """
+        Read the output written since the given position.
+
+        Waits up to the timeout for a new output, if there is none.
+
+        :param position: Number of the already read chunks.
+        :type: int
+        :param timeout: Maximum time (in seconds) to wait.
+        :type: float
+        :rtype: tuple of the list of (stream name, text) chunks, the new
+            position and whether the output is complete
+        """
+        with self._condition:
+            if position >= len(self._chunks) and not self._closed:
+                self._condition.wait(timeout)
+            chunks = self._chunks[position:]
+            return chunks, len(self._chunks), self._closed
+
+
+class Job(object):
+    """A command executed by a background thread."""
+    def __init__(self, job_id, line, func):
+        """
+        :param job_id: Number of the job.
+        :type: int
+        :param line: The command line, used in messages.
+        :type: str
+        :param func: A callable, which executes the command.
+        :type: callable
+        :rtype: None
+        """
+        self.id = job_id
+        self.line = line
+        self.state = JOB_RUNNING
+        self.output = JobOutput()
+        self.reported = False
+        self._func = func
+        self._executors = list()
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name='job-%s' % job_id)
+        self._thread.daemon = True
+        self._thread.job = self
+
+    def start(self):
+        """Start executing the job."""
+        self._thread.start()
+
+    def attach(self, executor):
+        """
+        Attach a fan-out executor, which runs the targets of the job.
+
+        The executor is cancelled together with the job and reports
+        the progress of the job.
+
+        :param executor: Executor started by the job.
+        :type: bac.executor.FanOutExecutor
+        :rtype: None
+        """
+        with self._lock:
+            self._executors.append(executor)
+            cancelled = self._cancelled
+        if cancelled:
+            executor.cancel()
+
+    def cancel(self):
+        """Cancel all of the pending and running targets of the job."""
+        with self._lock:
+            self._cancelled = True
+            executors = list(self._executors)
+        for executor in executors:
+            executor.cancel()
+
+    @property
+    def finished(self):
+        return self.state != JOB_RUNNING
+
+    @property
+    def progress(self):
+        """
+        Progress of the targets of the job.
+
+        :rtype: bac.executor.FanOutProgress
+        """
+        with self._lock:
+            executors = list(self._executors)
+        return sum((executor.progress for executor in executors),
+                   FanOutProgress())
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        state = JOB_DONE
+        try:
+            self._func()
+        except BACError as e:
+            log.error('Following exception has been raised: %s' % str(e))
+            state = JOB_FAILED
+        except Exception:
+            log.exception('Job [%s] failed.' % self.id)
+            state = JOB_FAILED
+        finally:
+            if self._cancelled:
+                state = JOB_KILLED
+            self.state = state
+            self.output.close()
+
+    def __str__(self):
+        progress = self.progress
+        summary = ''
+        if progress.total:
+            summary = ' (%s/%s targets' % (progress.finished, progress.total)
+            if progress.failed:
+                summary += ', %s failed' % progress.failed
+            summary += ')'
+        return '[%s] %s%s  %s' % (self.id, self.state, summary, self.line)
+
+
+class JobManager(object):
+    """
+    Starts the background jobs and handles the job control commands.
+
+    Finished jobs are kept until their output is printed by the "fg"
+    command.
+    """
+    def __init__(self):
+        self._jobs = dict()
+        self._next_id = 1
+        self._installed = False
+        self._commands = {
+            'jobs': self.list_jobs,
+            'fg': self.foreground,
+            'kill': self.kill,
+            }
+
+    @property
+    def jobs(self):
+        """Jobs sorted by their numbers."""
+        return [self._jobs[job_id] for job_id in sorted(self._jobs)]
+
+    @property
+    def progress(self):
+        """
+        Summed up progress of the running jobs.
+
+        :rtype: bac.executor.FanOutProgress
+        """
+        return sum((job.progress for job in self.jobs if not job.finished),
+                   FanOutProgress())
+
+    def start(self, line, func):
+        """
+        Execute the command in the background.
+
+        :param line: The command line, used in messages.
+        :type: str
+        :param func: A callable, which executes the command.
+        :type: callable
+        :rtype: bac.jobs.Job
+        """
+        self._install()
+        job = Job(self._next_id, line, func)
+        self._jobs[job.id] = job
+        self._next_id += 1
+        job.start()
+        print('[%s] %s' % (job.id, line))
+        return job
+
+    def report_finished(self):
+        """Print jobs, which have finished since the last report."""
+        for job in self.jobs:
+            if job.finished and not job.reported:
+                job.reported = True
+                print('[%s] %s  %s' % (job.id, job.state, job.line))
+
+    def handle_command(self, command, argv):
+        """Attempt to call a corresponding method for given command."""
+        handler = self._commands.get(command)
+        if handler is None:
+            return False
+        handler(argv)
+        return True
+
+    def list_jobs(self, argv):
+        """Lists background jobs with their progress."""
+        parser = ArgumentParser(prog=argv[0],
+                                description=JOB_COMMANDS[argv[0]])
+        try:
+            parser.parse_args(argv[1:])
+        except ArgumentParserDoneException:
+            return
+        for job in self.jobs:
+            print(job)
+
+    def foreground(self, argv):
+        """Prints the output of a job until it finishes."""
+        job = self._get_job(argv)
+        if job is None:
+            return
+        print(job.line)
+        position = 0
+        finished = False
+        while not finished:
+            try:
+                chunks, position, finished = job.output.read(
+                        position, EXECUTOR_POLL_INTERVAL)
+            except KeyboardInterrupt:
+                log.warning('Cancelling job [%s].' % job.id)
+                job.cancel()
+                continue
+            for name, text in chunks:
+                stream = sys.stderr if name == 'stderr' else sys.stdout
+                stream.write(text)
+                stream.flush()
+        job.wait()
+        job.reported = True
+        del self._jobs[job.id]
+        if job.state != JOB_DONE:
+            log.warning('Job [%s] %s.' % (job.id, job.state))
+
+    def kill(self, argv):
+        """Cancels a background job."""
+        job = self._get_job(argv)
+        if job is None:
+            return
+        if job.finished:
+            print('Job [%s] has already finished.' % job.id)
+            return
+        log.info('Cancelling job [%s].' % job.id)
+        job.cancel()
+
+    def _get_job(self, argv):
+        parser = ArgumentParser(prog=argv[0],
+                                description=JOB_COMMANDS[argv[0]])
+        parser.add_argument(
+                'job_id', nargs='?', type=int, metavar='JOB',
+                help='number of the job (default: the most recent job)')
+        try:
+            args = parser.parse_args(argv[1:])
+        except ArgumentParserDoneException:
+            return None
+        if not self._jobs:
+            print('No background jobs.')
+            return None
+        job_id = args.job_id if args.job_id is not None else max(self._jobs)
+        job = self._jobs.get(job_id)
+        if job is None:
+            print('No such job: %s' % job_id)
+        return job
+
+    def _install(self):
+        # Route the output of the job threads into their jobs
+        if self._installed:
+            return
+        stdout = _JobStream(sys.stdout, 'stdout')
+        stderr = _JobStream(sys.stderr, 'stderr')
+        for handler in logging.root.handlers:
+            stream = getattr(handler, 'stream', None)
+            if stream is sys.stdout:
+                handler.stream = stdout
+            elif stream is sys.stderr:
+                handler.stream = stderr
+        sys.stdout, sys.stderr = stdout, stderr
+        self._installed = True
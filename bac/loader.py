@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import logging
+import threading
+
+from bac.constants import EXECUTOR_POLL_INTERVAL
+
+log = logging.getLogger(__name__)
+
+
+class BackgroundLoader(object):
+    """
+    Loads independent pieces of BAC data by background threads.
+
+    The prompt can be shown before all of the data is loaded. Readers
+    of a piece of data wait only until that single piece is loaded.
+    """
+    def __init__(self):
+        self._events = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def loading(self):
+        """Names of the pieces of data, which are still being loaded."""
+        with self._lock:
+            return sorted(name for name, event in self._events.items()
+                          if not event.is_set())
+
+    def start(self, name, load):
+        """
+        Load a piece of data by a background thread.
+
+        If the same piece of data is still being loaded, it is loaded
+        again only once the previous load finishes.
+
+        :param name: Name of the loaded data, used in messages.
+        :type: str
+        :param load: A callable, which loads the data.
+        :type: callable
+        :rtype: None
+        """
+        event = threading.Event()
+        with self._lock:
+            previous = self._events.get(name)
+            self._events[name] = event
+
+        def run():
+            try:
+                if previous is not None:
+                    previous.wait()
+                load()
+            except Exception:
+                log.exception('Failed to load %s.' % name)
+            finally:
+                event.set()
+
+        thread = threading.Thread(target=run, name='load-%s' % name)
+        thread.daemon = True
+        thread.start()
+
+    def wait(self, name):
+        """
+        Wait until the piece of data is loaded.
+
+        :param name: Name of the loaded data.
+        :type: str
+        :rtype: None
+        """
+        with self._lock:
+            event = self._events.get(name)
+        if event is None or event.is_set():
+            return
+        log.info('Waiting for %s to load...' % name)
+        # Waiting with timeout keeps the main thread responsive
+        # to the KeyboardInterrupt.
+        while not event.wait(EXECUTOR_POLL_INTERVAL):
+            pass
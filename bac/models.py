@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+"""
+Process-wide cache of the botocore data and service models.
+
+Every botocore session loads and parses the JSON data files by its own
+loader, so the same service models are parsed again by the session of
+every profile. Sessions created by this module share a single loader
+and the parsed service models instead.
+"""
+import os
+import threading
+
+import botocore.session
+
+from botocore.loaders import create_loader
+
+_lock = threading.Lock()
+_loader = None
+_service_models = dict()
+
+
+class _SearchPaths(list):
+    """
+    Search paths of the shared loader.
+
+    Boto3 appends its data path into the loader of every boto3 session,
+    which would grow the paths of the shared loader without bounds.
+    """
+    def append(self, path):
+        if path not in self:
+            super(_SearchPaths, self).append(path)
+
+
+def get_loader():
+    """
+    Get the botocore data loader shared by all of the sessions.
+
+    :rtype: botocore.loaders.Loader
+    """
+    global _loader
+    with _lock:
+        if _loader is None:
+            # The aws-cli adds its data files into the AWS_DATA_PATH
+            loader = create_loader(os.environ.get('AWS_DATA_PATH'))
+            loader._search_paths = _SearchPaths(loader.search_paths)
+            _loader = loader
+        return _loader
+
+
+class Session(botocore.session.Session):
+    """
+    Botocore session sharing the data loader and the service models.
+
+    The service models are only parsed by the first session, which
+    requests them. The following sessions get the same model objects.
+    """
+    def __init__(self, *args, **kwargs):
+        super(Session, self).__init__(*args, **kwargs)
+        self.register_component('data_loader', get_loader())
+
+    def get_service_model(self, service_name, api_version=None):
+        key = (service_name, api_version)
+        with _lock:
+            model = _service_models.get(key)
+        if model is None:
+            model = super(Session, self).get_service_model(service_name,
+                                                           api_version)
+            with _lock:
+                model = _service_models.setdefault(key, model)
+        return model
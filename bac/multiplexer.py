@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import errno
+import os
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+
+from bac.constants import (EXECUTOR_POLL_INTERVAL, MULTIPLEXER_BUFFER_SIZE,
+                           MULTIPLEXER_READ_SIZE, PREFIX_ORDER_AS_COMPLETED)
+from bac.errors import BACError, CancelledException, TimeoutException
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_STDOUT = b'1'
+_STDERR = b'2'
+
+
+class OutputMultiplexer(object):
+    """
+    Prints outputs of concurrently executed targets line by line.
+
+    Every whole line printed by a target is prefixed with the profile
+    and region of the target, so that outputs of different targets
+    remain readable even if they interleave. Lines are either printed
+    as soon as they are complete ("as-completed"), or grouped by
+    targets and printed in the order of the targets ("ordered").
+
+    In the "ordered" mode, only the lines of the first unfinished
+    target are printed right away. Lines of the other targets are
+    buffered until all of the preceding targets finish. Buffers spill
+    over to temporary files once they exceed the buffer size, so that
+    the memory used by a single target stays bounded.
+    """
+    def __init__(self, targets, order=PREFIX_ORDER_AS_COMPLETED,
+                 buffer_size=MULTIPLEXER_BUFFER_SIZE, stdout=None,
+                 stderr=None):
+        """
+        :param targets: All targets, which are going to be executed.
+        :type: list
+        :param order: Either "as-completed" or "ordered".
+        :type: str
+        :param buffer_size: Maximum size (in bytes) of a single line
+            and of the in-memory buffer of a single target.
+        :type: int
+        :param stdout: Stream the standard output lines are printed
+            to. Standard output is used if not set.
+        :type: file
+        :param stderr: Stream the standard error lines are printed
+            to. Standard error output is used if not set.
+        :type: file
+        :rtype: None
+        """
+        self._indexes = dict((id(t), i) for i, t in enumerate(targets))
+        self._targets = list(targets)
+        self._ordered = order != PREFIX_ORDER_AS_COMPLETED
+        self._buffer_size = buffer_size
+        self._stdout = stdout
+        self._stderr = stderr
+        self._buffers = dict()
+        self._finished = set()
+        self._current = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args, targets):
+        """
+        Create multiplexer requested by BAC global arguments.
+
+        :param args: Namespace which contains BAC global arguments.
+        :type: argparse.Namespace
+        :param targets: All targets, which are going to be executed.
+        :type: list
+        :rtype: bac.multiplexer.OutputMultiplexer or None if no
+            multiplexing has been requested
+        """
+        order = getattr(args, 'prefix_order', None)
+        if not order:
+            return None
+        return cls(targets, order)
+
+    def execute(self, target, env=None):
+        """
+        Execute the target in a new process and multiplex its output.
+
+        :param target: Target to be executed.
+        :type: bac.executor.Target
+        :param env: Environment of the executed process.
+        :type: dict
+        :rtype: int
+        """
+        if fcntl is None:
+            raise BACError('Prefixed output is not supported on this'
+                           ' platform.')
+        process = subprocess.Popen(target.command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, env=env)
+        try:
+            self._pump(target, {process.stdout.fileno(): _STDOUT,
+                                process.stderr.fileno(): _STDERR})
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+            exit_code = process.wait()
+        return exit_code
+
+    def feed(self, target, out=None, err=None):
+        """
+        Multiplex an already captured output of the target.
+
+        :param target: The executed target.
+        :type: bac.executor.Target
+        :param out: Captured standard output.
+        :type: str
+        :param err: Captured standard error output.
+        :type: str
+        :rtype: None
+        """
+        for text, stream in ((out, _STDOUT), (err, _STDERR)):
+            if not text:
+                continue
+            for line in text.splitlines(True):
+                self._emit(target, stream, line)
+
+    def finish(self, target):
+        """
+        Mark the target as finished.
+
+        Buffered lines of the following targets may be printed,
+        once all of their preceding targets finish.
+
+        :param target: The finished target.
+        :type: bac.executor.Target
+        :rtype: None
+        """
+        with self._lock:
+            self._finished.add(self._indexes[id(target)])
+            while self._current in self._finished:
+                self._current += 1
+                self._flush(self._current)
+
+    def close(self):
+        """Print lines of all targets, which have not finished."""
+        with self._lock:
+            for index in sorted(self._buffers):
+                self._flush(index)
+            self._current = len(self._targets)
+
+    def _pump(self, target, streams):
+        for fd in streams:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        partial = dict((fd, b'') for fd in streams)
+
+        while partial:
+            if target.cancelled.is_set():
+                raise CancelledException('Command has been cancelled')
+            wait = target.remaining(EXECUTOR_POLL_INTERVAL)
+            if wait <= 0:
+                raise TimeoutException('Deadline of the command exceeded')
+            ready, _, _ = select.select(list(partial), [], [], wait)
+            for fd in ready:
+                try:
+                    data = os.read(fd, MULTIPLEXER_READ_SIZE)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        continue
+                    raise
+                if not data:
+                    # Stream closed, print its unterminated last line
+                    if partial[fd]:
+                        self._emit(target, streams[fd],
+                                   self._decode(partial[fd]))
+                    del partial[fd]
+                    continue
+                lines = (partial[fd] + data).split(b'\n')
+                partial[fd] = lines.pop()
+                while len(partial[fd]) >= self._buffer_size:
+                    # Do not let a single endless line exhaust the memory
+                    lines.append(partial[fd][:self._buffer_size])
+                    partial[fd] = partial[fd][self._buffer_size:]
+                for line in lines:
+                    self._emit(target, streams[fd], self._decode(line))
+
+    def _decode(self, data):
+        return data.decode('utf-8', 'replace')
+
+    def _emit(self, target, stream, line):
+        if not line.endswith('\n'):
+            line += '\n'
+        index = self._indexes[id(target)]
+        with self._lock:
+            if not self._ordered or index == self._current:
+                self._write(index, stream, line)
+                return
+            buffer = self._buffers.get(index)
+            if buffer is None:
+                buffer = tempfile.SpooledTemporaryFile(
+                        max_size=self._buffer_size, mode='w+b')
+                self._buffers[index] = buffer
+            buffer.write(stream + line.encode('utf-8'))
+
+    def _flush(self, index):
+        # Must be called while holding the lock
+        buffer = self._buffers.pop(index, None)
+        if buffer is None:
+            return
+        with buffer:
+            buffer.seek(0)
+            for data in buffer:
+                self._write(index, data[:1], data[1:].decode('utf-8'))
+
+    def _write(self, index, stream, line):
+        # Must be called while holding the lock
+        target = self._targets[index]
+        if stream == _STDERR:
+            output = self._stderr or sys.stderr
+        else:
+            output = self._stdout or sys.stdout
+        output.write('[%s/%s] %s' % (target.profile, target.region, line))
+        output.flush()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import sys
+import threading
+
+from collections import OrderedDict
+
+from bac.constants import OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_JSONL
+
+
+class AggregateOutput(object):
+    """
+    Merges outputs of all fan-out targets into a single document.
+
+    Every finished target is written as a record annotated with its
+    profile, account and region. Records are written as soon as their
+    targets finish, either as items of a single JSON array, or as
+    a JSON Lines stream with one record per line.
+    """
+    def __init__(self, output_format, account_names=None, stream=None):
+        """
+        :param output_format: Either "json" or "jsonl".
+        :type: str
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :param stream: Stream the records are written to. Standard
+            output is used if not set.
+        :type: file
+        :rtype: None
+        """
+        self._format = output_format
+        self._account_names = account_names or dict()
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._written = 0
+
+    @classmethod
+    def from_args(cls, args, account_names=None):
+        """
+        Create aggregate output requested by BAC global arguments.
+
+        :param args: Namespace which contains BAC global arguments.
+        :type: argparse.Namespace
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :rtype: bac.output.AggregateOutput or None if no aggregate
+            output has been requested
+        """
+        output_format = getattr(args, 'output_format', None)
+        if not output_format:
+            return None
+        return cls(output_format, account_names)
+
+    def open(self):
+        """Start the output document."""
+        self._written = 0
+        if self._format == OUTPUT_FORMAT_JSON:
+            self._write('[')
+
+    def close(self):
+        """Finish the output document."""
+        if self._format == OUTPUT_FORMAT_JSON:
+            self._write('\n]\n' if self._written else ']\n')
+
+    def write(self, result):
+        """
+        Write the record of a finished target.
+
+        :param result: Result of the finished target.
+        :type: bac.executor.TargetResult
+        :rtype: None
+        """
+        record = self.make_record(result)
+        with self._lock:
+            if self._format == OUTPUT_FORMAT_JSONL:
+                self._write('%s\n' % json.dumps(record, ensure_ascii=False))
+            else:
+                lines = json.dumps(record, indent=4,
+                                   ensure_ascii=False).splitlines()
+                separator = ',\n' if self._written else '\n'
+                self._write(separator + '\n'.join(
+                        '    %s' % line for line in lines))
+            self._written += 1
+
+    def make_record(self, result):
+        """
+        Annotate output of a finished target with its origin.
+
+        :param result: Result of the finished target.
+        :type: bac.executor.TargetResult
+        :rtype: collections.OrderedDict
+        """
+        target = result.target
+        record = OrderedDict()
+        record['profile'] = target.profile
+        record['account'] = self._account_names.get(target.profile)
+        record['region'] = target.region
+        record['exit_code'] = result.exit_code
+        record['output'] = self._parse_output(result.out)
+        if result.failed and result.err:
+            record['error'] = result.err.strip()
+        return record
+
+    def _parse_output(self, out):
+        if not out or not out.strip():
+            return None
+        try:
+            return json.loads(out)
+        except ValueError:
+            # Output other than JSON was requested from the aws-cli
+            return out
+
+    def _write(self, text):
+        stream = self._stream or sys.stdout
+        stream.write(text)
+        stream.flush()
@@ -2,21 +2,138 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright © 2020, GoodData(R) Corporation. All rights reserved.
 import boto3
+import fnmatch
 import logging
 import os
+import threading
+import time
 
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
-from six.moves.configparser import (ParsingError, RawConfigParser,
-                                    NoOptionError)
+from six.moves import collections_abc
+from six.moves.configparser import ParsingError, RawConfigParser
 
 from bac.constants import (CONFIG_FILE, CONFIG_PATH, CREDS_FILE, CREDS_PATH,
-                           EC2_REGIONS_JMES)
+                           EC2_REGIONS_JMES, IDENTITY_CACHE_TTL,
+                           PROFILE_DISCOVERY_CONNECT_TIMEOUT,
+                           PROFILE_DISCOVERY_ORGANIZATION_PROBES,
+                           PROFILE_DISCOVERY_READ_TIMEOUT,
+                           PROFILE_DISCOVERY_RETRIES,
+                           PROFILE_DISCOVERY_WORKERS)
+from bac import models
 from bac.errors import ConfigParsingException, NoProfilesError
+from bac.identity_cache import hash_files
 
 log = logging.getLogger(__name__)
 env = os.environ
 AWS_CREDENTIALS = os.path.expanduser(env.get(CREDS_FILE, CREDS_PATH))
 AWS_CONFIG = os.path.expanduser(env.get(CONFIG_FILE, CONFIG_PATH))
+# A single unreachable endpoint must not hold up the startup
+DISCOVERY_CONFIG = Config(connect_timeout=PROFILE_DISCOVERY_CONNECT_TIMEOUT,
+                          read_timeout=PROFILE_DISCOVERY_READ_TIMEOUT,
+                          retries={'max_attempts': PROFILE_DISCOVERY_RETRIES})
+
+
+def _get_mtimes():
+    """Modification times of the AWS credentials and config files."""
+    mtimes = list()
+    for path in (AWS_CREDENTIALS, AWS_CONFIG):
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+class LazySessions(collections_abc.Mapping):
+    """
+    Boto3 sessions of the profiles, created on their first use.
+
+    Names of all of the profiles are known right away, while every
+    session is only created once it is used. If the number of live
+    sessions is capped, the least recently used sessions are dropped,
+    and created again once they are used.
+    """
+    def __init__(self, profiles=(), max_sessions=None, role_credentials=None):
+        """
+        :param profiles: Names of the profiles.
+        :type: list
+        :param max_sessions: Maximum number of live sessions. Unlimited
+            if not set.
+        :type: int
+        :param role_credentials: Cache of the assumed-role credentials,
+            injected into the created sessions.
+        :type: bac.role_credentials.RoleCredentialCache
+        :rtype: None
+        """
+        self._profiles = OrderedDict((profile, None) for profile in profiles)
+        self._sessions = OrderedDict()
+        self._max_sessions = max_sessions
+        self._role_credentials = role_credentials
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    @property
+    def live(self):
+        """Number of currently created sessions."""
+        return len(self._sessions)
+
+    def add(self, profile):
+        """Add a profile, whose session is created on its first use."""
+        with self._lock:
+            self._profiles[profile] = None
+
+    def remove(self, profile):
+        """Remove a profile together with its session."""
+        with self._lock:
+            self._profiles.pop(profile, None)
+            self._sessions.pop(profile, None)
+            self._failed.discard(profile)
+
+    def __getitem__(self, profile):
+        if profile not in self._profiles:
+            raise KeyError(profile)
+        with self._lock:
+            session = self._sessions.pop(profile, None)
+            if session is not None:
+                # The most recently used sessions are the last ones
+                self._sessions[profile] = session
+                return session
+        log.debug('Creating session of %s profile.' % profile)
+        try:
+            session = boto3.session.Session(
+                    botocore_session=models.Session(), profile_name=profile)
+        except BotoCoreError as e:
+            with self._lock:
+                # Logged only once, the profile is used repeatedly
+                first = profile not in self._failed
+                self._failed.add(profile)
+            if first:
+                log.warning('Failed to load %s profile.'
+                            ' Following error was raised: %s'
+                            % (profile, str(e)))
+            raise
+        if self._role_credentials is not None:
+            self._role_credentials.inject(session._session)
+        with self._lock:
+            session = self._sessions.pop(profile, session)
+            self._sessions[profile] = session
+            while self._max_sessions and (len(self._sessions)
+                                          > self._max_sessions):
+                self._sessions.popitem(last=False)
+        return session
+
+    def __contains__(self, profile):
+        return profile in self._profiles
+
+    def __iter__(self):
+        return iter(list(self._profiles))
+
+    def __len__(self):
+        return len(self._profiles)
 
 
 class ProfileManager(object):
@@ -24,22 +141,97 @@ class ProfileManager(object):
     Loads and manages available profiles and regions.
 
     ProfileManager is initialized by parsing the AWS credentials and
-    config files, initializing a Boto3 Session object for each
-    profile, and receiving list of available regions.
+    config files, and receiving list of available regions. A Boto3
+    Session object of every profile is created on its first use.
+    Accounts of the profiles are loaded concurrently by a bounded
+    pool of threads. If the identity cache is given, accounts cached
+    by the previous runs are used instead, and only revalidated in the
+    background once they are older than their TTL. If the loader is
+    given, accounts and available regions are loaded in the background,
+    right after the files are parsed. Once the files change, only the
+    added, removed and changed profiles are loaded again by the reload
+    method. If the cache of the assumed-role
+    credentials is given, roles are assumed into it once, before the
+    targets of the role profiles are executed.
 
     It is responsible for managing the state of active profiles and
     regions, which then affect the rest of BAC logic.
     """
-    def __init__(self):
+    def __init__(self, identity_cache=None, loader=None, max_sessions=None,
+                 role_credentials=None):
+        """
+        :param identity_cache: Local cache of the accounts of the
+            profiles.
+        :type: bac.identity_cache.IdentityCache
+        :param loader: Loader of the accounts and regions, which loads
+            them in the background.
+        :type: bac.loader.BackgroundLoader
+        :param max_sessions: Maximum number of live sessions, the least
+            recently used ones are dropped. Unlimited if not set.
+        :type: int
+        :param role_credentials: Cache of the assumed-role credentials,
+            shared with the aws-cli subprocesses.
+        :type: bac.role_credentials.RoleCredentialCache
+        :rtype: None
+        """
         self.active_profiles = set()
         self.active_regions = set()
-        self.account_names = dict()
+        self._account_names = dict()
+        self._account_ids = dict()
+        self._available_regions = None
+        self._user_profiles = list()
+        self._role_profiles = set()
+        self._identity_cache = identity_cache
+        self._loader = loader
+        self._max_sessions = max_sessions
+        self._role_credentials = role_credentials
+        self._files_mtimes = _get_mtimes()
+        self._files_hash = hash_files([AWS_CREDENTIALS, AWS_CONFIG])
+        try:
+            self._profiles = self._read_profiles()
+        except ConfigParsingException:
+            self._profiles = dict()
         self._load_users()
-        self._load_account_names()
-        self._load_roles()
-        self._load_regions()
+        if loader is None:
+            self._load_account_names()
+            self._load_roles()
+            self._load_regions()
+        else:
+            self._load_roles()
+            loader.start('accounts', self._load_account_names)
+            loader.start('regions', self._load_regions)
         self._initialize_cmd_dicts()
 
+    @property
+    def account_names(self):
+        """Account (or role) names of the profiles."""
+        self._wait('accounts')
+        return self._account_names
+
+    @account_names.setter
+    def account_names(self, account_names):
+        self._account_names = account_names
+
+    @property
+    def account_ids(self):
+        """Account IDs of the profiles."""
+        self._wait('accounts')
+        return self._account_ids
+
+    @account_ids.setter
+    def account_ids(self, account_ids):
+        self._account_ids = account_ids
+
+    @property
+    def available_regions(self):
+        """Regions available to the profiles."""
+        self._wait('regions')
+        return self._available_regions
+
+    @available_regions.setter
+    def available_regions(self, available_regions):
+        self._available_regions = available_regions
+
     def get_first_profile(self):
         """
         Returns first profile from loaded profiles.
@@ -57,6 +249,93 @@ class ProfileManager(object):
         """
         return next(iter(self.sessions.values()))
 
+    def assume_roles(self, profiles):
+        """
+        Assume the roles of the profiles, which have not been assumed yet.
+
+        The roles are assumed in parallel, into the credential cache
+        shared with the aws-cli subprocesses. Roles requiring an MFA
+        code are not assumed.
+
+        :param profiles: Profiles of the executed targets.
+        :type: iterable
+        :rtype: None
+        """
+        if self._role_credentials is None:
+            return
+        pending = [profile for profile in set(profiles)
+                   if profile in self._role_profiles
+                   and not self._role_credentials.is_assumed(profile)]
+        self._map(self._assume_role, pending)
+
+    def _assume_role(self, profile):
+        try:
+            session = self.sessions[profile]
+        except BotoCoreError:
+            # Logged by the sessions
+            return
+        self._role_credentials.assume(profile, session)
+
+    def reload(self):
+        """
+        Reload the profiles, if the credentials or config file changed.
+
+        The files are only hashed once their modification time changes.
+        Sessions of the removed and changed profiles are dropped, and
+        accounts of the added and changed profiles are identified again,
+        without waiting for the accounts still being discovered.
+        Removed profiles are deactivated.
+
+        :rtype: bool, whether any of the profiles has changed
+        """
+        mtimes = _get_mtimes()
+        if mtimes == self._files_mtimes:
+            return False
+        files_hash = hash_files([AWS_CREDENTIALS, AWS_CONFIG])
+        if files_hash == self._files_hash:
+            self._files_mtimes = mtimes
+            return False
+        try:
+            profiles = self._read_profiles()
+        except ConfigParsingException as e:
+            log.warning('Failed to reload the profiles: %s' % str(e))
+            return False
+        self._files_mtimes, self._files_hash = mtimes, files_hash
+        previous, self._profiles = self._profiles, profiles
+        removed = set(previous).difference(profiles)
+        added = set(profiles).difference(previous)
+        changed = set(profile for profile in profiles
+                      if profile in previous
+                      and profiles[profile] != previous[profile])
+        if not (removed or added or changed):
+            return False
+        log.info('Reloading profiles: %s added, %s removed, %s changed.'
+                 % (len(added), len(removed), len(changed)))
+        for profile in removed.union(changed):
+            self._remove_profile(profile)
+        if isinstance(self.active_profiles, set):
+            # Profiles activated by "*" are a view of the sessions
+            self.active_profiles.difference_update(removed)
+        users = list()
+        for profile in sorted(added.union(changed)):
+            credentials, config = profiles[profile]
+            self.sessions.add(profile)
+            if credentials is not None:
+                users.append(profile)
+            elif config is not None:
+                self._add_role(profile, dict(config))
+        self._user_profiles.extend(users)
+        self._recache_accounts(users, files_hash)
+
+        def identify():
+            self._discover_accounts(users, files_hash)
+
+        if self._loader is None:
+            identify()
+        elif users:
+            self._loader.start('accounts', identify)
+        return True
+
     def list_available_accounts(self):
         """Lists all currently available accounts."""
         if self.account_names:
@@ -131,6 +410,45 @@ class ProfileManager(object):
         else:
             self.active_regions = self.active_regions.difference(regions)
 
+    def deduplicate_profiles(self, profiles, preferences=None):
+        """
+        Pick a single representative profile of every distinct account.
+
+        Profiles of unknown accounts are always kept.
+
+        :param profiles: Profiles to be deduplicated.
+        :type: set
+        :param preferences: Patterns (shell-style wildcards) of profile
+            names in the order of preference. Profiles matching none
+            of the patterns are the least preferred, ties are broken
+            by the profile names.
+        :type: list
+        :rtype: set
+        """
+        preferences = preferences or list()
+
+        def rank(profile):
+            for index, pattern in enumerate(preferences):
+                if fnmatch.fnmatchcase(profile, pattern):
+                    return index, profile
+            return len(preferences), profile
+
+        representatives = dict()
+        deduplicated = set()
+        for profile in sorted(profiles, key=rank):
+            account_id = self.account_ids.get(profile)
+            if account_id is None:
+                deduplicated.add(profile)
+            elif account_id not in representatives:
+                representatives[account_id] = profile
+                deduplicated.add(profile)
+            else:
+                log.debug('Skipping profile "%s", account %s is already'
+                          ' covered by profile "%s".'
+                          % (profile, account_id,
+                             representatives[account_id]))
+        return deduplicated
+
     def handle_command(self, command, args):
         """Attempt to call a corresponding method for given command."""
         cmd = self._cmd_argless.get(command, None)
@@ -157,8 +475,8 @@ class ProfileManager(object):
 
     def _load_users(self):
         """
-        Load AWS profiles from aws credentials file and create
-        a seperate aws session for each profile.
+        Load AWS profiles from aws credentials file. Their aws
+        sessions are created once they are used.
         """
         credentials = RawConfigParser()
 
@@ -173,25 +491,18 @@ class ProfileManager(object):
         if 'default' in profile_creds:
             profile_creds.remove('default')
 
-        self.sessions = dict()
-        for profile in profile_creds:
-            try:
-                self.sessions[profile] = (
-                        boto3.session.Session(profile_name=profile))
-            except BotoCoreError as e:
-                log.warning('Failed to load %s profile.'
-                            ' Following error was raised: %s'
-                            % (profile, str(e)))
-
+        self.sessions = LazySessions(profile_creds, self._max_sessions,
+                                     self._role_credentials)
         if not self.sessions:
             log.error('No valid profiles found in %s. Exiting BAC.'
                       % AWS_CREDENTIALS)
             raise NoProfilesError()
+        self._user_profiles = list(self.sessions)
 
     def _load_roles(self):
         """
-        Load assumable roles from aws config file and create
-        a separate aws session for each such role.
+        Load assumable roles from aws config file. Their aws
+        sessions are created once they are used.
         """
         config = RawConfigParser()
 
@@ -205,38 +516,213 @@ class ProfileManager(object):
         for section in config.sections():
             if 'profile' in section and config.has_option(section, 'role_arn'):
                 profile = section.split()[1]
-                self.sessions[profile] = boto3.session.Session(
-                                                    profile_name=profile)
-                # as role name set the user defined session name
-                try:
-                    self.account_names[profile] = config.get(
-                            section, 'role_session_name')
-                # if not defined, extract role name from ARN
-                except NoOptionError:
-                    role_name = config.get(section, 'role_arn').split('/')[-1]
-                    self.account_names[profile] = role_name
+                self.sessions.add(profile)
+                self._add_role(profile, dict(config.items(section)))
+
+    def _add_role(self, profile, options):
+        """Register the role profile and its account from its options."""
+        if 'mfa_serial' not in options:
+            # The MFA code could only be prompted from a worker thread,
+            # so these roles are left to the aws-cli and the sessions
+            self._role_profiles.add(profile)
+        # ARN of the role contains the ID of its account
+        arn = options['role_arn'].split(':')
+        if len(arn) > 4 and arn[4]:
+            self._account_ids[profile] = arn[4]
+        # as role name set the user defined session name, if not
+        # defined, extract role name from ARN
+        self._account_names[profile] = options.get(
+                'role_session_name', options['role_arn'].split('/')[-1])
+
+    def _remove_profile(self, profile):
+        self.sessions.remove(profile)
+        self._account_ids.pop(profile, None)
+        self._account_names.pop(profile, None)
+        self._role_profiles.discard(profile)
+        if profile in self._user_profiles:
+            self._user_profiles.remove(profile)
+        if self._role_credentials is not None:
+            self._role_credentials.discard(profile)
+
+    def _read_profiles(self):
+        """
+        Parse the options of the profiles from the AWS files.
+
+        :rtype: dict of the profile to the tuple of its sorted options
+            from the credentials file and the config file, either may
+            be None
+        """
+        credentials = RawConfigParser()
+        config = RawConfigParser()
+        self._parse_file(credentials, AWS_CREDENTIALS)
+        if os.path.exists(AWS_CONFIG):
+            self._parse_file(config, AWS_CONFIG)
+
+        profiles = dict()
+        for section in credentials.sections():
+            if section != 'default':
+                profiles[section] = (
+                        tuple(sorted(credentials.items(section))), None)
+        for section in config.sections():
+            if not section.startswith('profile '):
+                continue
+            profile = section.split()[1]
+            options = tuple(sorted(config.items(section)))
+            if profile in profiles:
+                profiles[profile] = profiles[profile][0], options
+            elif config.has_option(section, 'role_arn'):
+                profiles[profile] = None, options
+        return profiles
+
+    def _recache_accounts(self, excluded, files_hash):
+        # Cached accounts are only valid for the hash of the files
+        if self._identity_cache is None:
+            return
+        self._identity_cache.put(files_hash, dict(
+                (profile, (self._account_ids[profile],
+                           self._account_names[profile]))
+                for profile in self._user_profiles
+                if profile not in excluded and profile in self._account_ids))
 
     def _load_account_names(self):
         """Load account/role names."""
-        accounts = dict()
-        for profile, session in self.sessions.items():
-            account_id = session.client('sts') \
-                         .get_caller_identity() \
-                         .get('Account')
-            account_name = self._get_account_name(session, account_id)
-            self.account_names[profile] = (
-                    accounts.get(account_id, account_name))
+        files_hash = cached = None
+        if self._identity_cache is not None:
+            files_hash = hash_files([AWS_CREDENTIALS, AWS_CONFIG])
+            cached = self._identity_cache.get(files_hash)
+        missing = list()
+        stale = list()
+        for profile in self._user_profiles:
+            if not cached or profile not in cached:
+                missing.append(profile)
+                continue
+            account_id, account_name, updated = cached[profile]
+            self._account_ids[profile] = account_id
+            self._account_names[profile] = account_name
+            if time.time() - updated >= IDENTITY_CACHE_TTL:
+                stale.append(profile)
+
+        self._discover_accounts(missing, files_hash)
+        if stale:
+            log.debug('Revalidating cached accounts of %s profiles.'
+                      % len(stale))
+            thread = threading.Thread(target=self._discover_accounts,
+                                      args=(stale, files_hash))
+            thread.daemon = True
+            thread.start()
+
+    def _discover_accounts(self, profiles, files_hash=None):
+        if not profiles:
+            return
+        # Profiles may be reloaded while their accounts are discovered
+        options = dict((profile, self._profiles.get(profile))
+                       for profile in profiles)
+        accounts = self._map(self._get_account_id, profiles)
+        identified = [(profile,) + account
+                      for profile, account in zip(profiles, accounts)
+                      if account is not None]
+
+        index = self._list_organization_accounts(identified)
+        # Accounts outside of the listed organization
+        unresolved = [(profile, session, account_id)
+                      for profile, session, account_id in identified
+                      if account_id not in index]
+        names = self._map(self._describe_account_name, unresolved)
+        index.update((account_id, name) for (_, _, account_id), name
+                     in zip(unresolved, names))
+
+        discovered = dict()
+        for profile, _, account_id in identified:
+            if self._profiles.get(profile) != options[profile]:
+                log.debug('Dropping the account of reloaded %s profile.'
+                          % profile)
+                continue
+            account = account_id, index.get(account_id, account_id)
+            self._account_ids[profile], self._account_names[profile] = account
+            discovered[profile] = account
+        if self._identity_cache is not None:
+            self._identity_cache.put(files_hash, discovered)
+
+    def _get_account_id(self, profile):
+        try:
+            session = self.sessions[profile]
+            return session, session.client('sts', config=DISCOVERY_CONFIG) \
+                                   .get_caller_identity() \
+                                   .get('Account')
+        except (BotoCoreError, ClientError) as e:
+            log.warning('Failed to load the account of %s profile.'
+                        ' Following error was raised: %s'
+                        % (profile, str(e)))
+            return None
+
+    def _list_organization_accounts(self, identified):
+        """
+        Index names of all accounts of the organization.
+
+        A single profile of every account is asked to list the accounts
+        of its organization, a few of them at once, until one of them
+        is allowed to. The accounts are then listed only once.
+
+        :param identified: Profiles, their sessions and account IDs.
+        :type: list of tuples
+        :rtype: dict of account IDs to account names
+        """
+        probes = list()
+        probed_accounts = set()
+        for profile, session, account_id in identified:
+            if account_id not in probed_accounts:
+                probed_accounts.add(account_id)
+                probes.append((profile, session))
+        for start in range(0, len(probes),
+                           PROFILE_DISCOVERY_ORGANIZATION_PROBES):
+            batch = probes[start:start + PROFILE_DISCOVERY_ORGANIZATION_PROBES]
+            for (profile, _), accounts in zip(
+                    batch, self._map(self._list_accounts, batch)):
+                if accounts is not None:
+                    log.debug('Listed %s organization accounts with %s'
+                              ' profile.' % (len(accounts), profile))
+                    return dict((account['Id'], account['Name'])
+                                for account in accounts)
+        return dict()
+
+    def _list_accounts(self, item):
+        profile, session = item
+        client = session.client('organizations', config=DISCOVERY_CONFIG)
+        try:
+            pages = client.get_paginator('list_accounts').paginate()
+            return list(pages.search('Accounts[]'))
+        except (BotoCoreError, ClientError) as e:
+            log.debug('Failed to list organization accounts with %s'
+                      ' profile: %s' % (profile, str(e)))
+            return None
+
+    def _describe_account_name(self, item):
+        _, session, account_id = item
+        return self._get_account_name(session, account_id)
+
+    def _map(self, func, items):
+        """Call the function for every item by a bounded thread pool."""
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        pool = ThreadPool(min(PROFILE_DISCOVERY_WORKERS, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
 
     def _get_account_name(self, session, account_id):
         """
         Attempt to get AWS Account name. Store Account ID on failure.
         """
         try:
-            account_name = session.client('organizations') \
+            account_name = session.client('organizations',
+                                          config=DISCOVERY_CONFIG) \
                            .describe_account(AccountId=account_id) \
                            .get('Account') \
                            .get('Name')
-        except ClientError:
+        except (BotoCoreError, ClientError):
             # If the script user does not have satisfactory privileges
             # needed in order to call the AWS Organizations API,
             # store only the AWS Account ID
@@ -255,16 +741,18 @@ class ProfileManager(object):
         return valid
 
     def _load_regions(self):
-        self.available_regions = None
-        for profile, session in self.sessions.items():
-            ec2 = session.client('ec2', region_name='us-east-1')
+        self._available_regions = None
+        for profile in self.sessions:
             try:
+                ec2 = self.sessions[profile].client(
+                        'ec2', region_name='us-east-1',
+                        config=DISCOVERY_CONFIG)
                 regions = ec2.describe_regions(AllRegions=True)
-            except ClientError:
+            except (BotoCoreError, ClientError):
                 log.debug('Failed to load regions with %s session.' % profile)
                 continue
             parsed = EC2_REGIONS_JMES.search(regions)
-            self.available_regions = set(parsed)
+            self._available_regions = set(parsed)
             return
 
     def _check_profiles(self, profiles):
@@ -276,6 +764,10 @@ class ProfileManager(object):
                         % ', '.join(invalid))
         return valid
 
+    def _wait(self, name):
+        if self._loader is not None:
+            self._loader.wait(name)
+
     def _initialize_cmd_dicts(self):
         self._cmd_argless = {
             'list-available-profiles': self.list_available_profiles,
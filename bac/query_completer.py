@@ -8,7 +8,6 @@ import jmespath
 
 from botocore.exceptions import UnknownServiceError
 from botocore.model import OperationNotFoundError
-from botocore.session import Session
 from intervaltree import IntervalTree
 from prompt_toolkit.completion import Completer, Completion
 from six import text_type
@@ -16,6 +15,7 @@ from six import text_type
 from bac.data_tables import build_command_table
 from bac.errors import (
         InvalidShapeData, ModelLoadingError, NullIntervalException)
+from bac.models import Session
 from bac.shape_parser import ShapeParser
 
 _FIND_IDENTIFIER = re.compile(r'\w*')
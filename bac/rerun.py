@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import logging
+
+from bac.constants import RERUN_COMMANDS
+from bac.errors import ArgumentParserDoneException
+from bac.executor import Target
+from bac.utils import ArgumentParser
+
+log = logging.getLogger(__name__)
+
+
+class LastFanOut(object):
+    """
+    Remembers the per-target outcome of the most recent fan-out.
+
+    Both the aws-cli commands and the command batches record their
+    results together with a callable, which re-dispatches a list of
+    targets the same way as the original fan-out did. The
+    "rerun-failed" command then re-executes only the failed profile
+    and region targets, instead of the whole command.
+    """
+    def __init__(self):
+        self._description = None
+        self._results = list()
+        self._dispatch = None
+        self._commands = {
+            'rerun-failed': self.rerun_failed,
+            }
+
+    def record(self, description, results, dispatch):
+        """
+        Remember the outcome of a finished fan-out.
+
+        :param description: The executed command, used in messages.
+        :type: str
+        :param results: Results of all of the fan-out targets.
+        :type: list of bac.executor.TargetResult
+        :param dispatch: A callable, which receives a list of targets,
+            executes them as the original fan-out did and returns
+            their results.
+        :type: callable
+        :rtype: None
+        """
+        self._description = description
+        self._results = list(results)
+        self._dispatch = dispatch
+
+    @property
+    def failed(self):
+        """Targets of the last fan-out, which have failed."""
+        return [result.target for result in self._results
+                if result is not None and result.failed]
+
+    def handle_command(self, command, argv):
+        """Attempt to call a corresponding method for given command."""
+        handler = self._commands.get(command)
+        if handler is None:
+            return False
+        handler(argv)
+        return True
+
+    def rerun_failed(self, argv):
+        """Re-executes failed targets of the last fan-out."""
+        parser = ArgumentParser(
+                prog=argv[0], description=RERUN_COMMANDS[argv[0]])
+        parser.add_argument(
+                '--list', '-l', action='store_true', dest='list',
+                help='only list the failed targets')
+        try:
+            args = parser.parse_args(argv[1:])
+        except ArgumentParserDoneException:
+            return
+
+        if self._dispatch is None:
+            print('No command has been executed yet.')
+            return
+        failed = self.failed
+        if not failed:
+            print('No targets of "%s" have failed.' % self._description)
+            return
+        if args.list:
+            for target in failed:
+                print('%s/%s\t%s' % (target.profile, target.region,
+                                     ' '.join(target.command)))
+            return
+
+        log.info('Re-executing %s failed targets of "%s".'
+                 % (len(failed), self._description))
+        # Fresh targets, since the cancellation of the old ones is final
+        targets = [Target(list(t.command), t.profile, t.region)
+                   for t in failed]
+        results = self._dispatch(targets)
+        if results is not None:
+            self.record(self._description, results, self._dispatch)
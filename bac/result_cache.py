@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import logging
+import sqlite3
+import time
+
+from bac.constants import (READ_ONLY_OPERATIONS, RESULT_CACHE_MAX_AGE,
+                           RESULT_CACHE_PATH, SECRET_OPERATIONS)
+from bac.errors import BACError
+from bac.executor import TargetResult
+from bac.utils import Database, extract_positional_args, is_read_only
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    service TEXT NOT NULL,
+    created REAL NOT NULL,
+    exit_code INTEGER,
+    out TEXT,
+    err TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_service ON entries (service);
+'''
+
+# Whether the outputs of the operations contain sensitive data
+_sensitive_outputs = dict()
+
+
+def get_cache_ttl(args):
+    """
+    Get the maximum age of the served results, if the cache is enabled.
+
+    The cache is disabled by a zero TTL and bypassed by ``--bac-no-cache``.
+    A disabled or bypassed cache is neither read, nor written, nor
+    invalidated.
+
+    :param args: Parsed global arguments of BAC.
+    :type: argparse.Namespace
+    :rtype: float, or None if the cache is disabled
+    """
+    ttl = getattr(args, 'cache_ttl', None)
+    if not ttl or ttl <= 0 or getattr(args, 'no_cache', False):
+        return None
+    return ttl
+
+
+def classify_command(checker, command):
+    """
+    Classify the aws-cli command by the operation it calls.
+
+    The operation is resolved by the checker, the same way as for
+    the boto3 engine. Operations, which only describe, list or get
+    resources, are read-only. Results of the read-only operations
+    are cacheable, unless they stream their output into a file,
+    or return secrets, e.g. credentials.
+
+    :param checker: The checker object used to resolve the command.
+    :type: bac.checker.CLIChecker
+    :param command: aws-cli command.
+    :type: list
+    :rtype: tuple of the service name, whether the command is
+        read-only and whether its results are cacheable, or None
+        if the service of the command is unknown
+    """
+    positionals = extract_positional_args(command)
+    service = positionals[1] if len(positionals) > 1 else None
+    try:
+        call = checker.resolve(command[1:])
+    except BACError as e:
+        # The command may still modify resources of the service
+        log.debug('Failed to resolve the command "%s": %s'
+                  % (' '.join(command), str(e)))
+        if service is None:
+            return None
+        # Botocore does not recognize the "s3api"
+        return 's3' if service == 's3api' else service, False, False
+    if call is None:
+        # High-level "aws s3" commands are not botocore operations
+        if service is None:
+            return None
+        read_only = is_read_only(command)
+        return service, read_only, read_only
+    read_only = call.operation_name.startswith(READ_ONLY_OPERATIONS)
+    return call.service_name, read_only, read_only and is_cacheable(call)
+
+
+def is_cacheable(call):
+    """
+    Whether the results of the read-only operation call may be cached.
+
+    :param call: Resolved operation call.
+    :type: bac.checker.OperationCall
+    :rtype: bool
+    """
+    if (call.service_name, call.operation_name) in SECRET_OPERATIONS:
+        return False
+    model = call.operation_model
+    if model is None:
+        return True
+    if model.has_streaming_output:
+        return False
+    key = (call.service_name, call.operation_name)
+    if key not in _sensitive_outputs:
+        _sensitive_outputs[key] = _is_sensitive(model.output_shape, set())
+    return not _sensitive_outputs[key]
+
+
+def _is_sensitive(shape, seen):
+    if shape is None or shape.name in seen:
+        return False
+    seen.add(shape.name)
+    if shape.metadata.get('sensitive'):
+        return True
+    if shape.type_name == 'structure':
+        members = shape.members.values()
+    elif shape.type_name == 'list':
+        members = [shape.member]
+    elif shape.type_name == 'map':
+        members = [shape.key, shape.value]
+    else:
+        return False
+    return any(_is_sensitive(member, seen) for member in members)
+
+
+def normalize_command(command):
+    """Drop the profile and region options from the aws-cli command."""
+    normalized = list()
+    iter_command = iter(command)
+    for argument in iter_command:
+        if argument in ('--profile', '--region'):
+            next(iter_command, None)
+            continue
+        normalized.append(argument)
+    return normalized
+
+
+def _purge(connection):
+    with connection:
+        connection.execute('DELETE FROM entries WHERE created < ?',
+                           (time.time() - RESULT_CACHE_MAX_AGE,))
+
+
+class ResultCache(object):
+    """
+    Local disk cache of the results of read-only aws-cli commands.
+
+    Results are keyed by the command (without the profile and region
+    options), the profile and the region, and are served until they
+    are older than the requested TTL. Commands of a service, which
+    modify its resources, invalidate all of the cached results of the
+    service.
+    """
+    def __init__(self, path=RESULT_CACHE_PATH):
+        """
+        :param path: Path to the SQLite database file.
+        :type: str
+        :rtype: None
+        """
+        self._database = Database(path, _SCHEMA, _purge)
+
+    def get(self, target, ttl):
+        """
+        Get the cached result of the target.
+
+        :param target: Target to be executed.
+        :type: bac.executor.Target
+        :param ttl: Maximum age (in seconds) of the cached result.
+        :type: float
+        :rtype: bac.executor.TargetResult or None if there is no
+            fresh cached result
+        """
+        try:
+            with self._database as connection:
+                row = connection.execute(
+                        'SELECT * FROM entries WHERE key = ? AND created >= ?',
+                        (self._get_key(target), time.time() - ttl)).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            log.debug('Failed to read the result cache: %s' % str(e))
+            return None
+        if row is None:
+            return None
+        result = TargetResult(target, row['exit_code'], row['out'],
+                              row['err'])
+        result.cached = True
+        return result
+
+    def put(self, service, result):
+        """
+        Cache the result of a successfully completed target.
+
+        :param service: Service called by the target.
+        :type: str
+        :param result: Result of the finished target.
+        :type: bac.executor.TargetResult
+        :rtype: None
+        """
+        if result.failed or result.out is None:
+            return
+        try:
+            with self._database as connection:
+                with connection:
+                    connection.execute(
+                            'INSERT OR REPLACE INTO entries (key, service,'
+                            ' created, exit_code, out, err)'
+                            ' VALUES (?, ?, ?, ?, ?, ?)',
+                            (self._get_key(result.target), service,
+                             time.time(), result.exit_code, result.out,
+                             result.err))
+        except (sqlite3.Error, OSError) as e:
+            log.debug('Failed to write the result cache: %s' % str(e))
+
+    def invalidate(self, service):
+        """Drop all of the cached results of the service."""
+        try:
+            with self._database as connection:
+                with connection:
+                    cursor = connection.execute(
+                            'DELETE FROM entries WHERE service = ?',
+                            (service,))
+        except (sqlite3.Error, OSError) as e:
+            log.error('Failed to invalidate cached results of "%s": %s'
+                      % (service, str(e)))
+            return
+        if cursor.rowcount:
+            log.debug('Invalidated %s cached results of "%s".'
+                      % (cursor.rowcount, service))
+
+    def _get_key(self, target):
+        return json.dumps([normalize_command(target.command),
+                           target.profile, target.region])
+
+
+class CachedCommand(object):
+    """Caches the results of a single read-only command."""
+    def __init__(self, cache, service, ttl):
+        """
+        :param cache: The result cache.
+        :type: bac.result_cache.ResultCache
+        :param service: Service called by the command.
+        :type: str
+        :param ttl: Maximum age (in seconds) of the served results.
+        :type: float
+        :rtype: None
+        """
+        self._cache = cache
+        self._service = service
+        self._ttl = ttl
+
+    def get(self, target):
+        """Get the cached result of the target, if it is fresh."""
+        result = self._cache.get(target, self._ttl)
+        if result is not None:
+            log.info('Using cached result for: Profile=%s, Region=%s'
+                     % (target.profile, target.region))
+        return result
+
+    def put(self, result):
+        """Cache the result of the executed target."""
+        self._cache.put(self._service, result)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import logging
+import multiprocessing
+import sys
+import threading
+
+import jmespath
+
+from jmespath.exceptions import JMESPathError
+
+from bac.constants import QUERY_POOL_THRESHOLD, QUERY_SHARDS_PER_PROCESS
+from bac.errors import BACError
+from bac.output import AggregateOutput
+
+log = logging.getLogger(__name__)
+
+# Nodes which produce the concatenation of their results over parts
+# of the input list, if their first child does the same
+_DISTRIBUTIVE_NODES = {'flatten', 'projection', 'filter_projection'}
+
+# Worker processes shared by all of the queries, by their count
+_pools = dict()
+_pools_lock = threading.Lock()
+
+
+def _get_pool(processes):
+    """
+    Get the pool of worker processes, start it on the first use.
+
+    The workers are spawned rather than forked where possible, as BAC
+    forks with its executor, loader and credential threads running,
+    whose locks might be held by the forked workers forever.
+    """
+    with _pools_lock:
+        if processes not in _pools:
+            context = multiprocessing
+            if hasattr(multiprocessing, 'get_context'):
+                context = multiprocessing.get_context('spawn')
+            _pools[processes] = context.Pool(processes)
+        return _pools[processes]
+
+
+def _search_shard(shard):
+    expression, account_names, results = shard
+    output = AggregateOutput(None, account_names)
+    records = [output.make_record(result) for result in results]
+    return jmespath.search(expression, records)
+
+
+class ResultQuery(object):
+    """
+    JMESPath expression evaluated over the merged results of all
+    fan-out targets.
+
+    The expression is evaluated over the list of records produced
+    for the aggregate output, so it may filter, compare or aggregate
+    outputs across all of the profiles and regions, e.g.:
+
+        [?account=='production'].output.Reservations[].Instances[]
+
+    Large result sets are split into shards evaluated by a pool of
+    worker processes, as long as the expression allows for that.
+    The pool is started by the first large query and reused by the
+    following ones.
+    """
+    def __init__(self, expression, account_names=None, processes=None):
+        """
+        :param expression: JMESPath expression to be evaluated.
+        :type: str
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :param processes: Number of the worker processes. Number of
+            CPUs is used if not set.
+        :type: int
+        :rtype: None
+        """
+        try:
+            self._expression = jmespath.compile(expression)
+        except JMESPathError as e:
+            raise BACError('Invalid query "%s": %s' % (expression, str(e)))
+        self._account_names = account_names or dict()
+        self._processes = processes or multiprocessing.cpu_count()
+
+    @classmethod
+    def from_args(cls, args, account_names=None):
+        """
+        Create query requested by BAC global arguments.
+
+        :param args: Namespace which contains BAC global arguments.
+        :type: argparse.Namespace
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :rtype: bac.result_query.ResultQuery or None if no query
+            has been requested
+        """
+        expression = getattr(args, 'bac_query', None)
+        if not expression:
+            return None
+        return cls(expression, account_names)
+
+    @property
+    def shardable(self):
+        """Whether the expression may be evaluated in parts."""
+        node = self._expression.parsed
+        if node['type'] not in _DISTRIBUTIVE_NODES:
+            return False
+        while node['type'] in _DISTRIBUTIVE_NODES:
+            node = node['children'][0]
+        return node['type'] in ('identity', 'current')
+
+    def search(self, results):
+        """
+        Evaluate the expression over results of all targets.
+
+        :param results: Results of the finished targets.
+        :type: list of bac.executor.TargetResult
+        :rtype: Result of the evaluated expression.
+        """
+        results = [result for result in results if result is not None]
+        size = sum(len(result.out or '') for result in results)
+        if (not self.shardable or size < QUERY_POOL_THRESHOLD
+                or self._processes < 2 or len(results) < 2):
+            output = AggregateOutput(None, self._account_names)
+            records = [output.make_record(result) for result in results]
+            return self._expression.search(records)
+        return self._search_in_pool(results)
+
+    def write(self, results, stream=None):
+        """Evaluate the expression and print its result as JSON."""
+        stream = stream or sys.stdout
+        value = self.search(results)
+        stream.write('%s\n' % json.dumps(value, indent=4, ensure_ascii=False))
+        stream.flush()
+
+    def _search_in_pool(self, results):
+        count = min(len(results), self._processes * QUERY_SHARDS_PER_PROCESS)
+        size = -(-len(results) // count)
+        shards = [results[i:i + size] for i in range(0, len(results), size)]
+        log.debug('Evaluating query in %s shards by %s processes.'
+                  % (len(shards), self._processes))
+        expression = self._expression.expression
+        parts = _get_pool(self._processes).map(
+                _search_shard,
+                [(expression, self._account_names, shard)
+                 for shard in shards])
+
+        merged = list()
+        for part in parts:
+            if part is not None:
+                merged.extend(part)
+        return merged
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+"""
+Assumed-role credentials shared by BAC and its aws-cli subprocesses.
+
+The aws-cli caches the credentials of the assumed roles in JSON files,
+so that the following aws-cli processes do not assume the roles again.
+BAC assumes the roles into the same cache, before the targets of the
+role profiles are executed, and keeps the cached credentials fresh
+by a background thread. Neither the aws-cli subprocesses, nor the
+sessions of BAC then need to call the STS on their own.
+"""
+import datetime
+import logging
+import os
+import threading
+
+from botocore.credentials import JSONFileCache, RefreshableCredentials
+from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
+from botocore.utils import parse_timestamp
+from dateutil.tz import tzutc
+
+from bac.constants import (ROLE_CREDENTIALS_CACHE_PATH,
+                           ROLE_CREDENTIALS_REFRESH_AHEAD,
+                           ROLE_CREDENTIALS_REFRESH_FRACTION,
+                           ROLE_CREDENTIALS_REFRESH_INTERVAL)
+
+log = logging.getLogger(__name__)
+
+_ROLE_PROVIDERS = ('assume-role', 'assume-role-with-web-identity')
+
+
+def _cap_refresh_ahead(refresh_ahead, lifetime):
+    """
+    Cap the refresh-ahead time to a fraction of the credential lifetime.
+
+    Credentials of role sessions shorter than the refresh-ahead time
+    would be refreshed on every check otherwise.
+
+    :param refresh_ahead: Seconds before the expiration to refresh.
+    :type: int
+    :param lifetime: Seconds the credentials were valid for.
+    :type: float
+    :rtype: float
+    """
+    return min(refresh_ahead, lifetime * ROLE_CREDENTIALS_REFRESH_FRACTION)
+
+
+class _FreshJSONFileCache(JSONFileCache):
+    """
+    JSON file cache, which misses the credentials close to expiration.
+
+    The credentials are assumed again, while the aws-cli would still
+    accept the cached ones. The lifetime of the cached credentials
+    is measured from the time their file was written.
+    """
+    def __init__(self, working_dir, refresh_ahead):
+        super(_FreshJSONFileCache, self).__init__(working_dir)
+        self._refresh_ahead = refresh_ahead
+
+    def __getitem__(self, cache_key):
+        response = super(_FreshJSONFileCache, self).__getitem__(cache_key)
+        try:
+            expiration = parse_timestamp(
+                    response['Credentials']['Expiration'])
+            written = datetime.datetime.fromtimestamp(
+                    os.path.getmtime(self._convert_cache_key(cache_key)),
+                    tzutc())
+        except (KeyError, TypeError, ValueError, OSError):
+            raise KeyError(cache_key)
+        remaining = expiration - datetime.datetime.now(tzutc())
+        refresh_ahead = _cap_refresh_ahead(
+                self._refresh_ahead, (expiration - written).total_seconds())
+        if remaining.total_seconds() < refresh_ahead:
+            raise KeyError(cache_key)
+        return response
+
+
+class RoleCredentialCache(object):
+    """
+    Assumes the roles of the profiles once and keeps them fresh.
+
+    Credentials of the assumed roles are written into the credential
+    cache of the aws-cli. Once a role is assumed, its credentials are
+    refreshed by a background thread, ahead of the time the aws-cli
+    would assume the role on its own, or ahead by a fraction of their
+    lifetime for the shorter role sessions.
+    """
+    def __init__(self, path=ROLE_CREDENTIALS_CACHE_PATH,
+                 refresh_ahead=ROLE_CREDENTIALS_REFRESH_AHEAD,
+                 refresh_interval=ROLE_CREDENTIALS_REFRESH_INTERVAL):
+        """
+        :param path: Path to the directory of the JSON files.
+        :type: str
+        :param refresh_ahead: Credentials are refreshed this many
+            seconds before they expire.
+        :type: int
+        :param refresh_interval: Time (in seconds) between the checks
+            of the background thread.
+        :type: float
+        :rtype: None
+        """
+        self._cache = _FreshJSONFileCache(os.path.expanduser(path),
+                                          refresh_ahead)
+        self._refresh_ahead = refresh_ahead
+        self._refresh_interval = refresh_interval
+        self._credentials = dict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def inject(self, session):
+        """
+        Make the role providers of the session use the shared cache.
+
+        Must be called before the credentials of the session are used.
+
+        :param session: Session of a profile.
+        :type: botocore.session.Session
+        :rtype: None
+        """
+        try:
+            chain = session.get_component('credential_provider')
+        except ProfileNotFound:
+            return
+        for name in _ROLE_PROVIDERS:
+            provider = chain.get_provider(name)
+            if provider is not None:
+                provider.cache = self._cache
+
+    def is_assumed(self, profile):
+        """Whether the role of the profile has already been assumed."""
+        with self._lock:
+            return profile in self._credentials
+
+    def assume(self, profile, session):
+        """
+        Assume the role of the profile, unless it is cached already.
+
+        :param profile: Name of the role profile.
+        :type: str
+        :param session: Session of the profile, with the shared cache
+            injected.
+        :type: boto3.session.Session
+        :rtype: None
+        """
+        try:
+            credentials = session.get_credentials()
+            if credentials is not None:
+                credentials.get_frozen_credentials()
+        except (BotoCoreError, ClientError) as e:
+            log.warning('Failed to assume the role of %s profile: %s'
+                        % (profile, str(e)))
+            return
+        if isinstance(credentials, RefreshableCredentials):
+            # Refreshed while the aws-cli still uses the cached ones
+            refresh_ahead = _cap_refresh_ahead(
+                    self._refresh_ahead, credentials._seconds_remaining())
+            credentials._advisory_refresh_timeout = refresh_ahead
+            credentials._mandatory_refresh_timeout = min(
+                    credentials._mandatory_refresh_timeout, refresh_ahead)
+        with self._lock:
+            self._credentials[profile] = credentials
+        self._start()
+
+    def discard(self, profile):
+        """Stop refreshing the credentials of a removed or changed profile."""
+        with self._lock:
+            self._credentials.pop(profile, None)
+
+    def close(self):
+        """Stop refreshing the credentials."""
+        self._stopped.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refresh,
+                                            name='refresh-credentials')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def _refresh(self):
+        while not self._stopped.wait(self._refresh_interval):
+            with self._lock:
+                credentials = list(self._credentials.items())
+            for profile, profile_credentials in credentials:
+                if not isinstance(profile_credentials,
+                                  RefreshableCredentials):
+                    continue
+                try:
+                    profile_credentials.get_frozen_credentials()
+                except (BotoCoreError, ClientError) as e:
+                    log.debug('Failed to refresh the credentials of %s'
+                              ' profile: %s' % (profile, str(e)))
@@ -16,10 +16,24 @@ from bac.awscli_receiver import AwsCliReceiver
 from bac.batch import CommandBatch
 from bac.bindings import Bindings
 from bac.checker import CLIChecker
-from bac.constants import (BAC_PROMPT, BAC_HISTORY, IGNORED_ENV_VARS,
-                           PROFILE_MANAGER_COMMANDS)
+from bac.constants import (BAC_PROMPT, BAC_HISTORY, DEFAULT_WORKERS,
+                           ENGINE_SUBPROCESS, ENGINES, IGNORED_ENV_VARS,
+                           JOB_COMMANDS, OUTPUT_FORMATS, PREFIX_ORDERS,
+                           PROFILE_MANAGER_COMMANDS, RERUN_COMMANDS,
+                           RESULT_CACHE_TTL, RESULT_STORE_COMMANDS,
+                           TOOLBAR_REFRESH_INTERVAL)
+from bac.engines import EngineProvider, requires_subprocess
 from bac.errors import ArgumentParserDoneException, BACError
+from bac.identity_cache import IdentityCache
+from bac.jobs import JobManager, split_background
+from bac.loader import BackgroundLoader
 from bac.profile_manager import ProfileManager
+from bac.rerun import LastFanOut
+from bac.result_cache import ResultCache
+from bac.role_credentials import RoleCredentialCache
+from bac.store import ResultStore
+from bac.throttling import RateLimiter, parse_rate_limit
+from bac.timings import TimingHistory
 from bac.toolbar import Toolbar
 from bac.utils import ArgumentParser, GlobalsParser
 
@@ -59,6 +73,12 @@ def add_parser_commands(parser):
     commands = parser.add_subparsers()
     for command, command_help in PROFILE_MANAGER_COMMANDS.items():
         commands.add_parser(command, help=command_help)
+    for command, command_help in RESULT_STORE_COMMANDS.items():
+        commands.add_parser(command, help=command_help)
+    for command, command_help in RERUN_COMMANDS.items():
+        commands.add_parser(command, help=command_help)
+    for command, command_help in JOB_COMMANDS.items():
+        commands.add_parser(command, help=command_help)
     return commands
 
 
@@ -69,14 +89,34 @@ class BAC(object):
     Initialization of the tool as well as the delegation of
     all of the "work" is taken care of within this class.
     """
-    def __init__(self):
+    def __init__(self, max_sessions=None):
+        """
+        :param max_sessions: Maximum number of live profile sessions.
+            Unlimited if not set.
+        :type: int
+        :rtype: None
+        """
         self._fuzzy = True
         self._cache_completion = True
-        self._profile_manager = ProfileManager()
+        self._loader = BackgroundLoader()
+        self._role_credentials = RoleCredentialCache()
+        self._profile_manager = ProfileManager(IdentityCache(), self._loader,
+                                               max_sessions,
+                                               self._role_credentials)
         self._checker = CLIChecker(self._profile_manager.get_first_profile())
-        self._aws_cli = AwsCliReceiver(self._profile_manager, self._checker)
+        self._engines = EngineProvider(self._profile_manager, self._checker)
+        self._store = ResultStore()
+        self._last_fan_out = LastFanOut()
+        self._cache = ResultCache()
+        self._history = TimingHistory()
+        self._limiter = RateLimiter()
+        self._jobs = JobManager()
+        self._aws_cli = AwsCliReceiver(
+                self._profile_manager, self._checker, self._engines,
+                self._store, self._last_fan_out, self._cache, self._history,
+                self._limiter)
         self._bac_global_parser = self._create_bac_global_parser()
-        self._completer = BACCompleter(self._profile_manager)
+        self._completer = BACCompleter(self._profile_manager, self._loader)
         self._bindings = Bindings(self.toggle_fuzzy,
                                   self.toggle_cache,
                                   self.refresh_cache)
@@ -87,7 +127,8 @@ class BAC(object):
                               complete_while_typing=True,
                               complete_style=CompleteStyle.MULTI_COLUMN,
                               key_bindings=self._bindings.bindings,
-                              bottom_toolbar=self._get_toolbar_handler()))
+                              bottom_toolbar=self._get_toolbar_handler(),
+                              refresh_interval=TOOLBAR_REFRESH_INTERVAL))
         self._env_var_check()
 
     def toggle_fuzzy(self):
@@ -106,7 +147,19 @@ class BAC(object):
 
     def run_cli(self):
         """Run the main Better AWS CLI loop."""
+        try:
+            self._run_loop()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop refreshing the credentials of the assumed roles."""
+        self._role_credentials.close()
+
+    def _run_loop(self):
         while True:
+            self._jobs.report_finished()
+            self._reload_profiles()
             cli_input = self._prompt_session.prompt()
             try:
                 argv = shlex.split(text_type(cli_input))
@@ -122,7 +175,16 @@ class BAC(object):
             except BACError as e:
                 log.error('Following exception has been raised: %s' % str(e))
 
+    def _reload_profiles(self):
+        """Reload the profiles and drop the state of the changed ones."""
+        if not self._profile_manager.reload():
+            return
+        self._completer.refresh_profiles()
+        self._engines.reload()
+        self._checker.reload()
+
     def _work_input(self, argv):
+        argv, background = split_background(argv)
         if not argv:
             return
 
@@ -138,11 +200,38 @@ class BAC(object):
         log.debug('Choice made: %s' % choice)
 
         if choice == 'aws':
-            self._aws_cli.execute_awscli_command(remainder, parsed_args)
+            execute = (lambda: self._aws_cli.execute_awscli_command(
+                    remainder, parsed_args))
+            if background and requires_subprocess(remainder):
+                raise BACError('Interactive command "%s" cannot be executed'
+                               ' in the background.' % ' '.join(remainder))
+            self._execute(execute, argv, background)
             return
 
         if choice == 'batch-command':
-            CommandBatch(parsed_args, remainder, self._checker)
+            self._execute(
+                    lambda: CommandBatch(
+                            parsed_args, remainder, self._checker,
+                            self._engines,
+                            self._profile_manager.account_names, self._store,
+                            self._last_fan_out, self._cache, self._history,
+                            self._profile_manager.assume_roles,
+                            self._limiter),
+                    argv, background)
+            return
+
+        if background:
+            log.warning('Only "aws" and "batch-command" commands can be'
+                        ' executed in the background, executing "%s" in'
+                        ' the foreground.' % choice)
+
+        if self._jobs.handle_command(choice, remainder):
+            return
+
+        if self._store.handle_command(choice, remainder):
+            return
+
+        if self._last_fan_out.handle_command(choice, remainder):
             return
 
         if self._profile_manager.handle_command(choice, remainder):
@@ -153,12 +242,20 @@ class BAC(object):
         except ArgumentParserDoneException:
             pass
 
+    def _execute(self, execute, argv, background=False):
+        if background:
+            self._jobs.start(' '.join(argv), execute)
+        else:
+            execute()
+
     def _get_toolbar_handler(self):
         toolbar = Toolbar(
                 lambda: self._fuzzy,
                 lambda: self._cache_completion,
                 lambda: self._profile_manager.active_profiles,
-                lambda: self._profile_manager.active_regions)
+                lambda: self._profile_manager.active_regions,
+                lambda: self._jobs.progress,
+                lambda: self._loader.loading)
         return toolbar.handler
 
     def _create_bac_global_parser(self):
@@ -175,6 +272,106 @@ class BAC(object):
                 dest='priv_check', help=('Attempt to check for sufficient'
                                          'privileges before executing an'
                                          ' awscli command'))
+        parser.add_argument(
+                '--bac-store', action='store_true', dest='store',
+                help=('Store outputs of all profiles and regions into'
+                      ' the local result store, which can be queried later'
+                      ' by the "list-runs" and "query-results" commands'))
+        parser.add_argument(
+                '--bac-cache-ttl', type=float, dest='cache_ttl',
+                default=RESULT_CACHE_TTL, metavar='SECONDS',
+                help=('Maximum age of cached results of read-only'
+                      ' (describe, list and get) commands, which are'
+                      ' served instead of executing the command again.'
+                      ' Commands writing files or returning secrets are'
+                      ' never cached. Zero disables the cache'
+                      ' (default: %(default)s)'))
+        parser.add_argument(
+                '--bac-no-cache', action='store_true', dest='no_cache',
+                help=('Execute the command without the cache, neither'
+                      ' serving, nor caching its results'))
+        parser.add_argument(
+                '--bac-workers', type=int, dest='workers',
+                default=DEFAULT_WORKERS,
+                help=('Maximum number of concurrently executed profile'
+                      ' and region targets'))
+        parser.add_argument(
+                '--bac-max-per-profile', type=int, dest='max_per_profile',
+                default=None,
+                help=('Maximum number of concurrently executed targets'
+                      ' of a single profile'))
+        parser.add_argument(
+                '--bac-max-per-region', type=int, dest='max_per_region',
+                default=None,
+                help=('Maximum number of concurrently executed targets'
+                      ' in a single region'))
+        parser.add_argument(
+                '--bac-rate-limit', type=parse_rate_limit, action='append',
+                dest='rate_limits', metavar='[SERVICE=]RATE',
+                help=('Maximum number of awscli commands started per second'
+                      ' for a single account and region, optionally only'
+                      ' for the given service (e.g. "ec2=5"). Also shrinks'
+                      ' the concurrency of throttled or slowed down'
+                      ' accounts, services and regions'))
+        parser.add_argument(
+                '--bac-timeout', type=float, dest='target_timeout',
+                default=None, metavar='SECONDS',
+                help=('Maximum time of a single profile and region'
+                      ' target, after which its command is killed'))
+        parser.add_argument(
+                '--bac-budget', type=float, dest='budget', default=None,
+                metavar='SECONDS',
+                help=('Maximum time of the whole command across all'
+                      ' profiles and regions, after which all of the'
+                      ' unfinished targets are cancelled'))
+        parser.add_argument(
+                '--bac-no-timings', action='store_true', dest='no_timings',
+                help=('Neither order the profiles and regions by their'
+                      ' previous execution times, nor record their'
+                      ' execution times into the local timing history'))
+        parser.add_argument(
+                '--bac-dedupe-accounts', action='store_true',
+                dest='dedupe_accounts',
+                help=('Execute read-only (describe, list and get) commands'
+                      ' only once per account, instead of once per every'
+                      ' profile of the same account'))
+        parser.add_argument(
+                '--bac-account-preference', action='append',
+                dest='account_preferences', metavar='PATTERN',
+                help=('Pattern of profile names, which are preferred to'
+                      ' represent their account with'
+                      ' "--bac-dedupe-accounts". May be given multiple'
+                      ' times, in the order of preference'))
+        parser.add_argument(
+                '--bac-engine', choices=ENGINES, dest='engine',
+                default=ENGINE_SUBPROCESS,
+                help=('Engine used to execute awscli commands. The'
+                      ' "forkserver" engine forks every aws-cli process'
+                      ' from an already initialized one. The'
+                      ' "in-process" engine drives the aws-cli within BAC'
+                      ' instead of starting a new aws-cli process for'
+                      ' every profile and region. The "boto3" engine calls'
+                      ' the AWS API directly with pooled boto3 clients'))
+        parser.add_argument(
+                '--bac-output', choices=OUTPUT_FORMATS, dest='output_format',
+                default=None,
+                help=('Merge outputs of all profiles and regions into'
+                      ' a single JSON array ("json") or a JSON Lines'
+                      ' stream ("jsonl"), annotated with the profile,'
+                      ' account and region'))
+        parser.add_argument(
+                '--bac-query', dest='bac_query', metavar='EXPRESSION',
+                default=None,
+                help=('JMESPath expression evaluated over the merged'
+                      ' outputs of all profiles and regions, which are'
+                      ' annotated as by "--bac-output json"'))
+        parser.add_argument(
+                '--bac-prefix-output', choices=PREFIX_ORDERS,
+                dest='prefix_order', default=None,
+                help=('Prefix every line printed by awscli commands with'
+                      ' its profile and region. Lines are printed either'
+                      ' as soon as they are complete ("as-completed"),'
+                      ' or grouped by profiles and regions ("ordered")'))
         return parser
 
     def _env_var_check(self):
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import logging
+import sqlite3
+import time
+
+from bac.constants import (OUTPUT_FORMATS, RESULT_STORE_COMMANDS,
+                           RESULT_STORE_PATH)
+from bac.errors import ArgumentParserDoneException, BACError
+from bac.executor import Target, TargetResult
+from bac.multiplexer import OutputMultiplexer
+from bac.output import AggregateOutput
+from bac.utils import ArgumentParser, Database
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    command TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    command TEXT NOT NULL,
+    profile TEXT,
+    account TEXT,
+    region TEXT,
+    exit_code INTEGER,
+    started REAL,
+    finished REAL,
+    out TEXT,
+    err TEXT
+);
+CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id);
+CREATE INDEX IF NOT EXISTS results_command ON results (command);
+CREATE INDEX IF NOT EXISTS results_profile ON results (profile);
+CREATE INDEX IF NOT EXISTS results_account ON results (account);
+CREATE INDEX IF NOT EXISTS results_region ON results (region);
+'''
+
+
+class ResultStore(object):
+    """
+    Local SQLite database of the fan-out results.
+
+    Results of every profile and region of the stored runs can be
+    listed and queried later, without calling the AWS again. The
+    database is created on its first use.
+    """
+    def __init__(self, path=RESULT_STORE_PATH):
+        """
+        :param path: Path to the SQLite database file.
+        :type: str
+        :rtype: None
+        """
+        self._database = Database(path, _SCHEMA)
+        self._commands = {
+            'list-runs': self.list_runs,
+            'query-results': self.query_results,
+            }
+
+    def start_run(self, source, command, account_names=None):
+        """
+        Start recording results of a new run.
+
+        :param source: What executed the run, e.g. "aws".
+        :type: str
+        :param command: The executed command.
+        :type: str
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :rtype: bac.store.StoredRun or None if the run cannot be stored
+        """
+        try:
+            with self._database as connection:
+                with connection:
+                    cursor = connection.execute(
+                            'INSERT INTO runs (source, command, started)'
+                            ' VALUES (?, ?, ?)',
+                            (source, command, time.time()))
+        except (sqlite3.Error, OSError) as e:
+            log.error('Results will not be stored. Failed to open the'
+                      ' result store at "%s": %s' % (self._database.path,
+                                                     str(e)))
+            return None
+        return StoredRun(self, cursor.lastrowid, account_names)
+
+    def add_result(self, run_id, result, account=None):
+        """Store the result of a single target of the run."""
+        target = result.target
+        with self._database as connection:
+            with connection:
+                connection.execute(
+                        'INSERT INTO results (run_id, command, profile,'
+                        ' account, region, exit_code, started, finished,'
+                        ' out, err) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (run_id, ' '.join(target.command), target.profile,
+                         account, target.region, result.exit_code,
+                         result.started, result.finished, result.out,
+                         result.err))
+
+    def finish_run(self, run_id):
+        """Mark the run as finished."""
+        with self._database as connection:
+            with connection:
+                connection.execute('UPDATE runs SET finished = ? WHERE id = ?',
+                                   (time.time(), run_id))
+
+    def get_runs(self, limit=None):
+        """
+        Get the most recent runs.
+
+        :param limit: Maximum number of returned runs.
+        :type: int
+        :rtype: list of sqlite3.Row
+        """
+        query = ('SELECT runs.*, COUNT(results.id) AS targets,'
+                 ' SUM(results.exit_code IS NULL OR results.exit_code != 0)'
+                 ' AS failed FROM runs'
+                 ' LEFT JOIN results ON results.run_id = runs.id'
+                 ' GROUP BY runs.id ORDER BY runs.id DESC')
+        parameters = list()
+        if limit:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        return self._select(query, parameters)
+
+    def get_results(self, run_id=None, profile=None, account=None,
+                    region=None, command=None, failed=False):
+        """
+        Get stored results matching all of the given conditions.
+
+        :param run_id: ID of the run. The most recent run if not set.
+        :type: int
+        :param profile: Profile of the results.
+        :type: str
+        :param account: Account name of the results.
+        :type: str
+        :param region: Region of the results.
+        :type: str
+        :param command: Substring of the executed commands.
+        :type: str
+        :param failed: Get only results of failed commands.
+        :type: bool
+        :rtype: list of sqlite3.Row
+        """
+        conditions = list()
+        parameters = list()
+        if run_id is None:
+            conditions.append('run_id = (SELECT MAX(id) FROM runs)')
+        else:
+            conditions.append('run_id = ?')
+            parameters.append(run_id)
+        for column, value in (('profile', profile), ('account', account),
+                              ('region', region)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                parameters.append(value)
+        if command is not None:
+            conditions.append('command LIKE ?')
+            parameters.append('%%%s%%' % command)
+        if failed:
+            conditions.append('(exit_code IS NULL OR exit_code != 0)')
+        query = ('SELECT * FROM results WHERE %s ORDER BY id'
+                 % ' AND '.join(conditions))
+        return self._select(query, parameters)
+
+    def handle_command(self, command, argv):
+        """Attempt to call a corresponding method for given command."""
+        handler = self._commands.get(command)
+        if handler is None:
+            return False
+        handler(argv)
+        return True
+
+    def list_runs(self, argv):
+        """Lists the most recent stored runs."""
+        parser = ArgumentParser(
+                prog=argv[0], description=RESULT_STORE_COMMANDS[argv[0]])
+        parser.add_argument(
+                '--limit', '-l', type=int, default=20,
+                help='maximum number of listed runs')
+        args = self._parse_args(parser, argv)
+        if args is None:
+            return
+
+        runs = self._get_runs_safely(args.limit)
+        if not runs:
+            print('No stored runs found.')
+            return
+        for run in runs:
+            started = time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(run['started']))
+            print('\t'.join([str(run['id']), started, run['source'],
+                             '%s targets' % run['targets'],
+                             '%s failed' % (run['failed'] or 0),
+                             run['command']]))
+
+    def query_results(self, argv):
+        """Prints the stored results of a run."""
+        parser = ArgumentParser(
+                prog=argv[0], description=RESULT_STORE_COMMANDS[argv[0]])
+        parser.add_argument(
+                'run_id', type=int, nargs='?', default=None,
+                help='ID of the run, the most recent run if not given')
+        parser.add_argument('--profile', help='profile of the results')
+        parser.add_argument('--account', help='account name of the results')
+        parser.add_argument('--region', help='region of the results')
+        parser.add_argument(
+                '--command', help='substring of the executed commands')
+        parser.add_argument(
+                '--failed', action='store_true',
+                help='print results of failed commands only')
+        parser.add_argument(
+                '--format', choices=OUTPUT_FORMATS, default=None,
+                help=('print results as a JSON array or JSON Lines instead'
+                      ' of the prefixed output'))
+        args = self._parse_args(parser, argv)
+        if args is None:
+            return
+
+        try:
+            rows = self.get_results(args.run_id, args.profile, args.account,
+                                    args.region, args.command, args.failed)
+        except sqlite3.Error as e:
+            raise BACError('Failed to query the result store: %s' % str(e))
+        results = [self._to_result(row) for row in rows]
+        if args.format:
+            accounts = dict((row['profile'], row['account']) for row in rows)
+            output = AggregateOutput(args.format, accounts)
+            output.open()
+            for result in results:
+                output.write(result)
+            output.close()
+            return
+        if not results:
+            print('No stored results found.')
+            return
+        targets = [result.target for result in results]
+        multiplexer = OutputMultiplexer(targets)
+        for result in results:
+            multiplexer.feed(result.target, result.out, result.err)
+            multiplexer.finish(result.target)
+
+    def _parse_args(self, parser, argv):
+        try:
+            return parser.parse_args(argv[1:])
+        except ArgumentParserDoneException:
+            return None
+
+    def _get_runs_safely(self, limit):
+        try:
+            return self.get_runs(limit)
+        except sqlite3.Error as e:
+            raise BACError('Failed to query the result store: %s' % str(e))
+
+    def _to_result(self, row):
+        target = Target(row['command'].split(' '), row['profile'],
+                        row['region'])
+        result = TargetResult(target, row['exit_code'], row['out'],
+                              row['err'])
+        result.started = row['started']
+        result.finished = row['finished']
+        return result
+
+    def _select(self, query, parameters):
+        with self._database as connection:
+            return connection.execute(query, parameters).fetchall()
+
+
+class StoredRun(object):
+    """Records results of a single run into the result store."""
+    def __init__(self, store, run_id, account_names=None):
+        """
+        :param store: The result store.
+        :type: bac.store.ResultStore
+        :param run_id: ID of the run.
+        :type: int
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :rtype: None
+        """
+        self.run_id = run_id
+        self._store = store
+        self._account_names = account_names or dict()
+
+    def add(self, result):
+        """
+        Store the result of a finished target.
+
+        :param result: Result of the finished target.
+        :type: bac.executor.TargetResult
+        :rtype: None
+        """
+        if result is None:
+            return
+        account = self._account_names.get(result.target.profile)
+        try:
+            self._store.add_result(self.run_id, result, account)
+        except sqlite3.Error as e:
+            log.error('Failed to store the result of %s: %s'
+                      % (result.target, str(e)))
+
+    def finish(self):
+        """Mark the run as finished."""
+        try:
+            self._store.finish_run(self.run_id)
+        except sqlite3.Error as e:
+            log.error('Failed to finish the stored run %s: %s'
+                      % (self.run_id, str(e)))
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import argparse
+import logging
+import threading
+import time
+
+from bac.constants import (THROTTLING_DECREASE_FACTOR, THROTTLING_ERRORS,
+                           THROTTLING_LATENCY_FACTOR,
+                           THROTTLING_LATENCY_SMOOTHING)
+from bac.utils import extract_positional_args
+
+log = logging.getLogger(__name__)
+
+
+def parse_rate_limit(value):
+    """
+    Parse the value of the "--bac-rate-limit" global argument.
+
+    The value is either a rate applied to all services, e.g. "10",
+    or a rate of a single service, e.g. "ec2=5".
+
+    :param value: Value to be parsed.
+    :type: str
+    :rtype: tuple of service name (or None) and rate
+    """
+    service, _, rate = value.rpartition('=')
+    try:
+        rate = float(rate)
+    except ValueError:
+        rate = 0
+    if rate <= 0:
+        msg = ('Invalid rate limit given: "%s". Expected a positive'
+               ' number of commands per second, optionally preceded'
+               ' by the service name, e.g. "ec2=5".' % value)
+        raise argparse.ArgumentTypeError(msg)
+    return service or None, rate
+
+
+def is_throttled(result):
+    """
+    Check whether the target failed due to the API throttling.
+
+    :param result: Result of the finished target.
+    :type: bac.executor.TargetResult
+    :rtype: bool
+    """
+    if not result.failed or not result.err:
+        return False
+    return any(error in result.err for error in THROTTLING_ERRORS)
+
+
+class TokenBucket(object):
+    """Allows at most "rate" starts per second, with bursts."""
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Number of tokens added every second.
+        :type: float
+        :param capacity: Maximum number of tokens, which may be spent
+            at once. Equals to the rate (but at least one) if not set.
+        :type: float
+        :rtype: None
+        """
+        self._rate = rate
+        self._capacity = capacity or max(1.0, rate)
+        self._tokens = self._capacity
+        self._updated = time.time()
+
+    def available(self):
+        """Check whether there is a token to be consumed."""
+        self._refill()
+        return self._tokens >= 1
+
+    def consume(self):
+        """Consume a single token, if there is any."""
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _refill(self):
+        now = time.time()
+        elapsed = max(0, now - self._updated)
+        self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+        self._updated = now
+
+
+class AdaptiveLimit(object):
+    """
+    Concurrency limit adjusted by additive increase and
+    multiplicative decrease (AIMD).
+
+    The limit grows by one after every successful target, unless its
+    latency is significantly higher than usual. Throttled and slow
+    targets shrink the limit by the decrease factor instead.
+    """
+    def __init__(self, maximum):
+        """
+        :param maximum: Maximum (and initial) concurrency limit.
+        :type: int
+        :rtype: None
+        """
+        self.maximum = max(1, maximum)
+        self.limit = float(self.maximum)
+        self.running = 0
+        self._latency = None
+
+    def can_start(self):
+        return self.running < int(self.limit)
+
+    def update(self, throttled, duration=None):
+        """
+        Adjust the limit by the outcome of a finished target.
+
+        :param throttled: Whether the target has been throttled.
+        :type: bool
+        :param duration: Duration (in seconds) of the target.
+        :type: float
+        :rtype: None
+        """
+        slow = (duration is not None and self._latency is not None
+                and duration > self._latency * THROTTLING_LATENCY_FACTOR)
+        if duration is not None and not throttled:
+            if self._latency is None:
+                self._latency = duration
+            else:
+                self._latency += (THROTTLING_LATENCY_SMOOTHING
+                                  * (duration - self._latency))
+
+        if throttled or slow:
+            self.limit = max(1.0, self.limit * THROTTLING_DECREASE_FACTOR)
+        else:
+            self.limit = min(float(self.maximum), self.limit + 1)
+
+
+class RateLimiter(object):
+    """
+    Limits the start rate and concurrency of fan-out targets.
+
+    Targets are grouped by their account, service and region, since
+    these share the AWS API request limits. Every group has its own
+    token bucket, which limits how many targets are started per
+    second, and its own adaptive concurrency limit, which shrinks
+    when the targets of the group get throttled or slow down.
+
+    A single limiter is shared by all of the fan-outs, so that the
+    following and concurrently running fan-outs respect the throttling
+    of the previous ones.
+    """
+    def __init__(self, rates=None, maximum=1, account_names=None):
+        """
+        :param rates: Rates (targets started per second) of services.
+            Rate of None service applies to all other services.
+        :type: dict
+        :param maximum: Maximum concurrency limit of a single group.
+        :type: int
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :rtype: None
+        """
+        self._rates = dict(rates or dict())
+        self._maximum = maximum
+        self._account_names = account_names or dict()
+        self._buckets = dict()
+        self._limits = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args, account_names=None, limiter=None):
+        """
+        Get rate limiter requested by BAC global arguments.
+
+        :param args: Namespace which contains BAC global arguments.
+        :type: argparse.Namespace
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :param limiter: The shared limiter, which is reconfigured
+            by the arguments, instead of creating a new one.
+        :type: bac.throttling.RateLimiter
+        :rtype: bac.throttling.RateLimiter or None if no rate limits
+            have been requested
+        """
+        rate_limits = getattr(args, 'rate_limits', None)
+        if not rate_limits:
+            return None
+        maximum = getattr(args, 'workers', None) or 1
+        if limiter is None:
+            return cls(dict(rate_limits), maximum, account_names)
+        limiter.configure(dict(rate_limits), maximum, account_names)
+        return limiter
+
+    def configure(self, rates, maximum, account_names=None):
+        """
+        Change the rates and the maximum concurrency limit.
+
+        Token buckets and concurrency limits of the groups are kept,
+        unless the rates of their services have changed.
+
+        :param rates: Rates (targets started per second) of services.
+        :type: dict
+        :param maximum: Maximum concurrency limit of a single group.
+        :type: int
+        :param account_names: Account names of the profiles.
+        :type: dict
+        :rtype: None
+        """
+        with self._lock:
+            self._rates = dict(rates)
+            self._maximum = maximum
+            if account_names is not None:
+                self._account_names = account_names
+            for limit in self._limits.values():
+                limit.maximum = max(1, maximum)
+                limit.limit = min(limit.limit, float(limit.maximum))
+
+    def can_start(self, target):
+        """Check whether the target may be started right now."""
+        key = self._get_key(target)
+        with self._lock:
+            if not self._get_limit(key).can_start():
+                return False
+            bucket = self._get_bucket(key)
+            return bucket is None or bucket.available()
+
+    def start(self, target):
+        """Record the start of the target."""
+        key = self._get_key(target)
+        with self._lock:
+            self._get_limit(key).running += 1
+            bucket = self._get_bucket(key)
+            if bucket is not None:
+                bucket.consume()
+
+    def finish(self, target, result=None):
+        """Record the end of the target and adapt its group limit."""
+        key = self._get_key(target)
+        with self._lock:
+            limit = self._get_limit(key)
+            limit.running -= 1
+            if result is None:
+                return
+            throttled = is_throttled(result)
+            previous = int(limit.limit)
+            limit.update(throttled, result.duration)
+            if int(limit.limit) < previous:
+                log.debug('Concurrency of %s decreased to %s%s.'
+                          % ('/'.join(str(k) for k in key), int(limit.limit),
+                             ' due to throttling' if throttled else ''))
+
+    def _get_key(self, target):
+        account = self._account_names.get(target.profile, target.profile)
+        positionals = extract_positional_args(target.command)
+        service = positionals[1] if len(positionals) > 1 else None
+        return account, service, target.region
+
+    def _get_limit(self, key):
+        if key not in self._limits:
+            self._limits[key] = AdaptiveLimit(self._maximum)
+        return self._limits[key]
+
+    def _get_bucket(self, key):
+        service = key[1]
+        rate = self._rates.get(service, self._rates.get(None))
+        if key not in self._buckets or self._buckets[key][0] != rate:
+            self._buckets[key] = rate, TokenBucket(rate) if rate else None
+        return self._buckets[key][1]
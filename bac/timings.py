@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import logging
+import sqlite3
+import time
+
+from bac.constants import (TARGET_CANCELLED, TIMING_HISTORY_MAX_AGE,
+                           TIMING_HISTORY_MAX_ENTRIES, TIMING_HISTORY_PATH,
+                           TIMING_HISTORY_SMOOTHING)
+from bac.utils import Database, extract_positional_args
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS timings (
+    operation TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    region TEXT NOT NULL,
+    duration REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (operation, profile, region)
+);
+CREATE INDEX IF NOT EXISTS timings_updated ON timings (updated);
+'''
+
+
+def get_operation(command):
+    """Get the "service operation" name of the aws-cli command."""
+    return ' '.join(extract_positional_args(command)[1:3])
+
+
+def _purge(connection):
+    with connection:
+        connection.execute('DELETE FROM timings WHERE updated < ?',
+                           (time.time() - TIMING_HISTORY_MAX_AGE,))
+        connection.execute(
+                'DELETE FROM timings WHERE rowid NOT IN (SELECT rowid'
+                ' FROM timings ORDER BY updated DESC LIMIT ?)',
+                (TIMING_HISTORY_MAX_ENTRIES,))
+
+
+class TimingHistory(object):
+    """
+    Local history of the execution times of fan-out targets.
+
+    The execution time of every operation, profile and region is
+    smoothed over its runs. The history is used to start the targets
+    which are expected to take the longest first, so that they do not
+    prolong the whole fan-out by starting last. Entries not updated
+    for a long time, and the oldest entries above the maximum count,
+    are purged.
+    """
+    def __init__(self, path=TIMING_HISTORY_PATH):
+        """
+        :param path: Path to the SQLite database file.
+        :type: str
+        :rtype: None
+        """
+        self._database = Database(path, _SCHEMA, _purge)
+
+    def order(self, targets):
+        """
+        Order targets from the longest to the shortest expected time.
+
+        Targets without any history are expected to take the median
+        time of the other targets. Targets with the same expected time
+        keep their order, so the order does not change at all if there
+        is no history.
+
+        :param targets: Targets to be executed.
+        :type: list
+        :rtype: list of indexes of the targets
+        """
+        estimates = self.get_estimates(targets)
+        known = sorted(e for e in estimates if e is not None)
+        default = known[len(known) // 2] if known else 0
+        estimates = [default if e is None else e for e in estimates]
+        return sorted(range(len(targets)), key=lambda i: -estimates[i])
+
+    def get_estimates(self, targets):
+        """
+        Get the expected execution times of the targets.
+
+        :param targets: Targets to be executed.
+        :type: list
+        :rtype: list of float or None for targets without history
+        """
+        operations = set(get_operation(t.command) for t in targets)
+        durations = dict()
+        try:
+            with self._database as connection:
+                for operation in operations:
+                    rows = connection.execute(
+                            'SELECT * FROM timings WHERE operation = ?',
+                            (operation,))
+                    for row in rows:
+                        key = (operation, row['profile'], row['region'])
+                        durations[key] = row['duration']
+        except (sqlite3.Error, OSError) as e:
+            log.debug('Failed to read the timing history: %s' % str(e))
+        return [durations.get(self._get_key(t)) for t in targets]
+
+    def record(self, results):
+        """
+        Record the execution times of the finished targets.
+
+        Cancelled and cached results are ignored.
+
+        :param results: Results of the fan-out targets.
+        :type: list of bac.executor.TargetResult
+        :rtype: None
+        """
+        results = [r for r in results if r is not None
+                   and r.duration is not None and not r.cached
+                   and r.status != TARGET_CANCELLED
+                   and r.target.profile and r.target.region]
+        if not results:
+            return
+        try:
+            with self._database as connection:
+                with connection:
+                    for result in results:
+                        self._update(connection, result)
+                _purge(connection)
+        except (sqlite3.Error, OSError) as e:
+            log.debug('Failed to record the timing history: %s' % str(e))
+
+    def _update(self, connection, result):
+        key = self._get_key(result.target)
+        row = connection.execute(
+                'SELECT duration FROM timings WHERE operation = ?'
+                ' AND profile = ? AND region = ?', key).fetchone()
+        duration = result.duration
+        if row is not None:
+            duration = (row['duration'] + TIMING_HISTORY_SMOOTHING
+                        * (duration - row['duration']))
+        connection.execute(
+                'INSERT OR REPLACE INTO timings (operation, profile, region,'
+                ' duration, updated) VALUES (?, ?, ?, ?, ?)',
+                key + (duration, time.time()))
+
+    def _get_key(self, target):
+        return get_operation(target.command), target.profile, target.region
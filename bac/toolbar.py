@@ -7,7 +7,8 @@ from six import text_type
 
 class Toolbar(object):
     """Handles content shown in propt toolkit toolbar."""
-    def __init__(self, get_fuzzy, get_caching, get_profiles, get_regions):
+    def __init__(self, get_fuzzy, get_caching, get_profiles, get_regions,
+                 get_progress=None, get_loading=None):
         """
         :param get_fuzzy: A callable that retrieves current fuzzy
             completion setting.
@@ -21,12 +22,20 @@ class Toolbar(object):
         :param get_regions: A callable that retrieves set of currently
             active regions.
         :type: callable
+        :param get_progress: A callable that retrieves the progress
+            of currently running fan-outs.
+        :type: callable
+        :param get_loading: A callable that retrieves names of the data
+            which are still being loaded.
+        :type: callable
         :rtype: None
         """
         self.handler = self._create_toolbar_handler(
-                get_fuzzy, get_caching, get_profiles, get_regions)
+                get_fuzzy, get_caching, get_profiles, get_regions,
+                get_progress, get_loading)
 
-    def _create_toolbar_handler(self, fuzzy, caching, profiles, regions):
+    def _create_toolbar_handler(self, fuzzy, caching, profiles, regions,
+                                progress=None, loading=None):
 
         def get_toolbar():
             p = profiles()
@@ -37,7 +46,11 @@ class Toolbar(object):
                     'Active profiles: %s' % active_profiles,
                     'Active regions: %s' % active_regions
                     ]
+            loading_data = loading() if loading is not None else None
+            if loading_data:
+                top_tb.append('Loading: %s' % ', '.join(loading_data))
             top_tb = '   '.join(top_tb)
+            progress_tb = self._get_progress(progress)
 
             is_fuzzy = 'ON' if fuzzy() else 'OFF'
             is_caching = 'ON' if caching() else 'OFF'
@@ -48,7 +61,27 @@ class Toolbar(object):
                     ]
             bottom_tb = '   '.join(bottom_tb)
 
-            tb = HTML(text_type('\n'.join((top_tb, bottom_tb))))
+            lines = (top_tb, progress_tb, bottom_tb)
+            tb = HTML(text_type('\n'.join(line for line in lines if line)))
             return tb
 
         return get_toolbar
+
+    def _get_progress(self, get_progress):
+        if get_progress is None:
+            return None
+        progress = get_progress()
+        if not progress.total:
+            return None
+        targets = '%s/%s' % (progress.finished, progress.total)
+        if progress.failed:
+            targets += ' (%s failed)' % progress.failed
+        rate = progress.rate
+        eta = progress.eta
+        progress_tb = [
+                'Targets: %s' % targets,
+                'Running: %s/%s' % (progress.running, progress.workers),
+                'Rate: %s' % ('%.1f/s' % rate if rate is not None else '-'),
+                'ETA: %s' % ('%ds' % round(eta) if eta is not None else '-')
+                ]
+        return '   '.join(progress_tb)
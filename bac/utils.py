@@ -4,16 +4,27 @@
 import argparse
 import logging
 import os
+import sqlite3
+import threading
+import time
 
 import subprocess32
 
+from botocore.loaders import create_loader
 from subprocess32 import PIPE
 
-from bac.constants import CLI_OPTION_HAS_ARGS, PROFILE_OPTIONS
-from bac.errors import ArgumentParserDoneException, TimeoutException
+from bac.constants import (CLI_OPTION_HAS_ARGS, EXECUTOR_POLL_INTERVAL,
+                           GLOBAL_ENDPOINT_REGION, GLOBAL_OPERATIONS,
+                           PROFILE_OPTIONS, READ_ONLY_PREFIXES,
+                           REGION_OPTIONS)
+from bac.errors import (ArgumentParserDoneException, CancelledException,
+                        TimeoutException)
 
 log = logging.getLogger(__name__)
 
+# Regions of the global endpoints, loaded once from the botocore data
+_global_endpoints = None
+
 
 class ArgumentParser(argparse.ArgumentParser):
     """
@@ -48,19 +59,142 @@ def ensure_path(*args):
     return path
 
 
-def execute_command(command, timeout=None):
-    """Execute command with a timeout."""
-    with subprocess32.Popen(command, stdout=PIPE, stderr=PIPE) as process:
+class Database(object):
+    """
+    SQLite database shared by the threads of BAC.
+
+    The database file is created on the first use, accessible only
+    by the user, as it may contain outputs of the commands. Use it as
+    a context manager, which holds the lock of the database:
+
+        with database as connection:
+            connection.execute(...)
+    """
+    def __init__(self, path, schema, on_connect=None):
+        """
+        :param path: Path to the SQLite database file.
+        :type: str
+        :param schema: SQL script, which creates the tables.
+        :type: str
+        :param on_connect: Called with the new connection, once the
+            tables are created.
+        :type: callable
+        :rtype: None
+        """
+        self.path = os.path.expanduser(path)
+        self._schema = schema
+        self._on_connect = on_connect
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
         try:
-            (out, err) = process.communicate(timeout=timeout)
-        except subprocess32.TimeoutExpired as e:
-            process.kill()
-            raise TimeoutException(e)
+            return self._connect()
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def __exit__(self, *args):
+        self._lock.release()
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+        if not os.path.exists(self.path):
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+        # The database is used by the fan-out and background threads
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(self._schema)
+        if self._on_connect is not None:
+            self._on_connect(connection)
+        self._connection = connection
+        return connection
+
+
+def execute_command(command, timeout=None, env=None, cancelled=None,
+                    new_session=False):
+    """
+    Execute command with a timeout, capturing its output.
+
+    :param command: Command to be executed.
+    :type: list
+    :param timeout: Maximum time (in seconds) until the command
+        is killed.
+    :type: float
+    :param env: Environment of the command.
+    :type: dict
+    :param cancelled: Event, which kills the command once it is set.
+    :type: threading.Event
+    :param new_session: Start the command in a new session, so that
+        it does not receive the signals of the terminal, e.g. Ctrl-C.
+    :type: bool
+    :rtype: tuple of the output, error output and exit code
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    with subprocess32.Popen(command, stdout=PIPE, stderr=PIPE, env=env,
+                            start_new_session=new_session) as process:
+        try:
+            while True:
+                wait = timeout
+                if cancelled is not None:
+                    wait = EXECUTOR_POLL_INTERVAL
+                if deadline is not None:
+                    wait = max(0, min(wait, deadline - time.time()))
+                try:
+                    (out, err) = process.communicate(timeout=wait)
+                    break
+                except subprocess32.TimeoutExpired as e:
+                    if cancelled is not None and cancelled.is_set():
+                        raise CancelledException('Command has been cancelled')
+                    if deadline is not None and time.time() >= deadline:
+                        raise TimeoutException(e)
         finally:
+            if process.poll() is None:
+                process.kill()
             return_code = process.wait()
     return out.decode('utf-8'), err.decode('utf-8'), return_code
 
 
+def call_command(command, timeout=None, env=None, cancelled=None):
+    """
+    Execute command with a timeout, without capturing its output.
+
+    :param command: Command to be executed.
+    :type: list
+    :param timeout: Maximum time (in seconds) until the command
+        is killed.
+    :type: float
+    :param env: Environment of the command.
+    :type: dict
+    :param cancelled: Event, which kills the command once it is set.
+    :type: threading.Event
+    :rtype: int
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    process = subprocess32.Popen(command, env=env)
+    try:
+        while True:
+            wait = EXECUTOR_POLL_INTERVAL
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - time.time()))
+            try:
+                return process.wait(timeout=wait)
+            except subprocess32.TimeoutExpired as e:
+                if cancelled is not None and cancelled.is_set():
+                    raise CancelledException('Command has been cancelled')
+                if deadline is not None and time.time() >= deadline:
+                    raise TimeoutException(e)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
 def paginate(method, jmes_filter=None, **kwargs):
     """Paginate the AWS API output, if it's too large."""
     client = method.__self__
@@ -87,6 +221,72 @@ def extract_positional_args(command):
     return cmd
 
 
+def get_global_region(command):
+    """
+    Get the region of the global endpoint, which serves the command.
+
+    Commands of services, which are not regionalized (e.g. IAM or
+    Route53), and global operations of regional services (e.g.
+    "s3api list-buckets") return the same results in every region.
+    The services are resolved from the botocore endpoint metadata.
+
+    :param command: aws-cli command.
+    :type: list
+    :rtype: str or None if the command is regional
+    """
+    positionals = extract_positional_args(command)
+    if len(positionals) < 3:
+        return None
+    service, operation = positionals[1], positionals[2]
+    if service == 's3' and len(positionals) > 3:
+        # Only "aws s3 ls" without the path lists all of the buckets
+        return None
+    regionalized, region = _get_global_endpoints().get(
+            's3' if service == 's3api' else service, (True, None))
+    if regionalized and (service, operation) not in GLOBAL_OPERATIONS:
+        return None
+    return region or GLOBAL_ENDPOINT_REGION
+
+
+def is_read_only(command):
+    """
+    Check whether the aws-cli command only reads data.
+
+    Read-only commands call the "describe", "list" and "get"
+    operations (or list the S3 buckets and objects).
+
+    :param command: aws-cli command.
+    :type: list
+    :rtype: bool
+    """
+    positionals = extract_positional_args(command)
+    if len(positionals) < 3:
+        return False
+    service, operation = positionals[1], positionals[2]
+    if service == 's3':
+        return operation == 'ls'
+    return operation.startswith(READ_ONLY_PREFIXES)
+
+
+def _get_global_endpoints():
+    global _global_endpoints
+    if _global_endpoints is not None:
+        return _global_endpoints
+    endpoints = dict()
+    data = create_loader().load_data('endpoints')
+    # The standard "aws" partition is the first one
+    for name, service in data['partitions'][0]['services'].items():
+        regionalized = service.get('isRegionalized') is not False
+        global_endpoint = service.get('partitionEndpoint')
+        if regionalized and global_endpoint is None:
+            continue
+        scope = (service['endpoints'].get(global_endpoint, dict())
+                 .get('credentialScope', dict()))
+        endpoints[name] = (regionalized, scope.get('region'))
+    _global_endpoints = endpoints
+    return endpoints
+
+
 def extract_profile(command):
     """Extract profile name from aws-cli command."""
     iter_command = iter(command)
@@ -95,6 +295,14 @@ def extract_profile(command):
             return next(iter_command, None)
 
 
+def extract_region(command):
+    """Extract region name from aws-cli command."""
+    iter_command = iter(command)
+    for argument in iter_command:
+        if argument in REGION_OPTIONS:
+            return next(iter_command, None)
+
+
 class LevelFormatter(logging.Formatter):
     """
     Handles different formatting for different log levels.
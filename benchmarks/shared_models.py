@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+"""
+Benchmark of the service models shared by the sessions of the profiles.
+
+Creates the clients of the same services by the sessions of many
+profiles, once by plain boto3 sessions, which load the service models
+on their own, and once by the sessions sharing the models. Every
+scenario is executed by a fresh Python process, whose peak resident
+memory is reported.
+
+Usage: python benchmarks/shared_models.py [PROFILES]
+"""
+from __future__ import print_function
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILES = 100
+SERVICES = ['ec2', 'iam', 's3', 'sts']
+SCENARIOS = ['plain', 'shared']
+
+
+def write_config(directory, profiles):
+    path = os.path.join(directory, 'config')
+    with open(path, 'w') as f:
+        for i in range(profiles):
+            f.write('[profile bench-%s]\n' % i)
+            f.write('region = us-east-1\n')
+            f.write('aws_access_key_id = foo\n')
+            f.write('aws_secret_access_key = bar\n')
+    return path
+
+
+def run_scenario(scenario, profiles):
+    import boto3
+
+    from bac import models
+
+    start = time.time()
+    clients = list()
+    for i in range(profiles):
+        profile = 'bench-%s' % i
+        if scenario == 'shared':
+            session = boto3.session.Session(
+                    botocore_session=models.Session(), profile_name=profile)
+        else:
+            session = boto3.session.Session(profile_name=profile)
+        for service in SERVICES:
+            clients.append(session.client(service))
+    elapsed = time.time() - start
+    # Peak resident memory of the process, in kilobytes on Linux
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print('%s %s' % (elapsed, memory))
+
+
+def main():
+    profiles = int(sys.argv[1]) if len(sys.argv) > 1 else PROFILES
+    directory = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ)
+        env['AWS_CONFIG_FILE'] = write_config(directory, profiles)
+        env['AWS_SHARED_CREDENTIALS_FILE'] = os.path.join(directory,
+                                                          'credentials')
+        env['PYTHONPATH'] = os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))
+        results = dict()
+        for scenario in SCENARIOS:
+            output = subprocess.check_output(
+                    [sys.executable, __file__, '--scenario', scenario,
+                     str(profiles)], env=env)
+            elapsed, memory = output.split()
+            results[scenario] = (float(elapsed), int(memory))
+    finally:
+        shutil.rmtree(directory)
+    print('%s profiles, clients of %s' % (profiles, ', '.join(SERVICES)))
+    for scenario in SCENARIOS:
+        elapsed, memory = results[scenario]
+        print('%-8s %8.2f s %10.1f MiB' % (scenario, elapsed,
+                                           memory / 1024.0 / 1024))
+    plain, shared = results['plain'], results['shared']
+    print('saved    %8.2f s %10.1f MiB' % (
+            plain[0] - shared[0], (plain[1] - shared[1]) / 1024.0 / 1024))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--scenario':
+        run_scenario(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
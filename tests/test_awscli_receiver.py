@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
 import logging
 import unittest
 
@@ -14,9 +15,10 @@ from testfixtures import LogCapture, log_capture
 from tests._utils import _import, captured_output, check_logs
 awscli_receiver = _import('bac', 'awscli_receiver')
 errors = _import('bac', 'errors')
+rerun = _import('bac', 'rerun')
 
 ARGS = {'check': False, 'dry_run': False}
-COMMAND = ['aws', 's3api', 'list-buckets']
+COMMAND = ['aws', 's3api', 'list-objects']
 PROFILES = {'uno', 'dos'}
 REGIONS = {'us-east-1', 'eu-west-1'}
 SUPPORTED_REGIONS = {'us-east-2', 'eu-west-1', 'eu-west-2'}
@@ -78,16 +80,17 @@ class AwsCliReceiverTest(unittest.TestCase):
     @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
                 mock.Mock(return_value={'us-east-1'}))
     def test_no_regions(self, call):
+        call.return_value = 0
         self.pm.active_regions = set()
         with captured_output() as (out, err):
             with LogCapture(level=logging.WARNING) as captured_log:
                 self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'us-east-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'dos', '--region', 'us-east-1'], env=None)
                 ]
         call.assert_has_calls(results, any_order=True)
@@ -101,20 +104,30 @@ class AwsCliReceiverTest(unittest.TestCase):
         self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'us-east-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'eu-west-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'dos', '--region', 'us-east-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'dos', '--region', 'eu-west-1'], env=None)
                 ]
         call.assert_has_calls(results, any_order=True)
 
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value=REGIONS))
+    def test_assume_roles_before_execution(self, call):
+        self.pm.assume_roles.side_effect = (
+                lambda profiles: self.assertFalse(call.called))
+        self.receiver.execute_awscli_command(self.command, self.args)
+        profiles = self.pm.assume_roles.call_args[0][0]
+        self.assertEqual(sorted(profiles), ['dos', 'dos', 'uno', 'uno'])
+
     @mock.patch('subprocess.call')
     @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
                 mock.Mock(return_value=REGIONS))
@@ -123,10 +136,10 @@ class AwsCliReceiverTest(unittest.TestCase):
         self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'tres', '--region', 'us-east-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'tres', '--region', 'eu-west-1'], env=None),
                 ]
         call.assert_has_calls(results, any_order=True)
@@ -144,10 +157,10 @@ class AwsCliReceiverTest(unittest.TestCase):
         self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--region',
+                    ['aws', 's3api', 'list-objects', '--region',
                      'ca-central-1', '--profile', 'uno'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--region',
+                    ['aws', 's3api', 'list-objects', '--region',
                      'ca-central-1', '--profile', 'dos'], env=None),
                 ]
         call.assert_has_calls(results, any_order=True)
@@ -175,14 +188,79 @@ class AwsCliReceiverTest(unittest.TestCase):
             self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'eu-west-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'dos', '--region', 'eu-west-1'], env=None),
                 ]
         call.assert_has_calls(results, any_order=True)
 
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions')
+    def test_global_service(self, filter_regions, call):
+        self.pm.active_regions = {'us-east-1', 'eu-west-1'}
+        command = ['aws', 'iam', 'list-users']
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(command, self.args)
+        filter_regions.assert_not_called()
+        results = [
+                mock.call(command + ['--profile', profile,
+                                     '--region', 'us-east-1'], env=None)
+                for profile in PROFILES]
+        call.assert_has_calls(results, any_order=True)
+        self.assertEqual(call.call_count, 2)
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions')
+    def test_global_operation_in_active_region(self, filter_regions, call):
+        self.pm.active_regions = {'eu-west-2', 'eu-west-1'}
+        self.pm.active_profiles = {'uno'}
+        command = ['aws', 's3api', 'list-buckets']
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(command, self.args)
+        filter_regions.assert_not_called()
+        call.assert_called_once_with(
+                command + ['--profile', 'uno', '--region', 'eu-west-1'],
+                env=None)
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions')
+    def test_global_service_explicit_region(self, filter_regions, call):
+        self.pm.active_profiles = {'uno'}
+        command = ['aws', 'route53', 'list-hosted-zones',
+                   '--region', 'eu-west-1']
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(command, self.args)
+        filter_regions.assert_not_called()
+        call.assert_called_once_with(command + ['--profile', 'uno'],
+                                     env=None)
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_dedupe_accounts(self, call):
+        self.pm.deduplicate_profiles.return_value = {'dos'}
+        vars(self.args)['dedupe_accounts'] = True
+        vars(self.args)['account_preferences'] = ['d*']
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        self.pm.deduplicate_profiles.assert_called_once_with(PROFILES, ['d*'])
+        call.assert_called_once_with(
+                self.command + ['--profile', 'dos', '--region', 'us-east-1'],
+                env=None)
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_dedupe_accounts_skips_mutating(self, call):
+        vars(self.args)['dedupe_accounts'] = True
+        command = ['aws', 's3api', 'delete-bucket', '--bucket', 'foo']
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(command, self.args)
+        self.pm.deduplicate_profiles.assert_not_called()
+        self.assertEqual(call.call_count, 2)
+
     @mock.patch('subprocess.call')
     @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_supported_regions',
                 mock.Mock(return_value=SUPPORTED_REGIONS))
@@ -199,6 +277,7 @@ class AwsCliReceiverTest(unittest.TestCase):
     @mock.patch('subprocess.call')
     @mock.patch('bac.awscli_receiver.AwsCliReceiver._get_enabled_regions')
     def test_handle_privilege_filtering_error(self, ec2, call):
+        call.return_value = 0
         ec2.side_effect = ClientError(dict(), 'UnauthorizedOperation')
         self.pm.active_profiles = {'uno'}
         with captured_output() as (out, err):
@@ -206,10 +285,10 @@ class AwsCliReceiverTest(unittest.TestCase):
                 self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'us-east-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'eu-west-1'], env=None),
                 ]
         call.assert_has_calls(results, any_order=True)
@@ -220,6 +299,7 @@ class AwsCliReceiverTest(unittest.TestCase):
     @mock.patch('subprocess.call')
     @mock.patch('bac.awscli_receiver.AwsCliReceiver._get_enabled_regions')
     def test_handle_filtering_error(self, ec2, call):
+        call.return_value = 0
         ec2.side_effect = ClientError(dict(), 'SomeOperation')
         self.pm.active_profiles = {'uno'}
         with captured_output() as (out, err):
@@ -227,10 +307,10 @@ class AwsCliReceiverTest(unittest.TestCase):
                 self.receiver.execute_awscli_command(self.command, self.args)
         results = [
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'us-east-1'], env=None),
                 mock.call(
-                    ['aws', 's3api', 'list-buckets', '--profile',
+                    ['aws', 's3api', 'list-objects', '--profile',
                      'uno', '--region', 'eu-west-1'], env=None),
                 ]
         call.assert_has_calls(results, any_order=True)
@@ -238,8 +318,240 @@ class AwsCliReceiverTest(unittest.TestCase):
                    ['error occured while filtering',
                     'Continuing with all active regions'])
 
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_report_exit_code(self, call):
+        call.return_value = 254
+        self.pm.active_profiles = {'uno'}
+        with LogCapture(level=logging.WARNING) as captured_log:
+            self.receiver.execute_awscli_command(self.command, self.args)
+        check_logs(captured_log, 'bac.awscli_receiver', 'WARNING',
+                   ['Profile=uno', 'Region=us-east-1',
+                    'non-zero exit code', '254'])
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_cmd_exec_engine(self, call):
+        engine = mock.Mock()
+        engine.execute.side_effect = lambda target, timeout=None: (
+                awscli_receiver.TargetResult(target, 0, 'out\n', 'err\n'))
+        engines = mock.Mock()
+        engines.get_engine.return_value = engine
+        self.receiver._engines = engines
+        self.pm.active_profiles = {'uno'}
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        call.assert_not_called()
+        target = engine.execute.call_args[0][0]
+        self.assertEqual(target.command,
+                         ['aws', 's3api', 'list-objects', '--profile',
+                          'uno', '--region', 'us-east-1'])
+        self.assertEqual(out.getvalue(), 'out\n')
+        self.assertEqual(err.getvalue(), 'err\n')
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_engine_help_fallback(self, call):
+        call.return_value = 0
+        engines = mock.Mock()
+        self.receiver._engines = engines
+        self.pm.active_profiles = {'uno'}
+        self.command = ['aws', 's3api', 'list-objects', 'help']
+        self.receiver.execute_awscli_command(self.command, self.args)
+        call.assert_called_once_with(self.command, env=None)
+        engines.get_engine.return_value.execute.assert_not_called()
+
+    @mock.patch('bac.awscli_receiver.execute_command')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_aggregate_output(self, execute_command):
+        execute_command.return_value = ('{"Buckets": []}', '', 0)
+        self.pm.active_profiles = {'uno'}
+        self.pm.account_names = {'uno': 'account-uno'}
+        vars(self.args)['output_format'] = 'json'
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        execute_command.assert_called_once_with(
+                ['aws', 's3api', 'list-objects', '--profile', 'uno',
+                 '--region', 'us-east-1'], None, env=None,
+                cancelled=mock.ANY, new_session=False)
+        self.assertEqual(json.loads(out.getvalue()),
+                         [{'profile': 'uno', 'account': 'account-uno',
+                           'region': 'us-east-1', 'exit_code': 0,
+                           'output': {'Buckets': []}}])
+
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_prefixed_output(self):
+        engine = mock.Mock()
+        engine.execute.side_effect = lambda target, timeout=None: (
+                awscli_receiver.TargetResult(target, 0, 'foo\nbar\n', ''))
+        engines = mock.Mock()
+        engines.get_engine.return_value = engine
+        self.receiver._engines = engines
+        self.pm.active_profiles = {'uno'}
+        vars(self.args)['prefix_order'] = 'ordered'
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        self.assertEqual(out.getvalue(), '[uno/us-east-1] foo\n'
+                                         '[uno/us-east-1] bar\n')
+
+    @mock.patch('bac.awscli_receiver.execute_command')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_store_results(self, execute_command):
+        execute_command.return_value = ('out\n', 'err\n', 0)
+        self.pm.active_profiles = {'uno'}
+        self.receiver._store = mock.Mock()
+        vars(self.args)['store'] = True
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        self.receiver._store.start_run.assert_called_once_with(
+                'aws', 'aws s3api list-objects', self.pm.account_names)
+        run = self.receiver._store.start_run.return_value
+        result = run.add.call_args[0][0]
+        self.assertEqual((result.out, result.err), ('out\n', 'err\n'))
+        run.finish.assert_called_once_with()
+        self.assertEqual(out.getvalue(), 'out\n')
+        self.assertEqual(err.getvalue(), 'err\n')
+
+    @mock.patch('bac.awscli_receiver.execute_command')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_bac_query(self, execute_command):
+        execute_command.return_value = ('{"Buckets": [{"Name": "foo"}]}',
+                                        '', 0)
+        self.pm.active_profiles = {'uno'}
+        self.pm.account_names = {'uno': 'account-uno'}
+        vars(self.args)['bac_query'] = '[].output.Buckets[].Name'
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        self.assertEqual(json.loads(out.getvalue()), ['foo'])
+
+    @mock.patch('bac.awscli_receiver.current_job')
+    @mock.patch('bac.awscli_receiver.execute_command')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    def test_background_job(self, execute_command, current_job):
+        execute_command.return_value = ('out\n', '', 0)
+        self.pm.active_profiles = {'uno'}
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        # Captured, so that it is printed through the job, and not
+        # interrupted by Ctrl-C of the foreground commands
+        execute_command.assert_called_once_with(
+                ['aws', 's3api', 'list-objects', '--profile', 'uno',
+                 '--region', 'us-east-1'], None, env=None,
+                cancelled=mock.ANY, new_session=True)
+        self.assertEqual(out.getvalue(), 'out\n')
+        current_job.return_value.attach.assert_called_once_with(mock.ANY)
+
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1', 'eu-west-1'}))
+    def test_rerun_failed(self):
+        engine = mock.Mock()
+        engine.execute.side_effect = lambda target, timeout=None: (
+                awscli_receiver.TargetResult(
+                        target, int(target.region == 'eu-west-1')))
+        engines = mock.Mock()
+        engines.get_engine.return_value = engine
+        last_fan_out = rerun.LastFanOut()
+        self.receiver._engines = engines
+        self.receiver._last_fan_out = last_fan_out
+        self.pm.active_profiles = {'uno'}
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+            last_fan_out.rerun_failed(['rerun-failed'])
+        self.assertEqual(engine.execute.call_count, 3)
+        target = engine.execute.call_args[0][0]
+        self.assertEqual(target.command,
+                         ['aws', 's3api', 'list-objects', '--profile',
+                          'uno', '--region', 'eu-west-1'])
+        self.assertEqual([t.region for t in last_fan_out.failed],
+                         ['eu-west-1'])
+
+    @mock.patch('bac.awscli_receiver.execute_command')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    @mock.patch('bac.awscli_receiver.classify_command',
+                mock.Mock(return_value=('s3', True, True)))
+    def test_cached_results(self, execute_command):
+        execute_command.return_value = ('out\n', '', 0)
+        cache = mock.Mock()
+        cache.get.side_effect = [None, awscli_receiver.TargetResult(
+                mock.Mock(), 0, 'cached\n', '')]
+        self.receiver._cache = cache
+        self.pm.active_profiles = {'uno'}
+        vars(self.args)['cache_ttl'] = 60
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+            self.receiver.execute_awscli_command(self.command, self.args)
+        self.assertEqual(execute_command.call_count, 1)
+        self.assertEqual(cache.get.call_args[0][1], 60)
+        cache.put.assert_called_once_with('s3', mock.ANY)
+        cache.invalidate.assert_not_called()
+        self.assertEqual(out.getvalue(), 'out\ncached\n')
+
+    @mock.patch('bac.awscli_receiver.execute_command')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    @mock.patch('bac.awscli_receiver.classify_command',
+                mock.Mock(return_value=('s3', True, True)))
+    def test_bypass_cache(self, execute_command):
+        execute_command.return_value = ('out\n', '', 0)
+        cache = mock.Mock()
+        self.receiver._cache = cache
+        self.pm.active_profiles = {'uno'}
+        vars(self.args)['cache_ttl'] = 60
+        vars(self.args)['no_cache'] = True
+        with captured_output() as (out, err):
+            self.receiver.execute_awscli_command(self.command, self.args)
+        cache.get.assert_not_called()
+        cache.put.assert_not_called()
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    @mock.patch('bac.awscli_receiver.classify_command')
+    def test_disabled_cache_not_touched(self, classify_command, call):
+        call.return_value = 0
+        cache = mock.Mock()
+        self.receiver._cache = cache
+        self.pm.active_profiles = {'uno'}
+        vars(self.args)['cache_ttl'] = 0
+        self.receiver.execute_awscli_command(
+                ['aws', 's3api', 'delete-bucket', '--bucket', 'foo'],
+                self.args)
+        vars(self.args)['cache_ttl'] = 60
+        vars(self.args)['no_cache'] = True
+        self.receiver.execute_awscli_command(
+                ['aws', 's3api', 'delete-bucket', '--bucket', 'foo'],
+                self.args)
+        classify_command.assert_not_called()
+        self.assertEqual(cache.mock_calls, [])
+
+    @mock.patch('subprocess.call')
+    @mock.patch('bac.awscli_receiver.AwsCliReceiver._filter_regions',
+                mock.Mock(return_value={'us-east-1'}))
+    @mock.patch('bac.awscli_receiver.classify_command',
+                mock.Mock(return_value=('s3', False, False)))
+    def test_mutating_command_invalidates_cache(self, call):
+        call.return_value = 0
+        cache = mock.Mock()
+        self.receiver._cache = cache
+        self.pm.active_profiles = {'uno'}
+        vars(self.args)['cache_ttl'] = 60
+        self.receiver.execute_awscli_command(
+                ['aws', 's3api', 'delete-bucket', '--bucket', 'foo'],
+                self.args)
+        cache.get.assert_not_called()
+        cache.invalidate.assert_called_once_with('s3')
+
     def test_handle_service_extraction_error(self):
-        command = ['aws', '--weird-arg', 's3api', 'list-buckets']
+        command = ['aws', '--weird-arg', 's3api', 'list-objects']
         with self.assertRaises(errors.InvalidAwsCliCommandError):
             self.receiver.execute_awscli_command(command, self.args)
 
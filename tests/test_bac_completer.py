@@ -32,6 +32,26 @@ class BACCommandsTest(unittest.TestCase):
         fake_pm = self._get_profile_manager()
         self.completer = bac_completer.BACCompleter(fake_pm)
 
+    def test_no_completions_while_loading(self):
+        loader = mock.Mock()
+        completer = bac_completer.BACCompleter(
+                self._get_profile_manager(), loader)
+        loader.start.assert_called_once_with('completions',
+                                             completer._initialize)
+        doc = Document(text_type('lis'), 3)
+        self.assertEqual(list(completer.get_completions(doc,
+                                                        CompleteEvent())),
+                         [])
+
+    def test_refresh_profiles(self):
+        pm = self.completer._profile_manager
+        pm.sessions = {'prof1': mock.Mock(), 'prof3': mock.Mock()}
+        pm.account_names = {'prof3': '111111111111'}
+        self.completer.refresh_profiles()
+        completer = self.completer._profile_completer.completer
+        self.assertEqual(completer.words, ['prof1', 'prof3'])
+        self.assertEqual(completer.meta_dict, {'prof3': '111111111111'})
+
     def _get_profile_manager(self):
         pm = mock.Mock()
         pm.available_regions = REGS
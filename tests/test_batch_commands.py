@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
 import logging
 import mock
 import unittest
@@ -13,6 +14,7 @@ from testfixtures import LogCapture, log_capture
 from tests._utils import _import, captured_output, check_logs
 batch = _import('bac', 'batch')
 errors = _import('bac', 'errors')
+rerun = _import('bac', 'rerun')
 utils = _import('bac', 'utils')
 
 
@@ -35,6 +37,17 @@ class BatchCommandTest(unittest.TestCase):
         self.checker = mock.Mock()
         global_args = mock.Mock()
         global_args.dry_run = False
+        global_args.workers = 4
+        global_args.max_per_profile = None
+        global_args.max_per_region = None
+        global_args.output_format = None
+        global_args.rate_limits = None
+        global_args.bac_query = None
+        global_args.target_timeout = None
+        global_args.budget = None
+        global_args.cache_ttl = 0
+        global_args.no_cache = False
+        global_args.no_timings = False
         self.globals = global_args
 
     @log_capture('bac.utils', level=logging.ERROR)
@@ -84,10 +97,14 @@ class BatchCommandTest(unittest.TestCase):
         m.return_value = ('', '', 0)
         # 30 here, stands for 30 seconds timeout, which is the default value
         results = [
-                mock.call(COMMAND1, 30),
-                mock.call(COMMAND2, 30),
-                mock.call(COMMAND3, 30),
-                mock.call(COMMAND4, 30)
+                mock.call(COMMAND1, 30, cancelled=mock.ANY,
+                          new_session=False),
+                mock.call(COMMAND2, 30, cancelled=mock.ANY,
+                          new_session=False),
+                mock.call(COMMAND3, 30, cancelled=mock.ANY,
+                          new_session=False),
+                mock.call(COMMAND4, 30, cancelled=mock.ANY,
+                          new_session=False)
                 ]
         with mock.patch('bac.batch.execute_command', m) as execute_command:
             batch.CommandBatch(self.globals, self.argv, self.checker)
@@ -102,6 +119,100 @@ class BatchCommandTest(unittest.TestCase):
             expected = text_type('Some output\n')
             self.assertEqual(out.getvalue(), expected)
 
+    @mock.patch('bac.batch.execute_command')
+    def test_command_calls_engine(self, execute_command):
+        engine = mock.Mock()
+        engine.execute.side_effect = lambda target, timeout: (
+                batch.TargetResult(target, 0, 'output', ''))
+        engines = mock.Mock()
+        engines.get_engine.return_value = engine
+        with captured_output() as (out, err):
+            batch.CommandBatch(
+                    self.globals, self.argv, self.checker, engines)
+        execute_command.assert_not_called()
+        commands = [c[0][0].command for c in engine.execute.call_args_list]
+        self.assertEqual(sorted(commands),
+                         sorted([COMMAND1, COMMAND2, COMMAND3, COMMAND4]))
+        self.assertEqual(out.getvalue(), text_type('output\n') * 4)
+
+    @mock.patch('bac.batch.execute_command')
+    def test_aggregate_output(self, execute_command):
+        execute_command.return_value = ('{"Buckets": []}', '', 0)
+        self.globals.output_format = 'jsonl'
+        with captured_output() as (out, err):
+            batch.CommandBatch(self.globals, self.argv, self.checker,
+                               account_names={'uno': 'account-uno'})
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(records), 4)
+        self.assertEqual(
+                sorted((r['profile'], r['region']) for r in records),
+                [('dos', 'eu-west-1'), ('dos', 'us-east-1'),
+                 ('uno', 'eu-west-1'), ('uno', 'us-east-1')])
+        for record in records:
+            self.assertEqual(record['output'], {'Buckets': []})
+            self.assertEqual(record['account'],
+                             'account-uno' if record['profile'] == 'uno'
+                             else None)
+
+    @mock.patch('bac.batch.execute_command')
+    def test_store_results(self, execute_command):
+        execute_command.return_value = ('output', '', 0)
+        result_store = mock.Mock()
+        self.globals.store = True
+        with captured_output() as (out, err):
+            batch.CommandBatch(self.globals, self.argv, self.checker,
+                               store=result_store)
+        result_store.start_run.assert_called_once_with(
+                'batch-command', 'batch-command %s' % VALID_DEF_PATH, None)
+        run = result_store.start_run.return_value
+        self.assertEqual(run.add.call_count, 4)
+        run.finish.assert_called_once_with()
+        self.assertEqual(out.getvalue(), text_type('output\n') * 4)
+
+    @mock.patch('bac.batch.execute_command')
+    def test_rerun_failed(self, execute_command):
+        execute_command.side_effect = lambda command, timeout, **kwargs: (
+                ('', 'error', 255) if command == COMMAND3 else ('', '', 0))
+        last_fan_out = rerun.LastFanOut()
+        with captured_output() as (out, err):
+            batch.CommandBatch(self.globals, self.argv, self.checker,
+                               last_fan_out=last_fan_out)
+        self.assertEqual([t.command for t in last_fan_out.failed],
+                         [COMMAND3])
+        execute_command.reset_mock()
+        execute_command.side_effect = None
+        execute_command.return_value = ('', '', 0)
+        with captured_output() as (out, err):
+            last_fan_out.rerun_failed(['rerun-failed'])
+        execute_command.assert_called_once_with(COMMAND3, 30,
+                                                cancelled=mock.ANY,
+                                                new_session=False)
+        self.assertEqual(last_fan_out.failed, [])
+
+    @mock.patch('bac.batch.execute_command')
+    @mock.patch('bac.batch.classify_command',
+                mock.Mock(return_value=('s3', False, False)))
+    def test_invalidate_cache(self, execute_command):
+        execute_command.return_value = ('', '', 0)
+        cache = mock.Mock()
+        self.globals.cache_ttl = 60
+        with captured_output() as (out, err):
+            batch.CommandBatch(self.globals, self.argv, self.checker,
+                               cache=cache)
+        cache.invalidate.assert_called_once_with('s3')
+
+    @mock.patch('bac.batch.execute_command')
+    @mock.patch('bac.batch.classify_command')
+    def test_disabled_cache_not_invalidated(self, classify_command,
+                                            execute_command):
+        execute_command.return_value = ('', '', 0)
+        cache = mock.Mock()
+        with captured_output() as (out, err):
+            batch.CommandBatch(self.globals, self.argv, self.checker,
+                               cache=cache)
+        classify_command.assert_not_called()
+        cache.invalidate.assert_not_called()
+
     @mock.patch('bac.batch.Parser.parse', mock.Mock(return_value=['foo']))
     @mock.patch('bac.batch.execute_command')
     def test_handle_timeout(self, execute_command):
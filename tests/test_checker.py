@@ -43,3 +43,48 @@ class CheckerSyntaxTest(CheckerTest):
             expected = text_type(
                     'Checks for s3 file commands are not supported.\n')
             self.assertEqual(out.getvalue(), expected)
+
+
+class CheckerResolveTest(CheckerTest):
+    def test_resolve(self):
+        cmd = ['s3api', 'list-objects', '--bucket', 'foo', '--max-keys', '5',
+               '--query', 'Contents', '--region', 'eu-west-1']
+        call = self.checker.resolve(cmd)
+        self.assertEqual(call.service_name, 's3')
+        self.assertEqual(call.operation_name, 'ListObjects')
+        self.assertEqual(call.method_name, 'list_objects')
+        self.assertEqual(call.parameters, {'Bucket': 'foo', 'MaxKeys': 5})
+        self.assertEqual(call.parsed_globals.query, 'Contents')
+        self.assertEqual(call.parsed_globals.region, 'eu-west-1')
+        self.assertEqual(call.operation_model.name, 'ListObjects')
+
+    def test_reload(self):
+        session = self.checker._get_profile_session('foo')
+        self.checker.reload()
+        self.assertIsNot(self.checker._get_profile_session('foo'), session)
+        self.assertIsNotNone(self.checker.command_table)
+
+    def test_resolve_custom_s3(self):
+        self.assertIsNone(self.checker.resolve(['s3', 'ls']))
+
+    def test_handle_resolve_invalid_operation(self):
+        cmd = ['s3api', 'list-foos', '--bucket', 'foo']
+        with self.assertRaises(errors.CLICheckerSyntaxError):
+            self.checker.resolve(cmd)
+
+    def test_handle_resolve_missing_parameter(self):
+        cmd = ['s3api', 'list-objects']
+        with captured_output() as (out, err):
+            with self.assertRaises(errors.CLICheckerSyntaxError):
+                self.checker.resolve(cmd)
+        # Usage is printed only by the check
+        self.assertEqual((out.getvalue(), err.getvalue()), ('', ''))
+        with captured_output() as (out, err):
+            with self.assertRaises(errors.CLICheckerSyntaxError):
+                self.checker.check(cmd)
+        self.assertIn('usage', err.getvalue())
+
+    def test_handle_resolve_invalid_value(self):
+        cmd = ['s3api', 'list-objects', '--bucket', 'foo', '--max-keys', 'x']
+        with self.assertRaises(errors.CLICheckerSyntaxError):
+            self.checker.resolve(cmd)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+import boto3
+import mock
+
+from argparse import Namespace
+from botocore.stub import Stubber
+
+from tests._utils import _import
+checker = _import('bac', 'checker')
+engines = _import('bac', 'engines')
+executor = _import('bac', 'executor')
+models = _import('bac', 'models')
+
+
+class FakeDriver(object):
+    """Writes its arguments to stdout, and fails if asked to."""
+    def __init__(self, profile):
+        self._profile = profile
+
+    def main(self, args):
+        for arg in args:
+            sys.stdout.write('%s:%s\n' % (self._profile, arg))
+            time.sleep(0.01)
+        if 'fail' in args:
+            sys.stderr.write('%s failed\n' % self._profile)
+            return 255
+        return 0
+
+
+class RequiresSubprocessTest(unittest.TestCase):
+    def test_help(self):
+        self.assertTrue(engines.requires_subprocess(
+                ['aws', 'ec2', 'help']))
+
+    def test_configure(self):
+        self.assertTrue(engines.requires_subprocess(
+                ['aws', 'configure', '--profile', 'uno']))
+
+    def test_regular_command(self):
+        self.assertFalse(engines.requires_subprocess(
+                ['aws', 's3api', 'list-buckets', '--profile', 'help']))
+
+    def test_binary_stream(self):
+        self.assertTrue(engines.requires_subprocess(
+                ['aws', 's3', 'cp', 's3://foo/bar', '-']))
+        self.assertTrue(engines.requires_subprocess(
+                ['aws', 's3', 'cp', '-', 's3://foo/bar']))
+        self.assertFalse(engines.requires_subprocess(
+                ['aws', 's3', 'cp', 's3://foo/bar', 'bar']))
+
+
+class EngineProviderTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = engines.EngineProvider(mock.Mock(), mock.Mock())
+
+    def test_subprocess(self):
+        self.assertIsNone(self.provider.get_engine(Namespace()))
+        args = Namespace(engine='subprocess')
+        self.assertIsNone(self.provider.get_engine(args))
+
+    def test_engine_is_reused(self):
+        args = Namespace(engine='in-process')
+        engine = self.provider.get_engine(args)
+        self.assertIsInstance(engine, engines.InProcessEngine)
+        self.assertIs(engine, self.provider.get_engine(args))
+        engine = self.provider.get_engine(Namespace(engine='boto3'))
+        self.assertIsInstance(engine, engines.Boto3Engine)
+
+    def test_reload(self):
+        engine = mock.Mock()
+        self.provider._engines['boto3'] = engine
+        self.provider.reload()
+        engine.reload.assert_called_once_with()
+
+
+class InProcessEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.pm = mock.Mock()
+        self.pm.sessions = dict()
+        self.engine = engines.InProcessEngine(self.pm)
+
+    def test_captures_output_per_target(self):
+        targets = [
+                executor.Target(['aws', 'foo', 'bar'], 'uno', 'us-east-1'),
+                executor.Target(['aws', 'foo', 'fail'], 'dos', 'us-east-1'),
+                ]
+        stdout = sys.stdout
+        with mock.patch('bac.engines.InProcessEngine._create_driver',
+                        side_effect=FakeDriver):
+            fan_out = executor.FanOutExecutor(workers=2)
+            results = fan_out.run(targets, self.engine.execute)
+        self.assertIs(sys.stdout, stdout)
+        self.assertEqual(results[0].out, 'uno:foo\nuno:bar\n')
+        self.assertEqual(results[0].err, '')
+        self.assertEqual(results[0].exit_code, 0)
+        self.assertEqual(results[1].out, 'dos:foo\ndos:fail\n')
+        self.assertEqual(results[1].err, 'dos failed\n')
+        self.assertEqual(results[1].exit_code, 255)
+
+    def test_other_threads_are_not_captured(self):
+        written = list()
+
+        class Driver(FakeDriver):
+            def main(self, args):
+                thread = threading.Thread(
+                        target=lambda: written.append(sys.stdout.current()))
+                thread.start()
+                thread.join()
+                return 0
+
+        target = executor.Target(['aws', 'foo'], 'uno', 'us-east-1')
+        with mock.patch('bac.engines.InProcessEngine._create_driver',
+                        side_effect=Driver):
+            self.engine.execute(target)
+        self.assertNotIsInstance(written[0], engines.StringIO)
+
+    def test_binary_output_is_captured(self):
+        class Driver(FakeDriver):
+            def main(self, args):
+                sys.stdout.buffer.write(b'\xc5\xa1')
+                sys.stdout.flush()
+                return 0
+
+        target = executor.Target(['aws', 'foo'], 'uno', 'us-east-1')
+        with mock.patch('bac.engines.InProcessEngine._create_driver',
+                        side_effect=Driver):
+            result = self.engine.execute(target)
+        self.assertEqual(result.out, u'\u0161')
+
+    @mock.patch('bac.engines.execute_command')
+    def test_timeout_executed_by_subprocess(self, execute_command):
+        execute_command.return_value = ('out', 'err', 0)
+        target = executor.Target(['aws', 'foo'], 'uno', 'us-east-1')
+        with mock.patch('bac.engines.InProcessEngine._create_driver') as \
+                create_driver:
+            result = self.engine.execute(target, 5)
+        create_driver.assert_not_called()
+        execute_command.assert_called_once_with(
+                ['aws', 'foo'], 5, env=mock.ANY, cancelled=target.cancelled,
+                new_session=False)
+        self.assertEqual((result.out, result.err, result.exit_code),
+                         ('out', 'err', 0))
+
+    def test_real_driver_syntax_error(self):
+        target = executor.Target(['aws', 's3api', 'list-objects'],
+                                 'uno', 'us-east-1')
+        result = self.engine.execute(target)
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertEqual(result.out, '')
+        self.assertIn('--bucket', result.err)
+
+    def test_shares_profile_session_components(self):
+        provider = mock.Mock()
+        source = mock.Mock()
+        source._session.get_component.return_value = provider
+        self.pm.sessions = {'uno': source}
+        driver = self.engine._create_driver('uno')
+        self.assertIs(driver.session.get_component('data_loader'),
+                      models.get_loader())
+        self.assertIs(
+                driver.session.get_component('credential_provider'), provider)
+
+
+class Boto3EngineTest(unittest.TestCase):
+    def setUp(self):
+        self.pm = mock.Mock()
+        session = boto3.session.Session(
+                aws_access_key_id='foo', aws_secret_access_key='bar')
+        self.pm.sessions = {'uno': session, 'dos': session}
+        self.checker = checker.CLIChecker(None)
+        self.engine = engines.Boto3Engine(self.pm, self.checker)
+
+    def stub(self, profile, service, region='us-east-1'):
+        client = self.engine._clients.get_client(profile, region, service)
+        stubber = Stubber(client)
+        stubber.activate()
+        self.addCleanup(stubber.deactivate)
+        return stubber
+
+    def target(self, command, profile='uno', region='us-east-1'):
+        command = command + ['--profile', profile, '--region', region]
+        return executor.Target(command, profile, region)
+
+    def test_call(self):
+        response = {'AccountAliases': ['foo']}
+        stubber = self.stub('uno', 'iam')
+        stubber.add_response(
+                'list_account_aliases', dict(response), {'MaxItems': 10})
+        target = self.target(['aws', 'iam', 'list-account-aliases',
+                              '--max-items', '10', '--no-paginate'])
+        result = self.engine.execute(target)
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(json.loads(result.out), response)
+        self.assertEqual(result.err, '')
+        stubber.assert_no_pending_responses()
+
+    def test_paginated_call(self):
+        stubber = self.stub('uno', 'iam')
+        stubber.add_response(
+                'list_account_aliases', {'AccountAliases': ['foo'],
+                                         'IsTruncated': True,
+                                         'Marker': 'next'}, {})
+        stubber.add_response(
+                'list_account_aliases', {'AccountAliases': ['bar']},
+                {'Marker': 'next'})
+        target = self.target(['aws', 'iam', 'list-account-aliases'])
+        result = self.engine.execute(target)
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(json.loads(result.out),
+                         {'AccountAliases': ['foo', 'bar']})
+
+    def test_query(self):
+        stubber = self.stub('uno', 's3')
+        stubber.add_response(
+                'list_buckets', {'Buckets': [{'Name': 'foo'},
+                                             {'Name': 'bar'}]}, {})
+        target = self.target(['aws', 's3api', 'list-buckets', '--query',
+                              'Buckets[].Name'])
+        result = self.engine.execute(target)
+        self.assertEqual(json.loads(result.out), ['foo', 'bar'])
+
+    def test_client_error(self):
+        stubber = self.stub('uno', 's3')
+        stubber.add_client_error('list_buckets', 'AccessDenied', 'Nope')
+        target = self.target(['aws', 's3api', 'list-buckets'])
+        result = self.engine.execute(target)
+        self.assertEqual(result.exit_code, 255)
+        self.assertEqual(result.out, '')
+        self.assertIn('AccessDenied', result.err)
+        self.assertIn('ListBuckets', result.err)
+
+    def test_clients_are_pooled(self):
+        pool = self.engine._clients
+        client = pool.get_client('uno', 'us-east-1', 's3')
+        self.assertIs(client, pool.get_client('uno', 'us-east-1', 's3'))
+        self.assertIsNot(client, pool.get_client('dos', 'us-east-1', 's3'))
+        self.assertIsNot(client, pool.get_client('uno', 'eu-west-1', 's3'))
+
+    def test_reload_drops_clients_and_outputs(self):
+        client = self.engine._clients.get_client('uno', 'us-east-1', 's3')
+        self.engine._outputs['uno'] = 'text'
+        self.engine.reload()
+        self.assertIsNot(
+                client,
+                self.engine._clients.get_client('uno', 'us-east-1', 's3'))
+        self.assertEqual(self.engine._outputs, {})
+
+    def test_command_resolved_once(self):
+        with mock.patch.object(self.checker, 'resolve',
+                               wraps=self.checker.resolve) as resolve:
+            for profile in ('uno', 'dos'):
+                stubber = self.stub(profile, 's3', 'eu-west-1')
+                stubber.add_response('list_buckets', {'Buckets': []}, {})
+                target = self.target(['aws', 's3api', 'list-buckets'],
+                                     profile, 'eu-west-1')
+                self.assertEqual(self.engine.execute(target).exit_code, 0)
+        resolve.assert_called_once()
+
+    @mock.patch.dict('os.environ', clear=False)
+    def test_profile_output_fallback(self):
+        os.environ.pop('AWS_DEFAULT_OUTPUT', None)
+        session = mock.Mock()
+        session._session.get_config_variable.return_value = None
+        session._session.get_scoped_config.return_value = {'output': 'text'}
+        self.pm.sessions = {'uno': session}
+        fallback = mock.Mock()
+        self.engine._fallback = fallback
+        target = self.target(['aws', 'iam', 'list-account-aliases'])
+        self.engine.execute(target, 30)
+        fallback.execute.assert_called_once_with(target, 30)
+
+    def test_explicit_output_overrides_profile_output(self):
+        self.engine._outputs['uno'] = 'text'
+        self.stub('uno', 'iam').add_response(
+                'list_account_aliases', {'AccountAliases': ['foo']})
+        result = self.engine.execute(self.target(
+                ['aws', 'iam', 'list-account-aliases', '--output', 'json']))
+        self.assertEqual(json.loads(result.out), {'AccountAliases': ['foo']})
+
+    def test_unsupported_commands_fallback(self):
+        commands = [
+                ['aws', 's3', 'ls'],
+                ['aws', 's3api', 'list-buckets', '--output', 'table'],
+                ['aws', 's3api', 'list-buckets', '--debug'],
+                ['aws', 'ec2', 'describe-instances',
+                 '--filters', 'file://filters.json'],
+                ['aws', 's3api', 'list-foos'],
+                ]
+        fallback = mock.Mock()
+        self.engine._fallback = fallback
+        for command in commands:
+            target = self.target(command)
+            self.engine.execute(target, 30)
+            fallback.execute.assert_called_with(target, 30)
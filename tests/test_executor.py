@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import logging
+import threading
+import time
+import unittest
+
+import mock
+
+from argparse import Namespace
+
+from testfixtures import LogCapture
+
+from tests._utils import _import, check_logs
+errors = _import('bac', 'errors')
+executor = _import('bac', 'executor')
+throttling = _import('bac', 'throttling')
+
+PROFILES = ['uno', 'dos', 'tres']
+REGIONS = ['us-east-1', 'eu-west-1']
+
+
+def prepare_targets(profiles=PROFILES, regions=REGIONS):
+    return [executor.Target(['aws', 'foo', p, r], p, r)
+            for p in profiles for r in regions]
+
+
+class ConcurrencyProbe(object):
+    """Tracks the peak concurrency of executed targets."""
+    def __init__(self, delay=0.05):
+        self._delay = delay
+        self._lock = threading.Lock()
+        self.running = list()
+        self.peak = 0
+        self.peak_profile = 0
+        self.peak_region = 0
+
+    def __call__(self, target):
+        with self._lock:
+            self.running.append(target)
+            self.peak = max(self.peak, len(self.running))
+            self.peak_profile = max(
+                    self.peak_profile,
+                    sum(t.profile == target.profile for t in self.running))
+            self.peak_region = max(
+                    self.peak_region,
+                    sum(t.region == target.region for t in self.running))
+        time.sleep(self._delay)
+        with self._lock:
+            self.running.remove(target)
+        return executor.TargetResult(target, 0)
+
+
+class FanOutExecutorTest(unittest.TestCase):
+    def test_results_keep_target_order(self):
+        targets = prepare_targets()
+        fan_out = executor.FanOutExecutor(workers=4)
+        results = fan_out.run(
+                targets, lambda t: executor.TargetResult(t, len(t.profile)))
+        self.assertEqual([r.target for r in results], targets)
+        self.assertEqual([r.exit_code for r in results],
+                         [3, 3, 3, 3, 4, 4])
+        for result in results:
+            self.assertIsNotNone(result.duration)
+
+    def test_global_limit(self):
+        probe = ConcurrencyProbe()
+        executor.FanOutExecutor(workers=2).run(prepare_targets(), probe)
+        self.assertEqual(probe.peak, 2)
+
+    def test_runs_concurrently(self):
+        probe = ConcurrencyProbe()
+        executor.FanOutExecutor(workers=6).run(prepare_targets(), probe)
+        self.assertEqual(probe.peak, 6)
+
+    def test_per_profile_limit(self):
+        probe = ConcurrencyProbe()
+        fan_out = executor.FanOutExecutor(workers=6, per_profile=1)
+        fan_out.run(prepare_targets(), probe)
+        self.assertEqual(probe.peak_profile, 1)
+        self.assertEqual(probe.peak, 3)
+
+    def test_per_region_limit(self):
+        probe = ConcurrencyProbe()
+        fan_out = executor.FanOutExecutor(workers=6, per_region=1)
+        fan_out.run(prepare_targets(), probe)
+        self.assertEqual(probe.peak_region, 1)
+        self.assertEqual(probe.peak, 2)
+
+    def test_handle_execution_error(self):
+        def failing(target):
+            raise ValueError('Something bad happened')
+
+        targets = prepare_targets(['uno'], ['us-east-1'])
+        with LogCapture(level=logging.ERROR) as captured_log:
+            results = executor.FanOutExecutor().run(targets, failing)
+        self.assertTrue(results[0].failed)
+        self.assertEqual(results[0].exit_code, 255)
+        check_logs(captured_log, 'bac.executor', 'ERROR',
+                   ['uno', 'us-east-1', 'Something bad happened'])
+
+    def test_on_result(self):
+        finished = list()
+        targets = prepare_targets()
+        results = executor.FanOutExecutor(workers=3).run(
+                targets, ConcurrencyProbe(), on_result=finished.append)
+        self.assertEqual(len(finished), len(targets))
+        self.assertEqual(set(finished), set(results))
+
+    def test_no_targets(self):
+        self.assertEqual(executor.FanOutExecutor().run([], None), [])
+
+    def test_from_args(self):
+        args = Namespace(workers=3, max_per_profile=2, max_per_region=1)
+        fan_out = executor.FanOutExecutor.from_args(args)
+        self.assertEqual(fan_out._workers, 3)
+        self.assertEqual(fan_out._per_profile, 2)
+        self.assertEqual(fan_out._per_region, 1)
+
+    def test_from_args_defaults(self):
+        fan_out = executor.FanOutExecutor.from_args(Namespace())
+        self.assertEqual(fan_out._workers, executor.DEFAULT_WORKERS)
+        self.assertIsNone(fan_out._per_profile)
+        self.assertIsNone(fan_out._per_region)
+
+    def test_from_args_shared_limiter(self):
+        limiter = throttling.RateLimiter()
+        args = Namespace(rate_limits=[('ec2', 2.0)], workers=3)
+        fan_out = executor.FanOutExecutor.from_args(args, limiter=limiter)
+        self.assertIs(fan_out._limiter, limiter)
+        self.assertEqual(limiter._rates, {'ec2': 2.0})
+        fan_out = executor.FanOutExecutor.from_args(Namespace(),
+                                                    limiter=limiter)
+        self.assertIsNone(fan_out._limiter)
+
+    def test_from_args_deadlines(self):
+        args = Namespace(target_timeout=10, budget=60)
+        fan_out = executor.FanOutExecutor.from_args(args)
+        self.assertEqual(fan_out._timeout, 10)
+        self.assertEqual(fan_out._budget, 60)
+
+    def test_from_args_no_timings(self):
+        history = mock.Mock()
+        fan_out = executor.FanOutExecutor.from_args(Namespace(),
+                                                    history=history)
+        self.assertIs(fan_out._history, history)
+        fan_out = executor.FanOutExecutor.from_args(
+                Namespace(no_timings=True), history=history)
+        self.assertIsNone(fan_out._history)
+
+    def test_target_deadline(self):
+        def execute(target):
+            return executor.TargetResult(target, 0, out=target.remaining())
+
+        targets = prepare_targets(['uno'], ['us-east-1'])
+        results = executor.FanOutExecutor(timeout=10).run(targets, execute)
+        self.assertTrue(0 < results[0].out <= 10)
+
+    def test_target_timed_out(self):
+        def execute(target):
+            raise errors.TimeoutException('Command timed out')
+
+        targets = prepare_targets(['uno'], ['us-east-1'])
+        results = executor.FanOutExecutor(timeout=1).run(targets, execute)
+        self.assertEqual(results[0].status, executor.TARGET_TIMED_OUT)
+        self.assertTrue(results[0].failed)
+
+    def test_budget_cancels_targets(self):
+        def execute(target):
+            target.cancelled.wait(5)
+            raise errors.CancelledException('Command has been cancelled')
+
+        targets = prepare_targets()
+        with LogCapture(level=logging.WARNING) as captured_log:
+            started = time.time()
+            results = executor.FanOutExecutor(workers=2, budget=0.2).run(
+                    targets, execute)
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual([r.status for r in results],
+                         [executor.TARGET_CANCELLED] * len(targets))
+        check_logs(captured_log, 'bac.executor', 'WARNING',
+                   ['budget', '0.2'])
+
+    @mock.patch('bac.executor.EXECUTOR_CANCEL_GRACE', 0.1)
+    def test_abandoned_target_result_dropped(self):
+        finished = threading.Event()
+        on_result = mock.Mock()
+
+        def execute(target):
+            # Ignores the cancellation and outlives the grace period
+            time.sleep(0.5)
+            finished.set()
+            return executor.TargetResult(target, 0)
+
+        targets = prepare_targets()[:1]
+        with LogCapture(level=logging.WARNING):
+            results = executor.FanOutExecutor(budget=0.1).run(
+                    targets, execute, on_result=on_result)
+        self.assertEqual(results[0].status, executor.TARGET_CANCELLED)
+        self.assertTrue(finished.wait(5))
+        time.sleep(0.1)
+        on_result.assert_not_called()
+
+    def test_cancel(self):
+        fan_out = executor.FanOutExecutor(workers=1)
+
+        def execute(target):
+            fan_out.cancel()
+            return executor.TargetResult(target, 1)
+
+        targets = prepare_targets()
+        results = fan_out.run(targets, execute)
+        self.assertTrue(all(t.cancelled.is_set() for t in targets))
+        self.assertEqual([r.status for r in results],
+                         [executor.TARGET_CANCELLED] * len(targets))
+        self.assertEqual(results[0].exit_code, 1)
+        self.assertIsNone(results[1].exit_code)
+
+    def test_keyboard_interrupt(self):
+        fan_out = executor.FanOutExecutor(workers=2)
+        targets = prepare_targets()
+
+        def execute(target):
+            # Killed by the cancellation
+            target.cancelled.wait(5)
+            return executor.TargetResult(target, -9)
+
+        def wait(threads, until=None):
+            if until is None:
+                raise KeyboardInterrupt()
+            return original(threads, until)
+
+        original = fan_out._wait
+        fan_out._wait = wait
+        with LogCapture(level=logging.INFO) as captured_log:
+            with self.assertRaises(KeyboardInterrupt):
+                fan_out.run(targets, execute)
+        self.assertTrue(all(t.cancelled.is_set() for t in targets))
+        results = fan_out._results
+        self.assertEqual(len(results), len(targets))
+        self.assertEqual([r.status for r in results],
+                         [executor.TARGET_CANCELLED] * len(targets))
+        summary = [message for _, level, message in captured_log.actual()
+                   if level == 'INFO']
+        self.assertEqual(summary, ['Fan-out summary: 0 completed (0 failed),'
+                                   ' 0 timed out, %s cancelled.'
+                                   % len(targets)])
+
+
+class TargetTest(unittest.TestCase):
+    def test_remaining(self):
+        target = executor.Target(['aws'], 'uno', 'us-east-1')
+        self.assertIsNone(target.remaining())
+        self.assertEqual(target.remaining(5), 5)
+        target.deadline = time.time() + 10
+        self.assertTrue(9 < target.remaining() <= 10)
+        self.assertEqual(target.remaining(5), 5)
+        target.deadline = time.time() - 1
+        self.assertEqual(target.remaining(5), 0)
+
+
+class FanOutProgressTest(unittest.TestCase):
+    def test_progress(self):
+        targets = prepare_targets(['uno'], REGIONS)
+        fan_out = executor.FanOutExecutor(workers=2)
+        seen = list()
+
+        def on_result(result):
+            seen.append(fan_out.progress)
+
+        fan_out.run(targets, lambda t: executor.TargetResult(t, 1),
+                    on_result=on_result)
+        self.assertEqual([p.finished for p in seen], [1, 2])
+        progress = fan_out.progress
+        self.assertEqual((progress.total, progress.finished, progress.failed,
+                          progress.running, progress.timed), (2, 2, 2, 0, 2))
+        self.assertEqual(progress.eta, 0)
+
+    def test_rate_and_eta(self):
+        progress = executor.FanOutProgress(
+                total=10, finished=2, workers=4, elapsed=4, latency=6,
+                timed=2)
+        self.assertEqual(progress.rate, 0.5)
+        self.assertEqual(progress.eta, 6)
+        self.assertIsNone(executor.FanOutProgress(total=1).eta)
+        self.assertIsNone(executor.FanOutProgress().rate)
+
+    def test_sum(self):
+        progress = (executor.FanOutProgress(total=2, finished=1, elapsed=3)
+                    + executor.FanOutProgress(total=3, failed=1, elapsed=5))
+        self.assertEqual((progress.total, progress.finished, progress.failed,
+                          progress.elapsed), (5, 1, 1, 5))
+
+
+class LogSummaryTest(unittest.TestCase):
+    def test_all_completed(self):
+        targets = prepare_targets(['uno'], REGIONS)
+        with LogCapture() as captured_log:
+            executor.log_summary([executor.TargetResult(targets[0], 0),
+                                  executor.TargetResult(targets[1], 1)])
+        captured_log.check(
+                ('bac.executor', 'INFO', 'Fan-out summary: 2 completed'
+                 ' (1 failed), 0 timed out, 0 cancelled.'))
+
+    def test_not_completed(self):
+        targets = prepare_targets(['uno'], REGIONS)
+        results = [executor.TargetResult(targets[0], 0),
+                   executor.TargetResult(targets[1], None,
+                                         status=executor.TARGET_TIMED_OUT)]
+        with LogCapture() as captured_log:
+            executor.log_summary(results + [None])
+        self.assertEqual(captured_log.actual()[0], (
+                'bac.executor', 'INFO', 'Fan-out summary: 1 completed'
+                ' (0 failed), 1 timed out, 0 cancelled.'))
+        check_logs(captured_log, 'bac.executor', 'WARNING',
+                   ['timed out', 'eu-west-1'])
+
+
+class HistoryOrderTest(unittest.TestCase):
+    def test_longest_first(self):
+        history = mock.Mock()
+        history.order.return_value = [2, 0, 1]
+        started = list()
+        targets = prepare_targets(['uno'], ['a', 'b', 'c'])
+
+        def execute(target):
+            started.append(target)
+            return executor.TargetResult(target, 0)
+
+        results = executor.FanOutExecutor(workers=1, history=history).run(
+                targets, execute)
+        history.order.assert_called_once_with(targets)
+        self.assertEqual(started, [targets[2], targets[0], targets[1]])
+        self.assertEqual([r.target for r in results], targets)
+        history.record.assert_called_once_with(results)
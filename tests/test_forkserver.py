@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import os
+import socket
+import unittest
+
+import mock
+
+from six import StringIO
+from testfixtures import TempDirectory
+
+from tests._utils import _import
+engines = _import('bac', 'engines')
+errors = _import('bac', 'errors')
+executor = _import('bac', 'executor')
+forkserver = _import('bac', 'forkserver')
+
+
+@unittest.skipUnless(forkserver.is_supported(),
+                     'Fork-server is not supported on this platform')
+class ForkServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = forkserver.ForkServer()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_execute(self):
+        out, err, exit_code = self.server.execute(['aws', '--version'])
+        self.assertEqual(exit_code, 0)
+        self.assertIn('aws-cli/', out + err)
+
+    def test_syntax_error(self):
+        self.server.preload('s3api')
+        out, err, exit_code = self.server.execute(
+                ['aws', 's3api', 'list-objects'])
+        self.assertNotEqual(exit_code, 0)
+        self.assertEqual(out, '')
+        self.assertIn('aws: error', err)
+        self.assertIn('--bucket', err)
+
+    def test_timeout(self):
+        with mock.patch('bac.forkserver.select.select',
+                        return_value=([], [], [])), \
+                mock.patch('bac.forkserver.time.time',
+                           side_effect=[0, 0, 10]), \
+                mock.patch.object(self.server, '_receive_pid',
+                                  return_value=42), \
+                mock.patch.object(self.server, '_kill') as kill:
+            with self.assertRaises(errors.TimeoutException):
+                self.server.execute(['aws', '--version'], timeout=5)
+        kill.assert_called_once_with(42)
+
+    def test_cancel_before_output(self):
+        cancelled = mock.Mock()
+        cancelled.is_set.return_value = True
+        with mock.patch.object(self.server, '_kill') as kill:
+            with self.assertRaises(errors.CancelledException):
+                self.server.execute(['aws', '--version'],
+                                    cancelled=cancelled)
+        # The pid of the worker is received before it is killed
+        self.assertTrue(kill.call_args[0][0])
+
+    def test_restarts_stopped_zygote(self):
+        server = forkserver.ForkServer()
+        self.addCleanup(server.stop)
+        with mock.patch('bac.forkserver.atexit.register') as register:
+            server.start()
+            server.stop()
+            out, err, exit_code = server.execute(['aws', '--version'])
+        self.assertEqual(exit_code, 0)
+        register.assert_called_once_with(server.stop)
+
+    def test_restart_reads_changed_config(self):
+        with TempDirectory() as d:
+            config = d.write('config', b'[default]\nregion = us-east-1\n')
+            env = dict(os.environ, AWS_CONFIG_FILE=config)
+            server = forkserver.ForkServer(env)
+            self.addCleanup(server.stop)
+            command = ['aws', 'configure', 'get', 'region',
+                       '--profile', 'nuevo']
+            self.assertNotEqual(server.execute(command)[2], 0)
+            with open(config, 'a') as config_file:
+                config_file.write('[profile nuevo]\nregion = eu-west-1\n')
+            server.restart()
+            out, err, exit_code = server.execute(command)
+        self.assertEqual((out.strip(), exit_code), ('eu-west-1', 0))
+
+
+class OpenStdinTest(unittest.TestCase):
+    def test_detached_stdin(self):
+        server = forkserver.ForkServer()
+        with mock.patch('sys.stdin', StringIO()):
+            fd = server._open_stdin()
+        self.addCleanup(os.close, fd)
+        self.assertEqual(os.read(fd, 1), b'')
+
+
+class ExecuteTest(unittest.TestCase):
+    def test_failed_connect_closes_descriptors(self):
+        server = forkserver.ForkServer()
+        opened = list()
+        pipe, open_stdin = os.pipe, server._open_stdin
+
+        def record(function):
+            def wrapper():
+                fds = function()
+                opened.extend(fds if isinstance(fds, tuple) else [fds])
+                return fds
+            return wrapper
+
+        with mock.patch.object(server, 'start'), \
+                mock.patch.object(server, '_open_stdin', record(open_stdin)), \
+                mock.patch.object(server, '_connect',
+                                  side_effect=socket.error('refused')), \
+                mock.patch('bac.forkserver.os.pipe', record(pipe)):
+            with self.assertRaises(socket.error):
+                server.execute(['aws', '--version'])
+        self.assertEqual(len(opened), 5)
+        for fd in opened:
+            with self.assertRaises(OSError):
+                os.fstat(fd)
+
+
+class ParseStatusTest(unittest.TestCase):
+    def test_parse_status(self):
+        server = forkserver.ForkServer()
+        chunks = [b'{"pid": 42}\n{"exit', b'_code": 2}\n']
+        self.assertEqual(server._parse_status(chunks),
+                         {'pid': 42, 'exit_code': 2})
+
+    def test_incomplete_status(self):
+        server = forkserver.ForkServer()
+        self.assertEqual(server._parse_status([b'{"pid": 42}\n{"exi']),
+                         {'pid': 42})
+
+
+class ForkServerEngineTest(unittest.TestCase):
+    def test_execute(self):
+        target = executor.Target(['aws', 'ec2', 'describe-regions'],
+                                 'uno', 'us-east-1')
+        with mock.patch('bac.forkserver.ForkServer') as server_cls:
+            server = server_cls.return_value
+            server.execute.return_value = ('out', 'err', 0)
+            result = engines.ForkServerEngine().execute(target, 30)
+        server.preload.assert_called_once_with('ec2')
+        server.execute.assert_called_once_with(target.command, 30,
+                                               target.cancelled)
+        self.assertEqual((result.out, result.err, result.exit_code),
+                         ('out', 'err', 0))
+
+    def test_unsupported_platform(self):
+        target = executor.Target(['aws', 'ec2', 'describe-regions'],
+                                 'uno', 'us-east-1')
+        with mock.patch('bac.forkserver.is_supported', return_value=False), \
+                mock.patch('bac.engines.execute_command',
+                           return_value=('out', '', 0)) as execute:
+            result = engines.ForkServerEngine().execute(target, 30)
+        execute.assert_called_once_with(target.command, 30,
+                                        cancelled=target.cancelled,
+                                        new_session=False)
+        self.assertEqual(result.exit_code, 0)
+
+    def test_reload(self):
+        with mock.patch('bac.forkserver.is_supported', return_value=True), \
+                mock.patch('bac.forkserver.ForkServer') as server:
+            engines.ForkServerEngine().reload()
+        server.return_value.restart.assert_called_once_with()
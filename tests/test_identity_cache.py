@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tests._utils import _import
+identity_cache = _import('bac', 'identity_cache')
+
+
+class HashFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'credentials')
+
+    def write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_hash_changes_with_content(self):
+        missing = identity_cache.hash_files([self.path])
+        self.write('[uno]\n')
+        first = identity_cache.hash_files([self.path])
+        self.assertEqual(first, identity_cache.hash_files([self.path]))
+        self.write('[uno]\n[dos]\n')
+        second = identity_cache.hash_files([self.path])
+        self.assertEqual(len({missing, first, second}), 3)
+
+
+class IdentityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = identity_cache.IdentityCache(
+                os.path.join(self.directory, 'bac', 'identities.db'))
+
+    def test_put_and_get(self):
+        self.assertEqual(self.cache.get('hash'), {})
+        before = time.time()
+        self.cache.put('hash', {'uno': ('111', 'production'),
+                                'dos': ('222', '222')})
+        cached = self.cache.get('hash')
+        self.assertEqual(sorted(cached), ['dos', 'uno'])
+        self.assertEqual(cached['uno'][:2], ('111', 'production'))
+        self.assertTrue(cached['uno'][2] >= before)
+
+    def test_other_files_hash(self):
+        self.cache.put('old', {'uno': ('111', 'production')})
+        self.assertEqual(self.cache.get('new'), {})
+        self.cache.put('new', {'uno': ('111', 'renamed')})
+        self.assertEqual(self.cache.get('old'), {})
+        self.assertEqual(self.cache.get('new')['uno'][1], 'renamed')
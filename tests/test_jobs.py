@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import threading
+import unittest
+
+import mock
+
+from six import StringIO
+
+from tests._utils import _import, captured_output
+constants = _import('bac', 'constants')
+errors = _import('bac', 'errors')
+executor = _import('bac', 'executor')
+jobs = _import('bac', 'jobs')
+
+
+class SplitBackgroundTest(unittest.TestCase):
+    def test_separate_ampersand(self):
+        self.assertEqual(jobs.split_background(['aws', 's3', 'ls', '&']),
+                         (['aws', 's3', 'ls'], True))
+
+    def test_suffix_ampersand(self):
+        self.assertEqual(jobs.split_background(['aws', 's3', 'ls&']),
+                         (['aws', 's3', 'ls'], True))
+
+    def test_foreground(self):
+        self.assertEqual(jobs.split_background(['aws', 's3', 'ls']),
+                         (['aws', 's3', 'ls'], False))
+        self.assertEqual(jobs.split_background([]), ([], False))
+
+
+class JobTest(unittest.TestCase):
+    def test_output_is_routed_to_job(self):
+        original = StringIO()
+        stream = jobs._JobStream(original, 'stdout')
+
+        def execute():
+            # Written by a worker thread of the job
+            worker = threading.Thread(target=stream.write, args=('out\n',))
+            worker.parent = threading.current_thread()
+            worker.start()
+            worker.join()
+
+        job = jobs.Job(1, 'aws s3 ls', execute)
+        job.start()
+        job.wait()
+        stream.write('prompt\n')
+        self.assertEqual(job.state, constants.JOB_DONE)
+        self.assertEqual(job.output.read(0), ([('stdout', 'out\n')], 1, True))
+        self.assertEqual(original.getvalue(), 'prompt\n')
+
+    def test_current_job(self):
+        found = list()
+        job = jobs.Job(1, 'aws s3 ls',
+                       lambda: found.append(jobs.current_job()))
+        job.start()
+        job.wait()
+        self.assertEqual(found, [job])
+        self.assertIsNone(jobs.current_job())
+
+    def test_failed(self):
+        def execute():
+            raise errors.BACError('foo')
+
+        job = jobs.Job(1, 'aws s3 ls', execute)
+        job.start()
+        job.wait()
+        self.assertEqual(job.state, constants.JOB_FAILED)
+
+    def test_cancel_attached_executors(self):
+        started = threading.Event()
+        release = threading.Event()
+        late = mock.Mock(progress=executor.FanOutProgress())
+
+        def execute():
+            executor_ = executor.FanOutExecutor(workers=1)
+            jobs.current_job().attach(executor_)
+            started.set()
+            executor_.run([executor.Target(['aws'], 'p', 'r')],
+                          lambda target: target.cancelled.wait(5)
+                          and executor.TargetResult(target, -9))
+            release.wait(5)
+            jobs.current_job().attach(late)
+
+        job = jobs.Job(1, 'aws s3 ls', execute)
+        job.start()
+        started.wait(5)
+        job.cancel()
+        release.set()
+        job.wait()
+        self.assertEqual(job.state, constants.JOB_KILLED)
+        progress = job.progress
+        self.assertEqual((progress.finished, progress.failed, progress.total),
+                         (1, 1, 1))
+        late.cancel.assert_called_once_with()
+
+    def test_str(self):
+        job = jobs.Job(2, 'aws s3 ls', None)
+        attached = mock.Mock(progress=executor.FanOutProgress(
+                total=10, finished=3, failed=1))
+        job.attach(attached)
+        self.assertEqual(str(job),
+                         '[2] running (3/10 targets, 1 failed)  aws s3 ls')
+
+
+@mock.patch.object(jobs.JobManager, '_install')
+class JobManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = jobs.JobManager()
+
+    def test_start_and_foreground(self, install):
+        def execute():
+            job = jobs.current_job()
+            job.output.write('stdout', 'foo\n')
+            job.output.write('stderr', 'bar\n')
+
+        with captured_output() as (out, err):
+            job = self.manager.start('aws s3 ls', execute)
+            job.wait()
+            self.manager.report_finished()
+            self.manager.report_finished()
+            self.assertTrue(self.manager.handle_command('fg', ['fg']))
+        self.assertEqual(out.getvalue(),
+                         '[1] aws s3 ls\n[1] done  aws s3 ls\n'
+                         'aws s3 ls\nfoo\n')
+        self.assertEqual(err.getvalue(), 'bar\n')
+        self.assertEqual(self.manager.jobs, [])
+
+    def test_kill(self, install):
+        release = threading.Event()
+        with captured_output():
+            job = self.manager.start('aws s3 ls', lambda: release.wait(5))
+            with mock.patch.object(job, 'cancel') as cancel:
+                self.manager.handle_command('kill', ['kill', '1'])
+            cancel.assert_called_once_with()
+            release.set()
+            job.wait()
+
+    def test_unknown_job(self, install):
+        with captured_output() as (out, err):
+            self.manager.handle_command('fg', ['fg', '3'])
+        self.assertEqual(out.getvalue(), 'No background jobs.\n')
+
+    def test_unknown_command(self, install):
+        self.assertFalse(self.manager.handle_command('aws', ['aws']))
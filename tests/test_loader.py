@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import threading
+import unittest
+
+from testfixtures import LogCapture
+
+from tests._utils import _import
+loader = _import('bac', 'loader')
+
+
+class BackgroundLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.loader = loader.BackgroundLoader()
+
+    def test_wait(self):
+        release = threading.Event()
+        loaded = list()
+
+        def load():
+            release.wait(5)
+            loaded.append('regions')
+
+        self.loader.start('regions', load)
+        self.loader.start('accounts', lambda: None)
+        self.loader.wait('accounts')
+        self.assertEqual(self.loader.loading, ['regions'])
+        release.set()
+        self.loader.wait('regions')
+        self.assertEqual(loaded, ['regions'])
+        self.assertEqual(self.loader.loading, [])
+
+    def test_reload_waits_for_previous_load(self):
+        release = threading.Event()
+        loaded = list()
+
+        def load():
+            release.wait(5)
+            loaded.append('first')
+
+        self.loader.start('accounts', load)
+        self.loader.start('accounts', lambda: loaded.append('second'))
+        release.set()
+        self.loader.wait('accounts')
+        self.assertEqual(loaded, ['first', 'second'])
+
+    def test_wait_unknown(self):
+        self.loader.wait('foo')
+
+    def test_failed_load(self):
+        def load():
+            raise ValueError('foo')
+
+        with LogCapture() as captured_log:
+            self.loader.start('regions', load)
+            self.loader.wait('regions')
+        errors = [record.getMessage() for record in captured_log.records
+                  if record.levelname == 'ERROR']
+        self.assertEqual(errors, ['Failed to load regions.'])
+        self.assertEqual(self.loader.loading, [])
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import unittest
+
+import boto3
+
+from tests._utils import _import
+models = _import('bac', 'models')
+
+
+class SessionTest(unittest.TestCase):
+    def test_shared_loader(self):
+        uno = models.Session(profile='uno')
+        dos = models.Session(profile='dos')
+        self.assertIs(uno.get_component('data_loader'), models.get_loader())
+        self.assertIs(dos.get_component('data_loader'), models.get_loader())
+
+    def test_shared_service_models(self):
+        uno = models.Session(profile='uno')
+        dos = models.Session(profile='dos')
+        model = uno.get_service_model('sts')
+        self.assertIs(dos.get_service_model('sts'), model)
+        self.assertIsNot(dos.get_service_model('iam'), model)
+
+    def test_boto3_search_paths_not_repeated(self):
+        for _ in range(3):
+            boto3.session.Session(botocore_session=models.Session())
+        search_paths = models.get_loader().search_paths
+        self.assertEqual(len(search_paths), len(set(search_paths)))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import sys
+import time
+import unittest
+
+from argparse import Namespace
+
+from six import StringIO
+
+from tests._utils import _import
+errors = _import('bac', 'errors')
+executor = _import('bac', 'executor')
+multiplexer = _import('bac', 'multiplexer')
+
+
+def prepare_targets(*commands):
+    return [executor.Target(command, 'p%s' % i, 'r%s' % i)
+            for i, command in enumerate(commands)]
+
+
+def python_command(code):
+    return [sys.executable, '-c', code]
+
+
+class OutputMultiplexerTest(unittest.TestCase):
+    def setUp(self):
+        self.out = StringIO()
+        self.err = StringIO()
+
+    def create(self, targets, order, buffer_size=1024):
+        return multiplexer.OutputMultiplexer(
+                targets, order, buffer_size, self.out, self.err)
+
+    def test_execute(self):
+        code = ('import sys\n'
+                'sys.stdout.write("foo\\nbar")\n'
+                'sys.stderr.write("baz\\n")\n'
+                'sys.exit(3)')
+        targets = prepare_targets(python_command(code))
+        mux = self.create(targets, 'as-completed')
+        self.assertEqual(mux.execute(targets[0]), 3)
+        self.assertEqual(self.out.getvalue(), '[p0/r0] foo\n[p0/r0] bar\n')
+        self.assertEqual(self.err.getvalue(), '[p0/r0] baz\n')
+
+    def test_long_line_is_split(self):
+        code = 'import sys; sys.stdout.write("x" * 100)'
+        targets = prepare_targets(python_command(code))
+        mux = self.create(targets, 'as-completed', buffer_size=10)
+        mux.execute(targets[0])
+        lines = self.out.getvalue().splitlines()
+        self.assertGreater(len(lines), 1)
+        self.assertEqual(''.join(line[len('[p0/r0] '):] for line in lines),
+                         'x' * 100)
+
+    def test_execute_deadline(self):
+        code = ('import sys, time\n'
+                'sys.stdout.write("foo\\n")\n'
+                'sys.stdout.flush()\n'
+                'time.sleep(5)')
+        targets = prepare_targets(python_command(code))
+        targets[0].deadline = time.time() + 1
+        mux = self.create(targets, 'as-completed')
+        with self.assertRaises(errors.TimeoutException):
+            mux.execute(targets[0])
+        self.assertEqual(self.out.getvalue(), '[p0/r0] foo\n')
+
+    def test_execute_cancelled(self):
+        targets = prepare_targets(python_command('import time; time.sleep(5)'))
+        targets[0].cancelled.set()
+        mux = self.create(targets, 'as-completed')
+        with self.assertRaises(errors.CancelledException):
+            mux.execute(targets[0])
+
+    def test_as_completed(self):
+        targets = prepare_targets(['a'], ['b'])
+        mux = self.create(targets, 'as-completed')
+        mux.feed(targets[1], 'second\n')
+        mux.feed(targets[0], 'first\n')
+        self.assertEqual(self.out.getvalue(),
+                         '[p1/r1] second\n[p0/r0] first\n')
+
+    def test_ordered(self):
+        targets = prepare_targets(['a'], ['b'], ['c'])
+        mux = self.create(targets, 'ordered', buffer_size=8)
+        mux.feed(targets[2], 'third\n' * 3, 'error\n')
+        mux.feed(targets[1], 'second\n')
+        mux.finish(targets[2])
+        self.assertEqual(self.out.getvalue(), '')
+        mux.feed(targets[0], 'first\n')
+        self.assertEqual(self.out.getvalue(), '[p0/r0] first\n')
+        mux.finish(targets[0])
+        mux.feed(targets[1], 'second again')
+        mux.finish(targets[1])
+        self.assertEqual(self.out.getvalue(),
+                         '[p0/r0] first\n[p1/r1] second\n'
+                         '[p1/r1] second again\n' + '[p2/r2] third\n' * 3)
+        self.assertEqual(self.err.getvalue(), '[p2/r2] error\n')
+
+    def test_close_flushes_unfinished(self):
+        targets = prepare_targets(['a'], ['b'])
+        mux = self.create(targets, 'ordered')
+        mux.feed(targets[1], 'second\n')
+        mux.close()
+        self.assertEqual(self.out.getvalue(), '[p1/r1] second\n')
+
+    def test_from_args(self):
+        targets = prepare_targets(['a'])
+        self.assertIsNone(multiplexer.OutputMultiplexer.from_args(
+                Namespace(), targets))
+        mux = multiplexer.OutputMultiplexer.from_args(
+                Namespace(prefix_order='ordered'), targets)
+        self.assertTrue(mux._ordered)
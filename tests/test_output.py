@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import unittest
+
+from argparse import Namespace
+
+from six import StringIO
+
+from tests._utils import _import
+executor = _import('bac', 'executor')
+output = _import('bac', 'output')
+
+ACCOUNT_NAMES = {'uno': 'account-uno'}
+
+
+def prepare_result(profile, region, exit_code=0, out='', err=''):
+    target = executor.Target(['aws'], profile, region)
+    return executor.TargetResult(target, exit_code, out, err)
+
+
+class AggregateOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = StringIO()
+
+    def write(self, output_format, results):
+        aggregate = output.AggregateOutput(
+                output_format, ACCOUNT_NAMES, self.stream)
+        aggregate.open()
+        for result in results:
+            aggregate.write(result)
+        aggregate.close()
+        return self.stream.getvalue()
+
+    def test_json(self):
+        results = [prepare_result('uno', 'us-east-1', out='{"Buckets": []}'),
+                   prepare_result('dos', 'eu-west-1', 255, err='Denied\n')]
+        records = json.loads(self.write('json', results))
+        self.assertEqual(records, [
+                {'profile': 'uno', 'account': 'account-uno',
+                 'region': 'us-east-1', 'exit_code': 0,
+                 'output': {'Buckets': []}},
+                {'profile': 'dos', 'account': None, 'region': 'eu-west-1',
+                 'exit_code': 255, 'output': None, 'error': 'Denied'}])
+
+    def test_json_no_results(self):
+        self.assertEqual(json.loads(self.write('json', [])), [])
+
+    def test_jsonl(self):
+        results = [prepare_result('uno', 'us-east-1', out='[1, 2]\n'),
+                   prepare_result('dos', 'eu-west-1', out='foo\tbar\n')]
+        lines = self.write('jsonl', results).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['output'], [1, 2])
+        self.assertEqual(json.loads(lines[1])['output'], 'foo\tbar\n')
+        self.assertEqual(list(json.loads(lines[1]).keys())[:3],
+                         ['profile', 'account', 'region'])
+
+    def test_records_written_immediately(self):
+        aggregate = output.AggregateOutput('jsonl', stream=self.stream)
+        aggregate.open()
+        aggregate.write(prepare_result('uno', 'us-east-1', out='{}'))
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 1)
+
+    def test_from_args(self):
+        self.assertIsNone(output.AggregateOutput.from_args(Namespace()))
+        args = Namespace(output_format='jsonl')
+        aggregate = output.AggregateOutput.from_args(args, ACCOUNT_NAMES)
+        self.assertEqual(aggregate._format, 'jsonl')
+        self.assertEqual(aggregate._account_names, ACCOUNT_NAMES)
@@ -3,13 +3,19 @@
 # Copyright © 2020, GoodData(R) Corporation. All rights reserved.
 import logging
 import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
-from botocore.exceptions import BotoCoreError, ClientError
+from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
 from six.moves import configparser
 from testfixtures import LogCapture, log_capture
 
 from tests._utils import _import, captured_output, check_logs
+loader = _import('bac', 'loader')
 profile_manager = _import('bac', 'profile_manager')
 errors = _import('bac', 'errors')
 
@@ -22,6 +28,14 @@ REG2 = 'eu-west-1'
 PM_ABS_IMPORT = 'bac.profile_manager.ProfileManager'
 
 
+def list_accounts(client, accounts):
+    search = client.get_paginator.return_value.paginate.return_value.search
+    if isinstance(accounts, Exception):
+        search.side_effect = accounts
+    else:
+        search.return_value = accounts
+
+
 class ProfileManagerInitTest(unittest.TestCase):
     @mock.patch('bac.profile_manager.AWS_CREDENTIALS', '')
     @log_capture(level=logging.ERROR)
@@ -58,22 +72,28 @@ class ProfileManagerInitTest(unittest.TestCase):
     @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
     @mock.patch('boto3.session.Session')
     def test_load_users(self, faked_session):
-        def fake_session(profile_name):
+        organizations = dict()
+
+        def fake_session(profile_name, botocore_session=None):
             fake_session = mock.Mock()
 
-            def fake_client(service, region_name=None):
+            def fake_client(service, region_name=None, config=None):
                 faked_client = mock.Mock()
                 if service == 'sts':
                     response = {'Account': '%s_id' % profile_name}
                     faked_client.get_caller_identity.return_value = response
                 elif service == 'organizations':
-                    response = {'Account': {'Name': '%s_name' % profile_name}}
+                    error = {'Error': {'Message': 'Some message'}}
                     if profile_name == 'dos':
-                        error = {'Error': {'Message': 'Some message'}}
                         faked_client.describe_account.side_effect = (
                                 ClientError(error, 'DescribeAccount'))
+                        list_accounts(faked_client,
+                                      ClientError(error, 'ListAccounts'))
                     else:
-                        faked_client.describe_account.return_value = response
+                        list_accounts(faked_client, [
+                                {'Id': '%s_id' % profile_name,
+                                 'Name': '%s_name' % profile_name}])
+                    organizations[profile_name] = faked_client
                 elif service == 'ec2':
                     response = {
                             'Regions': [
@@ -113,17 +133,395 @@ class ProfileManagerInitTest(unittest.TestCase):
             self.assertEqual(k, v.profile_name)
         self.assertEqual(expected_names, pm.account_names)
         self.assertEqual(expected_regions, pm.available_regions)
+        self.assertEqual(pm.account_ids, {'uno': 'uno_id', 'dos': 'dos_id',
+                                          'tres': '123456789012',
+                                          'cuatro': '098765432109'})
+        # Resolved by the listed accounts of the organization
+        organizations['uno'].describe_account.assert_not_called()
+        # Outside of the listed organization
+        organizations['dos'].describe_account.assert_called_once_with(
+                AccountId='dos_id')
 
     @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock())
     @mock.patch('boto3.session.Session')
-    def test_handle_all_profiles_invalid(self, faked_session):
-        faked_session.side_effect = BotoCoreError
+    def test_handle_account_discovery_error(self, faked_session):
+        def fake_session(profile_name, botocore_session=None):
+            session = mock.Mock()
+            sts = session.client.return_value
+            list_accounts(sts, [])
+            if profile_name == 'uno':
+                sts.get_caller_identity.side_effect = BotoCoreError()
+            else:
+                sts.get_caller_identity.return_value = {'Account': ACC2}
+                sts.describe_account.return_value = {'Account':
+                                                     {'Name': 'dos_name'}}
+            return session
+
+        faked_session.side_effect = fake_session
+        with LogCapture(level=logging.WARNING) as captured_log:
+            pm = profile_manager.ProfileManager()
+        check_logs(captured_log, 'bac.profile_manager', 'WARNING',
+                   ['Failed to load the account of uno profile'])
+        self.assertEqual(set(pm.sessions), {'uno', 'dos'})
+        self.assertEqual(pm.account_ids, {'dos': ACC2})
+        self.assertEqual(pm.account_names, {'dos': 'dos_name'})
+        pm.sessions['dos'].client.assert_any_call(
+                'sts', config=profile_manager.DISCOVERY_CONFIG)
+
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('boto3.session.Session')
+    def test_list_organization_accounts(self, faked_session):
+        clients = dict()
+
+        def fake_session(profile_name, botocore_session=None):
+            session = mock.Mock()
+            client = session.client.return_value
+            client.get_caller_identity.return_value = {
+                    'Account': ACC1 if profile_name == 'uno' else ACC2}
+            if profile_name == 'uno':
+                error = {'Error': {'Message': 'Access denied'}}
+                list_accounts(client, ClientError(error, 'ListAccounts'))
+            else:
+                list_accounts(client, [{'Id': ACC1, 'Name': 'production'},
+                                       {'Id': ACC2, 'Name': 'staging'}])
+            clients[profile_name] = client
+            return session
+
+        faked_session.side_effect = fake_session
+        pm = profile_manager.ProfileManager()
+        self.assertEqual(pm.account_names, {'uno': 'production',
+                                            'dos': 'staging'})
+        for client in clients.values():
+            client.describe_account.assert_not_called()
+
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('bac.profile_manager.PROFILE_DISCOVERY_ORGANIZATION_PROBES',
+                1)
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('boto3.session.Session')
+    def test_list_organization_accounts_until_allowed(self, faked_session):
+        clients = dict()
+
+        def fake_session(profile_name, botocore_session=None):
+            session = mock.Mock()
+            client = session.client.return_value
+            client.get_caller_identity.return_value = {
+                    'Account': ACC1 if profile_name == 'uno' else ACC2}
+            list_accounts(client, [{'Id': ACC1, 'Name': 'production'}])
+            client.describe_account.return_value = {
+                    'Account': {'Name': 'staging'}}
+            clients[profile_name] = client
+            return session
+
+        faked_session.side_effect = fake_session
+        pm = profile_manager.ProfileManager()
+        self.assertEqual(pm.account_names, {'uno': 'production',
+                                            'dos': 'staging'})
+        clients['uno'].get_paginator.assert_called_once_with('list_accounts')
+        clients['dos'].get_paginator.assert_not_called()
+        clients['dos'].describe_account.assert_called_once_with(
+                AccountId=ACC2)
+
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('boto3.session.Session')
+    def test_list_organization_accounts_once_per_account(self,
+                                                         faked_session):
+        clients = dict()
+
+        def fake_session(profile_name, botocore_session=None):
+            session = mock.Mock()
+            client = session.client.return_value
+            client.get_caller_identity.return_value = {'Account': ACC1}
+            list_accounts(client, [{'Id': ACC1, 'Name': 'production'}])
+            clients[profile_name] = client
+            return session
+
+        faked_session.side_effect = fake_session
+        pm = profile_manager.ProfileManager()
+        self.assertEqual(pm.account_names, {'uno': 'production',
+                                            'dos': 'production'})
+        self.assertEqual(sum(client.get_paginator.call_count
+                             for client in clients.values()), 1)
+
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('boto3.session.Session')
+    def test_cached_accounts(self, faked_session):
+        cache = mock.Mock()
+        cache.get.return_value = {'uno': (ACC1, 'uno_name', time.time())}
+        sessions = dict()
+
+        def fake_session(profile_name, botocore_session=None):
+            session = mock.Mock()
+            session.client.return_value.get_caller_identity.return_value = {
+                    'Account': ACC2}
+            list_accounts(session.client.return_value, [])
+            sessions[profile_name] = session
+            return session
+
+        faked_session.side_effect = fake_session
+        pm = profile_manager.ProfileManager(cache)
+        self.assertEqual(pm.account_ids, {'uno': ACC1, 'dos': ACC2})
+        # Not even created
+        self.assertNotIn('uno', sessions)
+        cache.put.assert_called_once_with(
+                cache.get.call_args[0][0], {'dos': (ACC2, mock.ANY)})
+
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('boto3.session.Session')
+    def test_revalidate_stale_accounts(self, faked_session):
+        cache = mock.Mock()
+        stale = time.time() - profile_manager.IDENTITY_CACHE_TTL - 1
+        cache.get.return_value = {'uno': (ACC1, 'old_name', stale),
+                                  'dos': (ACC2, 'dos_name', time.time())}
+        session = faked_session.return_value
+        session.client.return_value.get_caller_identity.return_value = {
+                'Account': ACC1}
+        session.client.return_value.describe_account.return_value = {
+                'Account': {'Name': 'new_name'}}
+        list_accounts(session.client.return_value, [])
+        pm = profile_manager.ProfileManager(cache)
+        # Revalidated by a background thread
+        deadline = time.time() + 5
+        while not cache.put.called and time.time() < deadline:
+            time.sleep(0.01)
+        cache.put.assert_called_once_with(
+                cache.get.call_args[0][0], {'uno': (ACC1, 'new_name')})
+        self.assertEqual(pm.account_names, {'uno': 'new_name',
+                                            'dos': 'dos_name'})
+
+    @mock.patch('bac.profile_manager.AWS_CONFIG', 'tests/config')
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('boto3.session.Session')
+    def test_load_in_background(self, faked_session):
+        release = threading.Event()
+        session = faked_session.return_value
+        client = session.client.return_value
+        client.get_caller_identity.side_effect = (
+                lambda: release.wait(5) and {'Account': ACC1})
+        list_accounts(client, [{'Id': ACC1, 'Name': 'uno'}])
+        client.describe_regions.return_value = {
+                'Regions': [{'RegionName': REG1}]}
+        background = loader.BackgroundLoader()
+        pm = profile_manager.ProfileManager(loader=background)
+        self.assertEqual(set(pm.sessions), {'uno', 'dos', 'tres', 'cuatro'})
+        self.assertIn('accounts', background.loading)
+        release.set()
+        self.assertEqual(pm.account_ids, {'uno': ACC1, 'dos': ACC1,
+                                          'tres': '123456789012',
+                                          'cuatro': '098765432109'})
+        self.assertEqual(pm.account_names['tres'], 'three')
+        self.assertEqual(pm.available_regions, {REG1})
+
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('six.moves.configparser.RawConfigParser.sections',
+                mock.Mock(return_value=['default']))
+    def test_handle_no_profiles(self):
         with LogCapture() as captured_log:
             with self.assertRaises(errors.NoProfilesError):
                 profile_manager.ProfileManager()
         check_logs(captured_log, 'bac.profile_manager', 'ERROR',
                    ['No valid profiles found', 'Exiting BAC.'])
 
+    @mock.patch('bac.profile_manager.AWS_CREDENTIALS', 'tests/credentials')
+    @mock.patch('%s._load_roles' % PM_ABS_IMPORT, mock.Mock())
+    @mock.patch('boto3.session.Session')
+    def test_handle_invalid_profiles(self, faked_session):
+        faked_session.side_effect = BotoCoreError
+        with LogCapture(level=logging.WARNING) as captured_log:
+            pm = profile_manager.ProfileManager()
+        warnings = sorted(record.getMessage().split('.')[0]
+                          for record in captured_log.records)
+        self.assertEqual(warnings,
+                         ['Failed to load dos profile',
+                          'Failed to load the account of dos profile',
+                          'Failed to load the account of uno profile',
+                          'Failed to load uno profile'])
+        self.assertEqual(set(pm.sessions), {'uno', 'dos'})
+        self.assertEqual(pm.account_ids, {})
+        self.assertIsNone(pm.available_regions)
+
+
+class LazySessionsTest(unittest.TestCase):
+    @mock.patch('boto3.session.Session')
+    def test_create_on_first_use(self, faked_session):
+        sessions = profile_manager.LazySessions(['uno', 'dos'])
+        self.assertEqual(list(sessions), ['uno', 'dos'])
+        self.assertIn('dos', sessions)
+        self.assertEqual(sessions.live, 0)
+        session = sessions['dos']
+        self.assertIs(sessions['dos'], session)
+        faked_session.assert_called_once_with(
+                botocore_session=mock.ANY, profile_name='dos')
+        with self.assertRaises(KeyError):
+            sessions['tres']
+        sessions.add('tres')
+        self.assertEqual(len(sessions), 3)
+        sessions.remove('dos')
+        self.assertEqual(list(sessions), ['uno', 'tres'])
+        self.assertEqual(sessions.live, 0)
+
+    @mock.patch('boto3.session.Session')
+    def test_invalid_profile(self, faked_session):
+        faked_session.side_effect = ProfileNotFound(profile='uno')
+        sessions = profile_manager.LazySessions(['uno'])
+        with LogCapture(level=logging.WARNING) as captured_log:
+            for _ in range(2):
+                with self.assertRaises(ProfileNotFound):
+                    sessions['uno']
+        check_logs(captured_log, 'bac.profile_manager', 'WARNING',
+                   ['Failed to load uno profile'])
+        self.assertEqual(len(captured_log.records), 1)
+        self.assertEqual(sessions.live, 0)
+
+    @mock.patch('boto3.session.Session')
+    def test_inject_role_credentials(self, faked_session):
+        role_credentials = mock.Mock()
+        sessions = profile_manager.LazySessions(
+                ['uno'], role_credentials=role_credentials)
+        session = sessions['uno']
+        role_credentials.inject.assert_called_once_with(session._session)
+
+    @mock.patch('boto3.session.Session')
+    def test_least_recently_used(self, faked_session):
+        faked_session.side_effect = lambda profile_name, **kwargs: mock.Mock(
+                profile_name=profile_name)
+        sessions = profile_manager.LazySessions(['uno', 'dos', 'tres'],
+                                                max_sessions=2)
+        uno = sessions['uno']
+        sessions['dos']
+        self.assertIs(sessions['uno'], uno)
+        sessions['tres']
+        self.assertEqual(sessions.live, 2)
+        # "dos" has been dropped as the least recently used one
+        self.assertIs(sessions['uno'], uno)
+        self.assertEqual(faked_session.call_count, 3)
+        sessions['dos']
+        self.assertEqual(faked_session.call_count, 4)
+
+
+class ProfileManagerReloadTest(unittest.TestCase):
+    CREDENTIALS = ('[uno]\naws_access_key_id = foo\n'
+                   '[dos]\naws_access_key_id = bar\n')
+    CONFIG = ('[profile tres]\n'
+              'role_arn = arn:aws:iam::%s:role/some_role\n' % ACC1)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.credentials = os.path.join(directory, 'credentials')
+        self.config = os.path.join(directory, 'config')
+        self.write(self.credentials, self.CREDENTIALS)
+        self.write(self.config, self.CONFIG)
+        self.created = list()
+        patchers = [
+            mock.patch('bac.profile_manager.AWS_CREDENTIALS',
+                       self.credentials),
+            mock.patch('bac.profile_manager.AWS_CONFIG', self.config),
+            mock.patch('%s._load_regions' % PM_ABS_IMPORT, mock.Mock()),
+            mock.patch('boto3.session.Session',
+                       side_effect=self.fake_session),
+            ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pm = profile_manager.ProfileManager()
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+        # Modification times may not change within the same second
+        os.utime(path, (time.time() + 10, time.time() + 10))
+
+    def fake_session(self, profile_name, botocore_session=None):
+        self.created.append(profile_name)
+        session = mock.Mock()
+        sts = session.client.return_value
+        list_accounts(sts, [])
+        sts.get_caller_identity.return_value = {
+                'Account': '%s_id' % profile_name}
+        sts.describe_account.return_value = {
+                'Account': {'Name': '%s_name' % profile_name}}
+        return session
+
+    def test_unchanged_files(self):
+        self.assertFalse(self.pm.reload())
+        self.write(self.credentials, self.CREDENTIALS)
+        self.assertFalse(self.pm.reload())
+
+    def test_reload_changed_profiles(self):
+        self.pm.active_profiles = {'uno', 'dos'}
+        uno = self.pm.sessions['uno']
+        del self.created[:]
+        self.write(self.credentials,
+                   '[uno]\naws_access_key_id = foo\n'
+                   '[cinco]\naws_access_key_id = baz\n')
+        self.write(self.config,
+                   '[profile tres]\n'
+                   'role_arn = arn:aws:iam::%s:role/other_role\n' % ACC2)
+        self.assertTrue(self.pm.reload())
+        self.assertEqual(set(self.pm.sessions), {'uno', 'cinco', 'tres'})
+        self.assertEqual(self.created, ['cinco'])
+        self.assertIs(self.pm.sessions['uno'], uno)
+        self.assertEqual(self.pm.account_ids, {'uno': 'uno_id',
+                                               'cinco': 'cinco_id',
+                                               'tres': ACC2})
+        self.assertEqual(self.pm.account_names['tres'], 'other_role')
+        self.assertEqual(self.pm.active_profiles, {'uno'})
+        self.assertFalse(self.pm.reload())
+
+    def test_reload_during_discovery(self):
+        discovering = threading.Event()
+        release = threading.Event()
+        loader = mock.Mock()
+        started = list()
+        loader.start.side_effect = lambda name, load: started.append(load)
+        self.pm._loader = loader
+        get_account_id = self.pm._get_account_id
+
+        def slow_get_account_id(profile):
+            discovering.set()
+            release.wait(5)
+            return get_account_id(profile)
+
+        self.pm._get_account_id = slow_get_account_id
+        self.pm.account_ids.clear()
+        thread = threading.Thread(target=self.pm._discover_accounts,
+                                  args=(['uno', 'dos'],))
+        thread.start()
+        self.assertTrue(discovering.wait(5))
+        self.write(self.credentials, '[uno]\naws_access_key_id = baz\n'
+                                     '[dos]\naws_access_key_id = bar\n')
+        # Does not wait for the running discovery
+        self.assertTrue(self.pm.reload())
+        release.set()
+        thread.join(5)
+        # Account of the changed profile is discovered again
+        self.assertNotIn('uno', self.pm.account_ids)
+        self.assertEqual(self.pm.account_ids['dos'], 'dos_id')
+        self.assertEqual(len(started), 1)
+        self.pm._get_account_id = get_account_id
+        started[0]()
+        self.assertEqual(self.pm.account_ids['uno'], 'uno_id')
+
+    def test_invalid_files_are_not_reloaded(self):
+        self.write(self.credentials, 'uno]\n')
+        with LogCapture(level=logging.WARNING) as captured_log:
+            self.assertFalse(self.pm.reload())
+        check_logs(captured_log, 'bac.profile_manager', 'WARNING',
+                   ['Failed to reload the profiles'])
+        self.assertEqual(set(self.pm.sessions), {'uno', 'dos', 'tres'})
+
 
 class ProfileManagerTest(unittest.TestCase):
     def setUp(self):
@@ -153,6 +551,37 @@ class ProfileManagerTest(unittest.TestCase):
         result = self.pm.handle_command('foo', None)
         assert not result
 
+    def test_assume_roles(self):
+        credentials = mock.Mock()
+        credentials.is_assumed.side_effect = lambda profile: profile == 'tres'
+        self.pm._role_credentials = credentials
+        self.pm._role_profiles = {PROFILE2, 'tres'}
+        self.pm.sessions['tres'] = mock.Mock()
+        self.pm.assume_roles([PROFILE1, PROFILE2, PROFILE2, 'tres'])
+        credentials.assume.assert_called_once_with(
+                PROFILE2, self.pm.sessions[PROFILE2])
+
+    def test_assume_roles_invalid_profile(self):
+        credentials = mock.Mock()
+        credentials.is_assumed.return_value = False
+        self.pm._role_credentials = credentials
+        self.pm._role_profiles = {PROFILE2}
+        self.pm.sessions = mock.MagicMock()
+        self.pm.sessions.__getitem__.side_effect = ProfileNotFound(
+                profile=PROFILE2)
+        self.pm.assume_roles([PROFILE2])
+        credentials.assume.assert_not_called()
+
+    def test_mfa_roles_not_assumed(self):
+        self.pm._role_profiles = set()
+        self.pm._add_role('tres', {
+            'role_arn': 'arn:aws:iam::%s:role/some_role' % ACC1,
+            'mfa_serial': 'arn:aws:iam::%s:mfa/user' % ACC1})
+        self.pm._add_role('cuatro', {
+            'role_arn': 'arn:aws:iam::%s:role/other_role' % ACC1})
+        self.assertEqual(self.pm._role_profiles, {'cuatro'})
+        self.assertEqual(self.pm.account_names['tres'], 'some_role')
+
     def test_list_available_profiles(self):
         cmd = 'list-available-profiles'
         output = self.check_command(cmd, None)
@@ -181,6 +610,17 @@ class ProfileManagerTest(unittest.TestCase):
         expected = 'No available accounts found'
         self.check_items_in_result(expected, output)
 
+    def test_deduplicate_profiles(self):
+        self.pm.account_ids = {'uno': ACC1, 'uno-readonly': ACC1,
+                               'dos': ACC2, 'dos-admin': ACC2}
+        profiles = {'uno', 'uno-readonly', 'dos', 'dos-admin', 'tres'}
+        self.assertEqual(self.pm.deduplicate_profiles(profiles),
+                         {'dos', 'uno', 'tres'})
+        self.assertEqual(
+                self.pm.deduplicate_profiles(profiles, ['*-readonly',
+                                                        '*-admin']),
+                {'dos-admin', 'uno-readonly', 'tres'})
+
     def test_include_profiles(self):
         cmd1 = 'list-active-profiles'
         cmd2 = 'include-profiles'
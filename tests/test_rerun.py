@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import unittest
+
+import mock
+
+from tests._utils import _import, captured_output
+executor = _import('bac', 'executor')
+rerun = _import('bac', 'rerun')
+
+
+def prepare_results(*exit_codes):
+    return [executor.TargetResult(
+                executor.Target(['aws', 'foo', 'p%s' % i], 'p%s' % i, 'r'),
+                exit_code)
+            for i, exit_code in enumerate(exit_codes)]
+
+
+class LastFanOutTest(unittest.TestCase):
+    def setUp(self):
+        self.last = rerun.LastFanOut()
+        self.dispatch = mock.Mock()
+
+    def test_failed(self):
+        results = prepare_results(0, 1, None, 0)
+        self.last.record('aws foo', results + [None], self.dispatch)
+        self.assertEqual(self.last.failed,
+                         [results[1].target, results[2].target])
+
+    def test_rerun_failed(self):
+        results = prepare_results(0, 255, 0)
+        self.dispatch.side_effect = lambda targets: [
+                executor.TargetResult(t, 0) for t in targets]
+        self.last.record('aws foo', results, self.dispatch)
+        self.assertTrue(self.last.handle_command('rerun-failed',
+                                                 ['rerun-failed']))
+        targets = self.dispatch.call_args[0][0]
+        self.assertEqual([(t.command, t.profile, t.region) for t in targets],
+                         [(['aws', 'foo', 'p1'], 'p1', 'r')])
+        self.assertIsNot(targets[0], results[1].target)
+        self.assertEqual(self.last.failed, [])
+
+    def test_rerun_keeps_still_failing(self):
+        results = prepare_results(1, 1)
+        self.dispatch.side_effect = lambda targets: [
+                executor.TargetResult(t, i) for i, t in enumerate(targets)]
+        self.last.record('aws foo', results, self.dispatch)
+        self.last.rerun_failed(['rerun-failed'])
+        self.assertEqual([t.profile for t in self.last.failed], ['p1'])
+        self.last.rerun_failed(['rerun-failed'])
+        self.assertEqual(self.dispatch.call_count, 2)
+        self.assertEqual([t.profile for t in self.dispatch.call_args[0][0]],
+                         ['p1'])
+
+    def test_list(self):
+        self.last.record('aws foo', prepare_results(0, 1), self.dispatch)
+        with captured_output() as (out, err):
+            self.last.rerun_failed(['rerun-failed', '--list'])
+        self.dispatch.assert_not_called()
+        self.assertEqual(out.getvalue(), 'p1/r\taws foo p1\n')
+
+    def test_nothing_failed(self):
+        self.last.record('aws foo', prepare_results(0), self.dispatch)
+        with captured_output() as (out, err):
+            self.last.rerun_failed(['rerun-failed'])
+        self.dispatch.assert_not_called()
+        self.assertIn('No targets', out.getvalue())
+
+    def test_nothing_executed(self):
+        with captured_output() as (out, err):
+            self.last.rerun_failed(['rerun-failed'])
+        self.assertIn('No command', out.getvalue())
+
+    def test_unknown_command(self):
+        self.assertFalse(self.last.handle_command('foo', ['foo']))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import botocore.session
+import mock
+
+from argparse import Namespace
+
+from tests._utils import _import
+checker = _import('bac', 'checker')
+errors = _import('bac', 'errors')
+executor = _import('bac', 'executor')
+result_cache = _import('bac', 'result_cache')
+
+
+def prepare_target(command, profile='uno', region='us-east-1'):
+    command = (command.split() + ['--profile', profile, '--region', region])
+    return executor.Target(command, profile, region)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = result_cache.ResultCache(
+                os.path.join(self.directory, 'bac', 'cache.db'))
+
+    def test_get_cached_result(self):
+        target = prepare_target('aws ec2 describe-instances')
+        self.cache.put('ec2', executor.TargetResult(target, 0, 'out', 'err'))
+        same = prepare_target('aws ec2 describe-instances')
+        result = self.cache.get(same, 60)
+        self.assertIs(result.target, same)
+        self.assertEqual((result.exit_code, result.out, result.err),
+                         (0, 'out', 'err'))
+
+    def test_key(self):
+        target = prepare_target('aws ec2 describe-instances')
+        self.cache.put('ec2', executor.TargetResult(target, 0, 'out'))
+        for other in (prepare_target('aws ec2 describe-vpcs'),
+                      prepare_target('aws ec2 describe-instances', 'dos'),
+                      prepare_target('aws ec2 describe-instances',
+                                     region='eu-west-1')):
+            self.assertIsNone(self.cache.get(other, 60))
+
+    def test_expired(self):
+        target = prepare_target('aws ec2 describe-instances')
+        with mock.patch('time.time', return_value=time.time() - 120):
+            self.cache.put('ec2', executor.TargetResult(target, 0, 'out'))
+        self.assertIsNone(self.cache.get(target, 60))
+        self.assertIsNotNone(self.cache.get(target, 180))
+
+    def test_failed_not_cached(self):
+        target = prepare_target('aws ec2 describe-instances')
+        self.cache.put('ec2', executor.TargetResult(target, 255, '', 'err'))
+        self.cache.put('ec2', executor.TargetResult(target, 0))
+        self.assertIsNone(self.cache.get(target, 60))
+
+    def test_invalidate(self):
+        instances = prepare_target('aws ec2 describe-instances')
+        buckets = prepare_target('aws s3api list-buckets')
+        self.cache.put('ec2', executor.TargetResult(instances, 0, 'out'))
+        self.cache.put('s3', executor.TargetResult(buckets, 0, 'out'))
+        self.cache.invalidate('ec2')
+        self.assertIsNone(self.cache.get(instances, 60))
+        self.assertIsNotNone(self.cache.get(buckets, 60))
+
+    def test_cached_command(self):
+        target = prepare_target('aws ec2 describe-instances')
+        cached = result_cache.CachedCommand(self.cache, 'ec2', 60)
+        cached.put(executor.TargetResult(target, 0, 'out'))
+        self.assertEqual(cached.get(target).out, 'out')
+
+    def test_get_cache_ttl(self):
+        self.assertEqual(result_cache.get_cache_ttl(
+                Namespace(cache_ttl=60, no_cache=False)), 60)
+        self.assertIsNone(result_cache.get_cache_ttl(
+                Namespace(cache_ttl=0, no_cache=False)))
+        self.assertIsNone(result_cache.get_cache_ttl(
+                Namespace(cache_ttl=-1, no_cache=False)))
+        self.assertIsNone(result_cache.get_cache_ttl(
+                Namespace(cache_ttl=60, no_cache=True)))
+        self.assertIsNone(result_cache.get_cache_ttl(Namespace()))
+
+
+class ClassifyCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.checker = mock.Mock()
+
+    def classify(self, command):
+        return result_cache.classify_command(self.checker, command.split())
+
+    def test_operations(self):
+        for name, read_only in (('DescribeInstances', True),
+                                ('ListUsers', True),
+                                ('GetBucketPolicy', True),
+                                ('TerminateInstances', False),
+                                ('CreateUser', False)):
+            self.checker.resolve.return_value = checker.OperationCall(
+                    'ec2', name, dict(), None)
+            self.assertEqual(self.classify('aws ec2 foo'),
+                             ('ec2', read_only, read_only))
+
+    def test_s3_commands(self):
+        self.checker.resolve.return_value = None
+        self.assertEqual(self.classify('aws s3 ls s3://foo'),
+                         ('s3', True, True))
+        self.assertEqual(self.classify('aws s3 rm s3://foo/bar'),
+                         ('s3', False, False))
+
+    def test_uncacheable_operations(self):
+        session = botocore.session.get_session()
+        for service, name in (('s3', 'GetObject'),
+                              ('secretsmanager', 'GetSecretValue'),
+                              ('ssm', 'GetParameter'),
+                              ('sts', 'GetSessionToken'),
+                              ('ecr', 'GetAuthorizationToken')):
+            model = session.get_service_model(service).operation_model(name)
+            self.checker.resolve.return_value = checker.OperationCall(
+                    service, name, dict(), None, model)
+            self.assertEqual(self.classify('aws %s foo' % service),
+                             (service, True, False))
+        model = session.get_service_model('ec2').operation_model(
+                'DescribeInstances')
+        self.checker.resolve.return_value = checker.OperationCall(
+                'ec2', 'DescribeInstances', dict(), None, model)
+        self.assertEqual(self.classify('aws ec2 foo'), ('ec2', True, True))
+
+    def test_unresolved(self):
+        self.checker.resolve.side_effect = errors.CLICheckerSyntaxError()
+        self.assertEqual(self.classify('aws ec2 run-instances --count 1'),
+                         ('ec2', False, False))
+        self.assertEqual(self.classify('aws s3api put-object'),
+                         ('s3', False, False))
+        self.assertIsNone(self.classify('aws'))
+
+    def test_normalize_command(self):
+        command = ('aws --profile uno ec2 describe-instances --region'
+                   ' eu-west-1 --output json').split()
+        self.assertEqual(result_cache.normalize_command(command),
+                         ['aws', 'ec2', 'describe-instances', '--output',
+                          'json'])
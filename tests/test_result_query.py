@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import unittest
+
+import mock
+
+from argparse import Namespace
+
+from six import StringIO
+
+from tests._utils import _import
+errors = _import('bac', 'errors')
+executor = _import('bac', 'executor')
+result_query = _import('bac', 'result_query')
+
+ACCOUNT_NAMES = {'uno': 'account-uno', 'dos': 'account-dos'}
+
+
+def prepare_results():
+    results = list()
+    for profile in ('uno', 'dos'):
+        for number, region in enumerate(('us-east-1', 'eu-west-1')):
+            target = executor.Target(['aws'], profile, region)
+            out = json.dumps({'Reservations': [{'Instances': [
+                    {'InstanceId': '%s-%s-%s' % (profile, region, i)}
+                    for i in range(number + 1)]}]})
+            results.append(executor.TargetResult(target, 0, out, ''))
+    target = executor.Target(['aws'], 'tres', 'us-east-1')
+    results.append(executor.TargetResult(target, 255, '', 'Denied'))
+    return results
+
+
+class ResultQueryTest(unittest.TestCase):
+    def query(self, expression, processes=None):
+        return result_query.ResultQuery(expression, ACCOUNT_NAMES, processes)
+
+    def test_search_across_targets(self):
+        query = self.query("[?account=='account-dos'].output"
+                           '.Reservations[].Instances[].InstanceId')
+        self.assertEqual(query.search(prepare_results()),
+                         ['dos-us-east-1-0', 'dos-eu-west-1-0',
+                          'dos-eu-west-1-1'])
+
+    def test_aggregation(self):
+        query = self.query('length([?exit_code!=`0`])')
+        self.assertEqual(query.search(prepare_results()), 1)
+
+    def test_invalid_expression(self):
+        with self.assertRaises(errors.BACError):
+            self.query('[?foo==')
+
+    def test_shardable(self):
+        shardable = ['[].output', '[*].output.Reservations[].Instances[]',
+                     "[?region=='us-east-1'].output", '@[*].output[]']
+        for expression in shardable:
+            self.assertTrue(self.query(expression).shardable, expression)
+        not_shardable = ['length(@)', '[].output | [0]', '[0].output',
+                         'sort_by(@, &region)[].output', 'foo[].bar']
+        for expression in not_shardable:
+            self.assertFalse(self.query(expression).shardable, expression)
+
+    @mock.patch('bac.result_query.QUERY_POOL_THRESHOLD', 0)
+    def test_search_in_pool(self):
+        expression = '[].output.Reservations[].Instances[].InstanceId'
+        query = self.query(expression, processes=2)
+        with mock.patch.object(query, '_search_in_pool',
+                               wraps=query._search_in_pool) as in_pool:
+            found = query.search(prepare_results())
+        in_pool.assert_called_once()
+        self.assertEqual(found, self.query(expression, 1).search(
+                prepare_results()))
+        self.assertEqual(len(found), 6)
+
+    @mock.patch('bac.result_query.QUERY_POOL_THRESHOLD', 0)
+    def test_pool_reused(self):
+        expression = '[].output.Reservations[].Instances[].InstanceId'
+        query = self.query(expression, processes=2)
+        query.search(prepare_results())
+        pool = result_query._pools[2]
+        self.assertEqual(len(query.search(prepare_results())), 6)
+        self.assertIs(result_query._get_pool(2), pool)
+
+    def test_write(self):
+        stream = StringIO()
+        self.query('[].region').write(prepare_results(), stream)
+        self.assertEqual(json.loads(stream.getvalue()),
+                         ['us-east-1', 'eu-west-1', 'us-east-1',
+                          'eu-west-1', 'us-east-1'])
+
+    def test_from_args(self):
+        self.assertIsNone(result_query.ResultQuery.from_args(Namespace()))
+        query = result_query.ResultQuery.from_args(
+                Namespace(bac_query='[].output'))
+        self.assertTrue(query.shardable)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from botocore.credentials import RefreshableCredentials
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc
+from testfixtures import LogCapture
+
+from tests._utils import _import
+role_credentials = _import('bac', 'role_credentials')
+
+
+def expiring_in(seconds):
+    return datetime.datetime.now(tzutc()) + datetime.timedelta(
+            seconds=seconds)
+
+
+def role_response(seconds):
+    return {'Credentials': {
+        'AccessKeyId': 'foo',
+        'SecretAccessKey': 'bar',
+        'SessionToken': 'baz',
+        'Expiration': expiring_in(seconds).isoformat(),
+        }}
+
+
+class FreshJSONFileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = role_credentials._FreshJSONFileCache(self.directory,
+                                                          20 * 60)
+
+    def test_fresh_credentials(self):
+        self.cache['uno'] = role_response(60 * 60)
+        self.assertEqual(
+                self.cache['uno']['Credentials']['AccessKeyId'], 'foo')
+
+    def test_credentials_close_to_expiration(self):
+        self.cache['uno'] = role_response(14 * 60)
+        # Assumed for an hour, 46 minutes ago
+        written = time.time() - 46 * 60
+        os.utime(self.cache._convert_cache_key('uno'), (written, written))
+        with self.assertRaises(KeyError):
+            self.cache['uno']
+        with self.assertRaises(KeyError):
+            self.cache['dos']
+
+    def test_short_session_credentials(self):
+        # Assumed for 15 minutes, which are all within 20 minutes
+        self.cache['uno'] = role_response(15 * 60)
+        self.assertEqual(
+                self.cache['uno']['Credentials']['AccessKeyId'], 'foo')
+        self.cache['uno'] = role_response(3 * 60)
+        written = time.time() - 12 * 60
+        os.utime(self.cache._convert_cache_key('uno'), (written, written))
+        with self.assertRaises(KeyError):
+            self.cache['uno']
+
+
+class RoleCredentialCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = role_credentials.RoleCredentialCache(
+                self.directory, refresh_interval=0.01)
+        self.addCleanup(self.cache.close)
+
+    def credentials(self, seconds):
+        refresh = mock.Mock(side_effect=lambda: {
+            'access_key': 'foo',
+            'secret_key': 'bar',
+            'token': 'baz',
+            'expiry_time': expiring_in(seconds).isoformat(),
+            })
+        return refresh, RefreshableCredentials.create_from_metadata(
+                refresh(), refresh, 'assume-role')
+
+    def test_inject(self):
+        chain = mock.Mock()
+        session = mock.Mock()
+        session.get_component.return_value = chain
+        self.cache.inject(session)
+        chain.get_provider.assert_any_call('assume-role')
+        self.assertIs(chain.get_provider.return_value.cache,
+                      self.cache._cache)
+
+    def test_assume_once(self):
+        refresh, credentials = self.credentials(60 * 60)
+        session = mock.Mock()
+        session.get_credentials.return_value = credentials
+        self.assertFalse(self.cache.is_assumed('uno'))
+        self.cache.assume('uno', session)
+        self.assertTrue(self.cache.is_assumed('uno'))
+        self.assertAlmostEqual(credentials._advisory_refresh_timeout,
+                               15 * 60, delta=1)
+        self.assertEqual(credentials._mandatory_refresh_timeout, 10 * 60)
+        # Fresh credentials are not refreshed
+        time.sleep(0.05)
+        self.assertEqual(refresh.call_count, 1)
+        self.cache.discard('uno')
+        self.assertFalse(self.cache.is_assumed('uno'))
+
+    def test_refresh_ahead_of_expiration(self):
+        refresh, credentials = self.credentials(60 * 60)
+        session = mock.Mock()
+        session.get_credentials.return_value = credentials
+        self.cache.assume('uno', session)
+        self.assertEqual(refresh.call_count, 1)
+        credentials._expiry_time = expiring_in(14 * 60)
+        for _ in range(100):
+            if refresh.call_count > 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(refresh.call_count, 2)
+
+    def test_short_session_not_refreshed(self):
+        refresh, credentials = self.credentials(15 * 60)
+        session = mock.Mock()
+        session.get_credentials.return_value = credentials
+        self.cache.assume('uno', session)
+        self.assertAlmostEqual(credentials._advisory_refresh_timeout,
+                               15 * 60 / 4, delta=1)
+        self.assertEqual(credentials._mandatory_refresh_timeout,
+                         credentials._advisory_refresh_timeout)
+        call_count = refresh.call_count
+        time.sleep(0.05)
+        self.assertEqual(refresh.call_count, call_count)
+
+    def test_failed_assume(self):
+        session = mock.Mock()
+        session.get_credentials.side_effect = ClientError(
+                {'Error': {'Code': 'AccessDenied', 'Message': 'denied'}},
+                'AssumeRole')
+        with LogCapture(level=logging.WARNING) as logs:
+            self.cache.assume('uno', session)
+        self.assertIn('Failed to assume the role of uno profile',
+                      logs.records[-1].getMessage())
+        self.assertFalse(self.cache.is_assumed('uno'))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from testfixtures import LogCapture
+
+from tests._utils import _import, captured_output, check_logs
+executor = _import('bac', 'executor')
+store = _import('bac', 'store')
+
+ACCOUNT_NAMES = {'uno': 'account-uno', 'dos': 'account-dos'}
+
+
+def prepare_result(profile, region, exit_code=0, out='', err=''):
+    command = ['aws', 's3api', 'list-buckets', '--profile', profile,
+               '--region', region]
+    target = executor.Target(command, profile, region)
+    result = executor.TargetResult(target, exit_code, out, err)
+    result.started = 100.0
+    result.finished = 101.5
+    return result
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = store.ResultStore(
+                os.path.join(self.directory, 'bac', 'results.db'))
+
+    def record(self, command, results):
+        run = self.store.start_run('aws', command, ACCOUNT_NAMES)
+        for result in results:
+            run.add(result)
+        run.finish()
+        return run.run_id
+
+    def test_store_and_query(self):
+        first = self.record('aws s3api list-buckets', [
+                prepare_result('uno', 'us-east-1', out='{"Buckets": []}'),
+                prepare_result('dos', 'us-east-1', 255, err='Denied')])
+        second = self.record('aws ec2 describe-vpcs', [
+                prepare_result('uno', 'eu-west-1', out='{}')])
+
+        rows = self.store.get_results()
+        self.assertEqual([row['run_id'] for row in rows], [second])
+
+        rows = self.store.get_results(first)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['account'], 'account-uno')
+        self.assertEqual(rows[0]['out'], '{"Buckets": []}')
+        self.assertEqual(rows[0]['finished'] - rows[0]['started'], 1.5)
+
+        rows = self.store.get_results(first, failed=True)
+        self.assertEqual([row['profile'] for row in rows], ['dos'])
+        rows = self.store.get_results(first, account='account-uno',
+                                      region='us-east-1')
+        self.assertEqual([row['profile'] for row in rows], ['uno'])
+        rows = self.store.get_results(first, command='--profile dos')
+        self.assertEqual([row['exit_code'] for row in rows], [255])
+
+    def test_get_runs(self):
+        first = self.record('aws s3api list-buckets', [
+                prepare_result('uno', 'us-east-1'),
+                prepare_result('dos', 'us-east-1', 255)])
+        second = self.record('aws ec2 describe-vpcs', [])
+        runs = self.store.get_runs()
+        self.assertEqual([run['id'] for run in runs], [second, first])
+        self.assertEqual(runs[1]['targets'], 2)
+        self.assertEqual(runs[1]['failed'], 1)
+        self.assertEqual(runs[1]['command'], 'aws s3api list-buckets')
+        self.assertIsNotNone(runs[1]['finished'])
+        self.assertEqual(len(self.store.get_runs(1)), 1)
+
+    def test_list_runs_command(self):
+        self.record('aws s3api list-buckets', [
+                prepare_result('uno', 'us-east-1')])
+        with captured_output() as (out, err):
+            self.assertTrue(self.store.handle_command(
+                    'list-runs', ['list-runs']))
+        self.assertIn('aws s3api list-buckets', out.getvalue())
+        self.assertIn('1 targets', out.getvalue())
+
+    def test_query_results_command(self):
+        self.record('aws s3api list-buckets', [
+                prepare_result('uno', 'us-east-1', out='foo\nbar\n'),
+                prepare_result('dos', 'us-east-1', 255, err='Denied\n')])
+        with captured_output() as (out, err):
+            self.store.handle_command('query-results', ['query-results'])
+        self.assertEqual(out.getvalue(), '[uno/us-east-1] foo\n'
+                                         '[uno/us-east-1] bar\n')
+        self.assertEqual(err.getvalue(), '[dos/us-east-1] Denied\n')
+
+    def test_query_results_json(self):
+        run_id = self.record('aws s3api list-buckets', [
+                prepare_result('uno', 'us-east-1', out='{"Buckets": []}')])
+        self.record('aws ec2 describe-vpcs', [])
+        with captured_output() as (out, err):
+            self.store.handle_command(
+                    'query-results',
+                    ['query-results', str(run_id), '--format', 'json'])
+        records = json.loads(out.getvalue())
+        self.assertEqual(records[0]['account'], 'account-uno')
+        self.assertEqual(records[0]['output'], {'Buckets': []})
+
+    def test_unknown_command(self):
+        self.assertFalse(self.store.handle_command('foo', ['foo']))
+
+    def test_unavailable_store(self):
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        unavailable = store.ResultStore(os.path.join(path, 'results.db'))
+        with LogCapture(level=logging.ERROR) as captured_log:
+            self.assertIsNone(unavailable.start_run('aws', 'aws foo'))
+        check_logs(captured_log, 'bac.store', 'ERROR',
+                   'Results will not be stored')
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import argparse
+import unittest
+
+import mock
+
+from argparse import Namespace
+
+from tests._utils import _import
+executor = _import('bac', 'executor')
+throttling = _import('bac', 'throttling')
+
+THROTTLED = ('An error occurred (RequestLimitExceeded) when calling'
+             ' the DescribeInstances operation: Request limit exceeded.')
+
+
+def prepare_target(profile='uno', region='us-east-1', service='ec2'):
+    command = ['aws', service, 'describe-foo', '--profile', profile]
+    return executor.Target(command, profile, region)
+
+
+def prepare_result(target, exit_code=0, err='', duration=1.0):
+    result = executor.TargetResult(target, exit_code, '', err)
+    result.started = 0
+    result.finished = duration
+    return result
+
+
+class ParseRateLimitTest(unittest.TestCase):
+    def test_global_rate(self):
+        self.assertEqual(throttling.parse_rate_limit('10'), (None, 10.0))
+
+    def test_service_rate(self):
+        self.assertEqual(throttling.parse_rate_limit('ec2=0.5'),
+                         ('ec2', 0.5))
+
+    def test_invalid_rate(self):
+        for value in ('ec2', 'ec2=0', '-1', 'ec2=foo'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                throttling.parse_rate_limit(value)
+
+
+class IsThrottledTest(unittest.TestCase):
+    def test_throttled(self):
+        result = prepare_result(prepare_target(), 255, THROTTLED)
+        self.assertTrue(throttling.is_throttled(result))
+
+    def test_other_error(self):
+        result = prepare_result(prepare_target(), 255, 'AccessDenied')
+        self.assertFalse(throttling.is_throttled(result))
+
+    def test_success(self):
+        result = prepare_result(prepare_target(), 0, 'Throttling')
+        self.assertFalse(throttling.is_throttled(result))
+
+
+class TokenBucketTest(unittest.TestCase):
+    @mock.patch('bac.throttling.time.time')
+    def test_rate(self, time):
+        time.return_value = 100
+        bucket = throttling.TokenBucket(2)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.available())
+        self.assertFalse(bucket.consume())
+        time.return_value = 100.5
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        time.return_value = 110
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+    def test_decrease_on_throttling(self):
+        limit = throttling.AdaptiveLimit(8)
+        limit.update(True)
+        self.assertEqual(int(limit.limit), 4)
+        for _ in range(5):
+            limit.update(True)
+        self.assertEqual(int(limit.limit), 1)
+
+    def test_additive_increase(self):
+        limit = throttling.AdaptiveLimit(8)
+        limit.update(True)
+        limit.update(False)
+        self.assertEqual(int(limit.limit), 5)
+        for _ in range(10):
+            limit.update(False)
+        self.assertEqual(int(limit.limit), 8)
+
+    def test_decrease_on_latency(self):
+        limit = throttling.AdaptiveLimit(8)
+        limit.update(False, 1.0)
+        limit.update(False, 1.5)
+        self.assertEqual(int(limit.limit), 8)
+        limit.update(False, 10.0)
+        self.assertEqual(int(limit.limit), 4)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = throttling.RateLimiter(
+                {'ec2': 1}, 2, {'uno': 'account-uno'})
+
+    @mock.patch('bac.throttling.time.time', mock.Mock(return_value=100))
+    def test_rate_per_group(self):
+        first = prepare_target()
+        self.assertTrue(self.limiter.can_start(first))
+        self.limiter.start(first)
+        self.assertFalse(self.limiter.can_start(prepare_target()))
+        self.assertTrue(self.limiter.can_start(prepare_target('dos')))
+        self.assertTrue(self.limiter.can_start(
+                prepare_target(region='eu-west-1')))
+        self.assertTrue(self.limiter.can_start(
+                prepare_target(service='iam')))
+
+    def test_concurrency_shrinks_on_throttling(self):
+        limiter = throttling.RateLimiter({}, 2)
+        targets = [prepare_target(), prepare_target(), prepare_target()]
+        limiter.start(targets[0])
+        limiter.start(targets[1])
+        self.assertFalse(limiter.can_start(targets[2]))
+        limiter.finish(targets[0], prepare_result(targets[0], 255, THROTTLED))
+        self.assertFalse(limiter.can_start(targets[2]))
+        limiter.finish(targets[1], prepare_result(targets[1]))
+        self.assertTrue(limiter.can_start(targets[2]))
+
+    def test_from_args(self):
+        self.assertIsNone(throttling.RateLimiter.from_args(Namespace()))
+        args = Namespace(rate_limits=[(None, 5.0), ('ec2', 1.0)], workers=4)
+        limiter = throttling.RateLimiter.from_args(args)
+        self.assertEqual(limiter._rates, {None: 5.0, 'ec2': 1.0})
+        self.assertEqual(limiter._maximum, 4)
+
+    @mock.patch('bac.throttling.time.time', mock.Mock(return_value=100))
+    def test_from_args_keeps_state(self):
+        args = Namespace(rate_limits=[('ec2', 1.0)], workers=2)
+        limiter = throttling.RateLimiter.from_args(args)
+        target = prepare_target()
+        limiter.start(target)
+        limiter.finish(target, prepare_result(target, 255, THROTTLED))
+        args = Namespace(rate_limits=[('ec2', 1.0), ('iam', 2.0)], workers=4)
+        self.assertIs(
+                throttling.RateLimiter.from_args(args, limiter=limiter),
+                limiter)
+        self.assertEqual(limiter._rates, {'ec2': 1.0, 'iam': 2.0})
+        self.assertFalse(limiter.can_start(prepare_target()))
+        key = limiter._get_key(target)
+        self.assertEqual(limiter._limits[key].maximum, 4)
+        self.assertLess(limiter._limits[key].limit, 2)
+
+    @mock.patch('bac.throttling.time.time', mock.Mock(return_value=100))
+    def test_configure_replaces_changed_buckets(self):
+        target = prepare_target()
+        self.limiter.start(target)
+        self.assertFalse(self.limiter.can_start(prepare_target()))
+        self.limiter.configure({'ec2': 5}, 2)
+        self.assertTrue(self.limiter.can_start(prepare_target()))
+
+    def test_executor_respects_limiter(self):
+        limiter = throttling.RateLimiter({}, 1)
+        running = list()
+        peak = list()
+
+        def execute(target):
+            running.append(target)
+            peak.append(len(running))
+            running.remove(target)
+            return executor.TargetResult(target, 0)
+
+        targets = [prepare_target() for _ in range(4)]
+        fan_out = executor.FanOutExecutor(workers=4, limiter=limiter)
+        results = fan_out.run(targets, execute)
+        self.assertEqual(max(peak), 1)
+        self.assertEqual([r.exit_code for r in results], [0] * 4)
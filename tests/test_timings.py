@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright © 2020, GoodData(R) Corporation. All rights reserved.
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from tests._utils import _import
+executor = _import('bac', 'executor')
+timings = _import('bac', 'timings')
+
+
+def prepare_target(profile, region='us-east-1',
+                   command='aws ec2 describe-instances'):
+    return executor.Target(command.split() + ['--profile', profile,
+                                              '--region', region],
+                           profile, region)
+
+
+def prepare_result(target, duration, status=executor.TARGET_COMPLETED):
+    result = executor.TargetResult(target, 0, status=status)
+    result.started = 100.0
+    result.finished = 100.0 + duration
+    return result
+
+
+class TimingHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.history = timings.TimingHistory(
+                os.path.join(self.directory, 'bac', 'timings.db'))
+
+    def test_get_operation(self):
+        self.assertEqual(timings.get_operation(
+                ['aws', '--profile', 'uno', 'ec2', 'describe-instances',
+                 '--region', 'eu-west-1']), 'ec2 describe-instances')
+
+    def test_no_history(self):
+        targets = [prepare_target(p) for p in ('uno', 'dos', 'tres')]
+        self.assertEqual(self.history.get_estimates(targets),
+                         [None, None, None])
+        self.assertEqual(self.history.order(targets), [0, 1, 2])
+
+    def test_order_longest_first(self):
+        targets = [prepare_target(p) for p in ('uno', 'dos', 'tres', 'cuatro')]
+        self.history.record([prepare_result(targets[0], 1),
+                             prepare_result(targets[1], 10),
+                             prepare_result(targets[3], 3)])
+        # The target without history is expected to take the median time
+        self.assertEqual(self.history.order(targets), [1, 2, 3, 0])
+
+    def test_key(self):
+        target = prepare_target('uno')
+        self.history.record([prepare_result(target, 5)])
+        for other in (prepare_target('dos'),
+                      prepare_target('uno', 'eu-west-1'),
+                      prepare_target('uno', command='aws ec2 describe-vpcs')):
+            self.assertEqual(self.history.get_estimates([other]), [None])
+
+    def test_smoothing(self):
+        target = prepare_target('uno')
+        self.history.record([prepare_result(target, 10)])
+        self.history.record([prepare_result(target, 20)])
+        self.assertEqual(self.history.get_estimates([target]), [15])
+
+    def test_ignored_results(self):
+        target = prepare_target('uno')
+        cached = prepare_result(target, 0.1)
+        cached.cached = True
+        self.history.record([
+                None, cached, executor.TargetResult(target, 0),
+                prepare_result(target, 1, executor.TARGET_CANCELLED)])
+        self.assertEqual(self.history.get_estimates([target]), [None])
+
+    @mock.patch('bac.timings.TIMING_HISTORY_MAX_ENTRIES', 2)
+    def test_purge(self):
+        targets = [prepare_target(p) for p in ('uno', 'dos', 'tres', 'cuatro')]
+        now = time.time()
+        with mock.patch('time.time', return_value=now - 31 * 24 * 60 * 60):
+            self.history.record([prepare_result(targets[0], 1)])
+        self.assertEqual(self.history.get_estimates(targets[:1]), [1])
+        for index, target in enumerate(targets[1:]):
+            with mock.patch('time.time', return_value=now + index):
+                self.history.record([prepare_result(target, 1)])
+        # Outdated and the oldest entries above the maximum are purged
+        self.assertEqual(self.history.get_estimates(targets),
+                         [None, None, 1, 1])
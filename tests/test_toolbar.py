@@ -7,6 +7,7 @@ import mock
 from six import text_type
 
 from tests._utils import _import
+executor = _import('bac', 'executor')
 toolbar = _import('bac', 'toolbar')
 
 
@@ -89,3 +90,40 @@ class ToolbarTest(unittest.TestCase):
         expected = self._prepare_tb(top_tb, bottom_tb)
         result = self.toolbar.handler()
         self.assertEqual(expected, result.value)
+
+    def test_toolbar_progress(self):
+        progress = executor.FanOutProgress(
+                total=10, finished=4, failed=1, running=2, workers=2,
+                elapsed=8, latency=12, timed=4)
+        self.toolbar = toolbar.Toolbar(
+                lambda: self.bac._fuzzy,
+                lambda: self.bac._cache_completion,
+                lambda: self.bac._profile_manager.active_profiles,
+                lambda: self.bac._profile_manager.active_regions,
+                lambda: progress)
+        result = self.toolbar.handler()
+        self.assertEqual(result.value.splitlines()[1],
+                         'Targets: 4/10 (1 failed)   Running: 2/2'
+                         '   Rate: 0.5/s   ETA: 9s')
+
+    def test_toolbar_no_progress(self):
+        self.toolbar = toolbar.Toolbar(
+                lambda: self.bac._fuzzy,
+                lambda: self.bac._cache_completion,
+                lambda: self.bac._profile_manager.active_profiles,
+                lambda: self.bac._profile_manager.active_regions,
+                lambda: executor.FanOutProgress())
+        self.assertEqual(len(self.toolbar.handler().value.splitlines()), 2)
+
+    def test_toolbar_loading(self):
+        self.toolbar = toolbar.Toolbar(
+                lambda: self.bac._fuzzy,
+                lambda: self.bac._cache_completion,
+                lambda: self.bac._profile_manager.active_profiles,
+                lambda: self.bac._profile_manager.active_regions,
+                get_loading=lambda: ['accounts', 'regions'])
+        result = self.toolbar.handler()
+        self.assertEqual(result.value.splitlines()[0],
+                         'Active profiles: None'
+                         '   Active regions: default(us-east-1)'
+                         '   Loading: accounts, regions')
@@ -2,7 +2,10 @@ import datetime
 import logging
 import os
 import shlex
+import sqlite3
 import sys
+import threading
+import time
 import unittest
 
 import boto3
@@ -48,6 +51,33 @@ class UtilsTest(unittest.TestCase):
             assert os.path.exists(expected)
             self.assertEqual(p, expected)
 
+    def test_database(self):
+        connected = list()
+        with TempDirectory() as d:
+            path = os.path.join(d.path, 'bac', 'test.db')
+            database = utils.Database(
+                    path, 'CREATE TABLE IF NOT EXISTS t (v INTEGER);',
+                    connected.append)
+            with database as connection:
+                connection.execute('INSERT INTO t VALUES (1)')
+            with database as connection:
+                self.assertEqual(
+                        connection.execute('SELECT v FROM t').fetchone()[0],
+                        1)
+            self.assertEqual(len(connected), 1)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777,
+                             0o700)
+
+    def test_database_releases_lock_on_error(self):
+        with TempDirectory() as d:
+            database = utils.Database(os.path.join(d.path, 'test.db'),
+                                      'INVALID SQL')
+            for _ in range(2):
+                with self.assertRaises(sqlite3.Error):
+                    with database:
+                        pass
+
     def test_execute_command(self):
         cmd = shlex.split('echo "Hello world!"')
         out, err, exit_code = utils.execute_command(cmd)
@@ -59,6 +89,38 @@ class UtilsTest(unittest.TestCase):
         with self.assertRaises(errors.TimeoutException):
             utils.execute_command(cmd, timeout=1)
 
+    def test_execute_command_cancelled(self):
+        cancelled = threading.Event()
+        threading.Timer(0.2, cancelled.set).start()
+        cmd = shlex.split('sleep 5')
+        started = time.time()
+        with self.assertRaises(errors.CancelledException):
+            utils.execute_command(cmd, cancelled=cancelled)
+        self.assertLess(time.time() - started, 5)
+
+    def test_execute_command_new_session(self):
+        cmd = [sys.executable, '-c', 'import os; print(os.getsid(0))']
+        out, _, _ = utils.execute_command(cmd)
+        self.assertEqual(int(out), os.getsid(0))
+        out, _, _ = utils.execute_command(cmd, new_session=True)
+        self.assertNotEqual(int(out), os.getsid(0))
+
+    def test_call_command(self):
+        cmd = [sys.executable, '-c', 'import sys; sys.exit(3)']
+        self.assertEqual(utils.call_command(cmd, timeout=10), 3)
+
+    def test_call_command_timeout(self):
+        cmd = shlex.split('sleep 5')
+        with self.assertRaises(errors.TimeoutException):
+            utils.call_command(cmd, timeout=0.5)
+
+    def test_call_command_cancelled(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        cmd = shlex.split('sleep 5')
+        with self.assertRaises(errors.CancelledException):
+            utils.call_command(cmd, cancelled=cancelled)
+
     def test_paginate(self):
         config = botocore.config.Config(signature_version=botocore.UNSIGNED)
         ssm = boto3.client('ssm', config=config, region_name='us-east-1')
@@ -133,6 +195,36 @@ class UtilsTest(unittest.TestCase):
         actual = utils.extract_positional_args(command)
         self.assertEqual(actual, expected)
 
+    def test_get_global_region(self):
+        commands = {
+            'aws iam list-users': 'us-east-1',
+            'aws organizations list-accounts --profile uno': 'us-east-1',
+            'aws s3api list-buckets --region eu-west-1': 'us-east-1',
+            'aws s3 ls': 'us-east-1',
+            'aws s3 ls s3://foo': None,
+            'aws s3api list-objects --bucket foo': None,
+            'aws ec2 describe-instances': None,
+            'aws sts get-caller-identity': None,
+            'aws iam': None,
+            }
+        for command, region in commands.items():
+            self.assertEqual(utils.get_global_region(shlex.split(command)),
+                             region, command)
+
+    def test_is_read_only(self):
+        commands = {
+            'aws ec2 describe-instances': True,
+            'aws --profile uno iam list-users': True,
+            'aws s3api get-bucket-policy --bucket foo': True,
+            'aws s3 ls s3://foo': True,
+            'aws s3 cp foo s3://foo': False,
+            'aws ec2 terminate-instances --instance-ids i-1': False,
+            'aws ec2': False,
+            }
+        for command, read_only in commands.items():
+            self.assertEqual(utils.is_read_only(shlex.split(command)),
+                             read_only, command)
+
     def test_extract_profile(self):
         command = ['aws', 's3api', 'list-buckets', '--profile', 'uno']
         expected = 'uno'